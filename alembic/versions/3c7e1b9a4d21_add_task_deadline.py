@@ -0,0 +1,44 @@
+"""add deadline to tasks
+
+Revision ID: 3c7e1b9a4d21
+Revises: 0f821c0fce3e
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7e1b9a4d21'
+down_revision: Union[str, Sequence[str], None] = '0f821c0fce3e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add the optional `deadline` column and the EXPIRED task status.
+
+    The enum value is added with IF NOT EXISTS so re-running the migration
+    against a database that already has it does not fail.
+    """
+    op.execute("ALTER TYPE taskstatus ADD VALUE IF NOT EXISTS 'EXPIRED'")
+
+    op.add_column('tasks', sa.Column('deadline', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.create_index(
+        "ix_tasks_status_deadline",
+        "tasks",
+        ["status", "deadline"]
+    )
+
+
+def downgrade() -> None:
+    """Drop the `deadline` column.
+
+    Postgres cannot remove a single enum label, so EXPIRED stays in the
+    `taskstatus` type after a downgrade.
+    """
+    op.drop_index("ix_tasks_status_deadline", table_name="tasks")
+    op.drop_column('tasks', 'deadline')
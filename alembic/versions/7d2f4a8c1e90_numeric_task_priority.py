@@ -0,0 +1,61 @@
+"""numeric task priority
+
+Revision ID: 7d2f4a8c1e90
+Revises: 3c7e1b9a4d21
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f4a8c1e90'
+down_revision: Union[str, Sequence[str], None] = '3c7e1b9a4d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Convert `tasks.priority` from the low/high enum to an integer level 0-9.
+
+    Existing rows keep their Redis instance: 'low' becomes 2 and 'high' becomes 7.
+    """
+    # The old default is an enum literal and cannot be cast, drop it first
+    op.alter_column('tasks', 'priority', server_default=None)
+    op.alter_column('tasks', 'priority',
+               existing_type=postgresql.ENUM('low', 'high', name='prioritytype', create_type=False),
+               type_=sa.Integer(),
+               existing_nullable=False,
+               postgresql_using="CASE priority WHEN 'high' THEN 7 ELSE 2 END")
+    op.alter_column('tasks', 'priority', server_default=sa.text('2'))
+    op.create_check_constraint('ck_tasks_priority_range', 'tasks', 'priority BETWEEN 0 AND 9')
+
+    sa.Enum(name='prioritytype').drop(op.get_bind(), checkfirst=True)
+
+    # The scheduler runs one pass per priority level
+    op.create_index(
+        "ix_tasks_status_priority_scheduled_at",
+        "tasks",
+        ["status", "priority", "scheduled_at"]
+    )
+
+
+def downgrade() -> None:
+    """Fold the levels back into low/high using the Redis instance split (>= 5 is high)."""
+    op.drop_index("ix_tasks_status_priority_scheduled_at", table_name="tasks")
+    op.drop_constraint('ck_tasks_priority_range', 'tasks', type_='check')
+
+    priority_type = postgresql.ENUM('low', 'high', name='prioritytype')
+    priority_type.create(op.get_bind(), checkfirst=True)
+
+    op.alter_column('tasks', 'priority', server_default=None)
+    op.alter_column('tasks', 'priority',
+               existing_type=sa.Integer(),
+               type_=postgresql.ENUM('low', 'high', name='prioritytype', create_type=False),
+               existing_nullable=False,
+               postgresql_using="CASE WHEN priority >= 5 THEN 'high'::prioritytype ELSE 'low'::prioritytype END")
+    op.alter_column('tasks', 'priority', server_default=sa.text("'low'"))
@@ -0,0 +1,29 @@
+"""add cancelled task status
+
+Revision ID: 9b4e6f2a7c13
+Revises: 7d2f4a8c1e90
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b4e6f2a7c13'
+down_revision: Union[str, Sequence[str], None] = '7d2f4a8c1e90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add CANCELLED to the task status and the task event types."""
+    op.execute("ALTER TYPE taskstatus ADD VALUE IF NOT EXISTS 'CANCELLED'")
+    op.execute("ALTER TYPE eventtype ADD VALUE IF NOT EXISTS 'CANCELLED'")
+
+
+def downgrade() -> None:
+    """Postgres cannot remove a single enum label, CANCELLED stays in both types."""
+    pass
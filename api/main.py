@@ -1,12 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .routers import api_keys, auth, status, tasks, user
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 import sys
 
-app = FastAPI()
+# orjson renders response bodies several times faster than the stdlib encoder
+app = FastAPI(default_response_class=ORJSONResponse)
 
 origins = ["*"]
 
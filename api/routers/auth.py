@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends, status, HTTPException, Response
 from .. import oauth2, utils, schemas
-from core import models, database
+from core import models, database, codec
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from core.redis_client import get_redis
-import redis, json, logging 
+import redis, logging 
 from ..utils import cache_user_data, check_cache_user
 from ..rate_limiter import user_rate_limiter
 
@@ -34,7 +34,7 @@ def login(
             user = cached_user_data
         elif isinstance(cached_user_data, (str, bytes, bytearray)):
             # if it is a JSON string for some reason, decode it
-            user = json.loads(cached_user_data)
+            user = codec.decode(cached_user_data)
 
         if not utils.verify(user_credentials.password, user['password']):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
@@ -6,8 +6,11 @@ from sqlalchemy.orm import Session
 from .. import schemas
 from typing import List, Optional
 from ..rate_limiter import user_rate_limiter
-from core.redis_client import get_redis
-import redis, logging, shutil, os, uuid
+from core.redis_client import get_redis, get_redis_client
+from core.config import settings
+from core import result_store, cancellation, task_files, progress, profiles
+from fastapi.responses import StreamingResponse
+import redis, logging, os, uuid, statistics
 from datetime import datetime, timezone, timedelta
 
 logger = logging.getLogger(__name__)
@@ -25,12 +28,14 @@ def create_task(task: schemas.TaskCreate, db: Session=Depends(get_db),
                 current_user: models.User = Depends(get_current_user),
                 redis_client: redis.Redis = Depends(get_redis)):
     
-    # Validation: Check if the .py file actually exists before queueing
+    # Validation: Check if the .py file actually exists before queueing.
+    # Published files are known to Redis, older ones only to the shared volume.
     file_path = f"worker/tasks/{task.title}.py"
-    if not os.path.exists(file_path):
+    if not redis_client.exists(task_files.current_key(task.title)) and not os.path.exists(file_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Task logic file '{task.title}.py' not found. Please upload it first."
+            detail=f"Task logic file '{task.title}.py' not found. Please upload it first "
+                   "(an upload can be used once it passed validation)."
         )
 
     # Salt the payload with a UUID
@@ -38,21 +43,35 @@ def create_task(task: schemas.TaskCreate, db: Session=Depends(get_db),
         "data": task.payload,
         "_run_id": str(uuid.uuid4())
     }
+    if task.limits:
+        salted_payload["_limits"] = task.limits.model_dump(exclude_none=True)
 
     # Calculate scheduling
     schedule_time = task.scheduled_at  
     scheduled_for = datetime.now(timezone.utc) + timedelta(minutes=schedule_time)
 
+    deadline = None
+    if task.deadline is not None:
+        deadline = datetime.now(timezone.utc) + timedelta(minutes=task.deadline)
+        if deadline <= scheduled_for:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Deadline must be later than the scheduled time"
+            )
+
     # Create the task in Database
     new_task = models.Tasks(
         title=task.title,
         payload=salted_payload, 
         priority=task.priority,
         scheduled_at=scheduled_for,                    
+        deadline=deadline,
         owner_id=current_user.id
     )
 
     db.add(new_task)
+    # written in the same transaction, no extra round trip
+    db.add(models.TaskEvents(task=new_task, event_type=models.EventType.CREATED))
     db.commit()
     db.refresh(new_task)
 
@@ -103,11 +122,196 @@ def get_a_task(task_id: int, db: Session=Depends(get_db),
         return task
 
 
+# Statuses a task never leaves, there is nothing left to cancel
+FINAL_STATUSES = {
+    models.TaskStatus.COMPLETED, models.TaskStatus.FAILED,
+    models.TaskStatus.EXPIRED, models.TaskStatus.CANCELLED,
+}
+
+@router.post("/{task_id}/cancel", status_code=status.HTTP_202_ACCEPTED,
+             dependencies = [Depends(user_rate_limiter)])
+def cancel_task(task_id: int, db: Session=Depends(get_db),
+                current_user: models.User = Depends(get_current_user),
+                redis_client: redis.Redis = Depends(get_redis)):
+    """
+    Cancel a task that has not finished yet.
+    A task that is still waiting is marked CANCELLED right away and never runs.
+    A running task is stopped by its worker (async handlers are cancelled, handlers
+    in the process pool are killed), which then records CANCELLED itself.
+    """
+    task = db.query(models.Tasks).filter(
+        models.Tasks.id == task_id,
+        models.Tasks.owner_id == current_user.id
+    ).with_for_update().first()
+
+    if task == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Task with id: {task_id} not found")
+
+    if task.status in FINAL_STATUSES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Task {task_id} already finished with status {task.status.value}")
+
+    # Marker first, so a worker claiming the task from now on drops it
+    try:
+        cancellation.request_cancel(redis_client, task_id)
+    except redis.RedisError as e:
+        logger.error(f"Failed to publish cancel of task {task_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Could not reach the workers, try again")
+
+    if task.status == models.TaskStatus.IN_PROGRESS:
+        db.commit()
+        return {"message": f"Cancellation of running task {task_id} requested",
+                "status": task.status.value}
+
+    task.status = models.TaskStatus.CANCELLED
+    task.updated_at = datetime.now(timezone.utc)
+    db.add(models.TaskEvents(task_id=task.id, event_type=models.EventType.CANCELLED,
+                             message=f"Cancelled by {current_user.username}"))
+    db.commit()
+    return {"message": f"Task {task_id} cancelled", "status": task.status.value}
+
+
+@router.get("/{task_id}/result", dependencies = [Depends(user_rate_limiter)])
+def get_task_result(task_id: int, db: Session=Depends(get_db),
+                    current_user: models.User = Depends(get_current_user)):
+    """
+    Returns the value returned by the task's handler as JSON.
+    Large results are streamed from the result store in chunks instead of being
+    loaded into memory. Results are kept for RESULT_TTL_SECONDS after the task completes.
+    """
+    task = db.query(models.Tasks).filter(
+        models.Tasks.id == task_id,
+        models.Tasks.owner_id == current_user.id
+    ).first()
+
+    if task == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Task with id: {task_id} not found")
+
+    if task.status != models.TaskStatus.COMPLETED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Task {task_id} has no result, its status is {task.status.value}")
+
+    entry = result_store.get_result(get_redis_client("low"), task_id)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Result of task {task_id} has expired or was not stored")
+
+    headers = {"X-Result-Size": entry["size"]}
+    if entry["kind"] == "file":
+        return StreamingResponse(result_store.iter_result_file(entry["path"]),
+                                 media_type="application/json", headers=headers)
+    return Response(content=entry["data"], media_type="application/json", headers=headers)
+
+
+@router.get("/{task_id}/progress", response_model=schemas.TaskProgress,
+            dependencies = [Depends(user_rate_limiter)])
+def get_task_progress(task_id: int, db: Session=Depends(get_db),
+                      current_user: models.User = Depends(get_current_user)):
+    """
+    Returns the last progress reported by the task's handler. Meant for polling:
+    it reads one Redis hash and only the owner of the task from the database.
+    """
+    owner_id = db.query(models.Tasks.owner_id).filter(models.Tasks.id == task_id).scalar()
+    if owner_id is None or owner_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Task with id: {task_id} not found")
+
+    try:
+        entry = progress.get_progress(get_redis_client("low"), task_id) or {}
+    except redis.RedisError as e:
+        logger.error(f"Failed to read progress of task {task_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Progress is temporarily unavailable")
+
+    updated_at = entry.get("updated_at")
+    return schemas.TaskProgress(
+        task_id=task_id,
+        done=entry.get("done"),
+        total=entry.get("total"),
+        message=entry.get("message"),
+        updated_at=datetime.fromtimestamp(float(updated_at), timezone.utc) if updated_at else None,
+    )
+
+
+@router.get("/validation_status/{validation_id}", response_model=schemas.TaskFileValidation,
+            dependencies = [Depends(user_rate_limiter)])
+def get_validation_status(validation_id: str,
+                          current_user: models.User = Depends(get_current_user),
+                          redis_client: redis.Redis = Depends(get_redis)):
+    """
+    Outcome of the validation of an upload, by the `validation_id` returned by
+    `POST /tasks/upload_file`: PENDING, RUNNING, VALIDATED or REJECTED (with the
+    reason in `message`). Records expire after VALIDATION_STATUS_TTL_SECONDS.
+    """
+    try:
+        record = task_files.get_validation(redis_client, validation_id)
+    except redis.RedisError as e:
+        logger.error(f"Failed to read validation {validation_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Validation status is temporarily unavailable")
+    if record is None or int(record.get("owner_id", 0)) != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Validation {validation_id} not found")
+
+    def timestamp(name):
+        value = record.get(name)
+        return datetime.fromtimestamp(float(value), timezone.utc) if value else None
+
+    return schemas.TaskFileValidation(
+        validation_id=validation_id,
+        title=record["title"],
+        status=record["status"],
+        message=record.get("message"),
+        created_at=timestamp("created_at"),
+        finished_at=timestamp("finished_at"),
+        duration_ms=record.get("duration_ms"),
+        payloads_run=record.get("payloads_run"),
+        promoted=bool(int(record["promoted"])) if "promoted" in record else None,
+    )
+
+
+@router.get("/profiles/{title}", response_model=schemas.TaskProfiles,
+            dependencies = [Depends(user_rate_limiter)])
+def get_task_profiles(title: str, limit: int = Query(20, ge=1, le=100),
+                      current_user: models.User = Depends(get_current_user)):
+    """
+    The last `limit` profiles of a task file, newest first: wall and CPU time,
+    peak traced memory and the lines holding the most memory, for the fraction
+    of runs set by PROFILE_SAMPLE_RATE. The summary covers the returned profiles.
+    """
+    try:
+        entries = profiles.get_profiles(get_redis_client("low"), title, limit)
+    except redis.RedisError as e:
+        logger.error(f"Failed to read profiles of '{title}': {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Profiles are temporarily unavailable")
+
+    for entry in entries:
+        entry["recorded_at"] = datetime.fromtimestamp(entry["recorded_at"], timezone.utc)
+    wall = [e["wall_ms"] for e in entries]
+    cpu = [e["cpu_ms"] for e in entries if e.get("cpu_ms") is not None]
+    memory = [e["peak_memory_kb"] for e in entries if e.get("peak_memory_kb") is not None]
+    return schemas.TaskProfiles(
+        title=title,
+        sample_rate=settings.PROFILE_SAMPLE_RATE,
+        count=len(entries),
+        wall_ms_p50=statistics.median(wall) if wall else None,
+        wall_ms_max=max(wall, default=None),
+        cpu_ms_p50=statistics.median(cpu) if cpu else None,
+        peak_memory_kb_max=max(memory, default=None),
+        profiles=entries,
+    )
+
+
 @router.delete("/delete_file", status_code=status.HTTP_200_OK,
                dependencies=[Depends(user_rate_limiter)])
 async def delete_task_file(
     file_name: str = Query(..., description="The name of the task file to delete", min_length=1),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis)
 ):
     """
     Delete a task file from the shared PVC volume.
@@ -118,10 +322,12 @@ async def delete_task_file(
     - **file_name**: The name/title of the task file to delete (without .py extension)
     ### Response:
     - **200 OK**: File successfully deleted from PVC (affects all pods)
+    - **400 Bad Request**: Not a valid title
     - **404 Not Found**: File doesn't exist
     - **500 Internal Server Error**: Failed to delete the file
     """
     logger.info(f"Delete file request for: {file_name} by user: {current_user.username}")
+    _check_file_name(file_name)
     file_path = os.path.join(UPLOAD_DIR, f"{file_name}.py")
     
     # Check if file exists
@@ -133,6 +339,7 @@ async def delete_task_file(
     
     # Delete the file
     try:
+        task_files.unpublish_task_file(redis_client, file_name)
         os.remove(file_path)
         logger.info(f"User {current_user.username} deleted task file: {file_name}.py from shared PVC")
         return {"message": f"Task file '{file_name}.py' deleted successfully from all pods"}
@@ -181,18 +388,60 @@ def delete_task(task_id: int, db: Session=Depends(get_db),
 UPLOAD_DIR = "/app/worker/tasks"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+
+def _check_file_name(file_name: str):
+    if not task_files.is_valid_title(file_name):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=task_files.INVALID_TITLE)
+
+
+def _stage_for_validation(file_name: str, source: bytes, digest: str, owner_id: int,
+                          redis_client: redis.Redis) -> str:
+    validation_id = uuid.uuid4().hex
+    staged_path = os.path.join(settings.UPLOAD_STAGING_DIR, f"{validation_id}.py")
+    try:
+        os.makedirs(settings.UPLOAD_STAGING_DIR, exist_ok=True)
+        # not readable by the sandboxes, which run under another uid
+        with open(os.open(staged_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as buffer:
+            buffer.write(source)
+    except OSError as e:
+        logger.error(f"Staging upload failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to save the task file"
+        )
+
+    try:
+        task_files.request_validation(
+            redis_client, validation_id, file_name, digest, owner_id, staged_path,
+            settings.TASK_VALIDATION_QUEUE_NAME, settings.VALIDATION_STATUS_TTL_SECONDS,
+        )
+    except redis.RedisError as e:
+        os.remove(staged_path)
+        logger.error(f"Failed to queue validation of task file {file_name}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to queue the task file for validation, please upload it again"
+        )
+    return validation_id
+
+
 # file_name: Uses a Query parameter. The user will call it like ?file_name=p1
 @router.post("/upload_file", status_code=status.HTTP_201_CREATED, 
              dependencies=[Depends(user_rate_limiter)])
 async def upload_task_file(
+    response: Response,
     file_name: str = Query(..., description="The title that will be used to trigger this code"),
     file: UploadFile = File(...), 
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis)
 ):
     """
     Upload a Python script to be executed as a dynamic task.
     This endpoint allows users to upload custom business logic that the worker 
-    cluster will execute. The uploaded file is stored in a shared volume.
+    cluster will execute. The file is checked and compiled here, then staged and
+    queued for the validator, which imports it in a sandbox and runs the
+    handler on the file's optional `VALIDATION_PAYLOADS` list. Only a file that
+    passes is published to Redis for the workers and kept in the shared volume.
 
     ### Task Script Protocol:
     The uploaded `.py` file **MUST** contain an `async def handler(payload: dict)` 
@@ -203,19 +452,29 @@ async def upload_task_file(
     async def handler(payload):
         return {"result": f"Processed {payload.get('data')}"}
     ```
+    A file may also define `handler_batch(payloads: list)` returning one result
+    per payload; workers then run tasks of this title in batches.
+    Optional `init()` and `teardown(context)` hooks run once per worker process
+    and file version; handlers that take a `context` argument get what init returned.
     ### Parameters:
     - **file_name**: The title/identifier. This name must be used as the `title` 
       when creating a task via `POST /tasks/`.
     - **file**: A `.py` file containing the task logic.
     ### Response:
-    - **201 Created**: File successfully saved to the shared volume.
-    - **400 Bad Request**: If the file extension is not `.py`.
+    - **202 Accepted**: File staged for validation. The body holds the
+      `validation_id` to poll with `GET /tasks/validation_status/{validation_id}`.
+    - **201 Created**: File published right away (TASK_VALIDATION_ENABLED off).
+    - **400 Bad Request**: If the title contains `/`, `\\` or `..` or starts with `.`,
+      the file extension is not `.py`, the file does not parse or does not define
+      a top-level `handler`.
     - **429 Too Many Requests**: If the user exceeds the rate limit.
     - **500 Internal Server Error**: If there is a filesystem or storage error.
+    - **503 Service Unavailable**: If the file could not be queued or published to Redis.
     ### Cleanup:
     Note: In this FaaS model, the logic file is automatically deleted from 
     the server after the task has been successfully executed or has failed.
     """
+    _check_file_name(file_name)
     # Validation: Only allow Python files
     if not file.filename.endswith(".py"):
         raise HTTPException(
@@ -223,6 +482,25 @@ async def upload_task_file(
             detail="Only .py files are allowed"
         )
 
+    # Reject files that cannot run now instead of failing every task later
+    source = await file.read()
+    try:
+        digest, code = task_files.compile_task_file(file_name, source)
+    except task_files.TaskFileError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid task file: {e}"
+        )
+
+    if settings.TASK_VALIDATION_ENABLED:
+        validation_id = _stage_for_validation(file_name, source, digest, current_user.id, redis_client)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "message": f"Logic for task '{file_name}' received and queued for validation",
+            "validation_id": validation_id,
+            "status": task_files.VALIDATION_PENDING,
+        }
+
     # Define the path: Use task_title as the unique filename
     # This ensures the worker knows exactly which file to look for by title
     file_path = os.path.join(UPLOAD_DIR, f"{file_name}.py")
@@ -230,17 +508,32 @@ async def upload_task_file(
     # Check if file already exists
     file_exists = os.path.exists(file_path)
 
-    # Save the file to the shared volume
+    # Save the file to the shared volume. Write to a temp file and rename it into
+    # place so workers never read a half written file and every upload gets a new
+    # inode, which is what their handler cache uses to detect a new version.
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with open(tmp_path, "wb") as buffer:
+            buffer.write(source)
+        os.replace(tmp_path, file_path)
     except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         logger.error(f"Upload failed: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail="Failed to save the task file"
         )
 
+    try:
+        task_files.publish_task_file(redis_client, file_name, source, code, digest)
+    except redis.RedisError as e:
+        logger.error(f"Failed to publish task file {file_name}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to publish the task file, please upload it again"
+        )
+
     if file_exists:
         return {"message": f"Logic for task '{file_name}' updated successfully (overwrote existing file)"}
     else:
@@ -1,7 +1,9 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime 
-from typing import Optional
+from typing import List, Optional
 from core.models import TaskStatus
+from core.queues import DEFAULT_PRIORITY, normalize_priority
+from core.task_files import INVALID_TITLE, is_valid_title
 
 # ===================== SCHEMAS RELATED TO USERS ==================================
 
@@ -40,11 +42,33 @@ class Token_data(BaseModel):
 class TaskBase(BaseModel):
     title: str
 
+    @field_validator("title")
+    @classmethod
+    def check_title(cls, value):
+        if not is_valid_title(value):
+            raise ValueError(INVALID_TITLE)
+        return value
+
+# Limits for a single task, applied when sync handlers run in the process pool
+class ResourceLimits(BaseModel):
+    memory_mb: Optional[int] = Field(None, gt=0)
+    cpu_seconds: Optional[int] = Field(None, gt=0)
+    open_files: Optional[int] = Field(None, gt=0)
+
 class TaskCreate(TaskBase):
     payload: str
-    priority: Optional[str] = "low"
+    # level 0 (backfill) to 9 (interactive), "low" and "high" are still accepted
+    priority: int = DEFAULT_PRIORITY
     scheduled_at: int
-    pass 
+    # minutes from now after which the task is no longer worth running
+    deadline: Optional[int] = Field(None, gt=0)
+    # overrides the task file's RESOURCE_LIMITS and the worker defaults
+    limits: Optional[ResourceLimits] = None
+
+    @field_validator("priority", mode="before")
+    @classmethod
+    def check_priority(cls, value):
+        return normalize_priority(value)
 
 class TaskUpdate(TaskBase):
     pass
@@ -54,12 +78,68 @@ class TaskResponse(BaseModel):
     id: int
     title: str
     status: TaskStatus
+    priority: int
     created_at: datetime
     owner_id: int
     scheduled_at: datetime
+    deadline: Optional[datetime] = None
     class Config:
         from_attributes = True
 
+# Last progress reported by a running handler, all None until it reports
+class TaskProgress(BaseModel):
+    task_id: int
+    done: Optional[float] = None
+    total: Optional[float] = None
+    message: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+
+# Line of a task file holding memory at the end of a profiled run
+class AllocationSite(BaseModel):
+    file: str
+    line: int
+    size_kb: float
+    count: int
+
+
+# One sampled run of a task, see core/profiles.py
+class TaskRunProfile(BaseModel):
+    task_id: int
+    worker_id: str
+    recorded_at: datetime
+    ok: bool
+    wall_ms: float
+    cpu_ms: Optional[float] = None
+    peak_memory_kb: Optional[float] = None
+    isolated: bool
+    top_allocations: List[AllocationSite] = []
+
+
+# Recent profiles of a task file, newest first, with a summary over them
+class TaskProfiles(BaseModel):
+    title: str
+    sample_rate: float
+    count: int
+    wall_ms_p50: Optional[float] = None
+    wall_ms_max: Optional[float] = None
+    cpu_ms_p50: Optional[float] = None
+    peak_memory_kb_max: Optional[float] = None
+    profiles: List[TaskRunProfile]
+
+
+# Outcome of the sandbox check of an uploaded task file
+class TaskFileValidation(BaseModel):
+    validation_id: str
+    title: str
+    status: str
+    message: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[float] = None
+    payloads_run: Optional[int] = None
+    promoted: Optional[bool] = None
+
 
 # ============ API KEY SCHEMAS =================
 
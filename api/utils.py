@@ -1,6 +1,7 @@
 from passlib.context import CryptContext
 import hashlib
 import redis, json
+from core import codec
 import logging
 from datetime import datetime
 
@@ -63,7 +64,7 @@ def cache_user_data(redis_client: redis.Redis, user: dict):
         "password": user['password']
     }
 
-    redis_client.setex(f"user:profile:{user['id']}", 3600, json.dumps(user_data))
+    redis_client.setex(f"user:profile:{user['id']}", 3600, codec.encode(user_data))
     logger.info(f"Cached user data for user_id: {user['id']}")
 
 
@@ -91,7 +92,7 @@ def check_cache_user(redis_client: redis.Redis, identifier_or_id: str):
         user_data = redis_client.get(user_profile_key)
         if user_data:
             logger.info(f"Cache hit for {identifier_or_id}")
-            return json.loads(user_data)
+            return codec.decode(user_data)
 
     logger.info(f"Cache miss for {identifier_or_id}")
     return None  # Cache miss
@@ -115,7 +116,7 @@ def cache_api_key(redis_client: redis.Redis, api_key_data: dict, ttl: int=3600):
         "user": api_key_data['user']
     }
     redis_client.setex(f"user:profile:api_key:{api_key_data['api_key']}", ttl, 
-                       json.dumps(api_key_cache))
+                       codec.encode(api_key_cache))
     logger.info(f"Cached api key details for the user with id:{api_key_cache['owner_id']}")
 
 
@@ -126,7 +127,7 @@ def check_cache_api(redis_client: redis.Redis, check_key: str):
     user_data = redis_client.get(check_key)
     if user_data:
         logger.info(f"Cache HIT for {check_key}")
-        return json.loads(user_data)
+        return codec.decode(user_data)
 
     logger.info(f"Cache MISS for {check_key}")
     return None  # Cache miss
@@ -171,7 +172,7 @@ def cache_task(redis_client: redis.Redis, task_data: dict):
 
     task_key = f"task:{hash_val}"
 
-    redis_client.setex(task_key, 3600, json.dumps(task_data))
+    redis_client.setex(task_key, 3600, codec.encode(task_data))
     logger.info(f"Cached task detils for the user:{task_data['owner_id']}")
 
 
@@ -187,7 +188,7 @@ def check_cache_task(redis_client: redis.Redis, task_title: str, owner_id: int,
     cached_task_data = redis_client.get(task_key)
     if cached_task_data:
         logger.info(f"Cache HIT for the key:{task_key}")
-        return json.loads(cached_task_data)
+        return codec.decode(cached_task_data)
     else:
         logger.info(f"Cache MISS for the key:{task_key}")
         return None
\ No newline at end of file
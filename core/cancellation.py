@@ -0,0 +1,27 @@
+"""
+Task cancellation signals shared by the API and the workers.
+
+The API publishes the task id on CANCEL_CHANNEL, every worker is subscribed and
+the one running the task stops it. Because a pub/sub message only reaches workers
+that are subscribed at that moment, the API also sets a marker key that workers
+check before they start a task, so a cancelled task that is still queued, or is
+claimed while the message is in flight, is dropped instead of run.
+Both live on the high-priority Redis instance.
+"""
+import redis
+
+CANCEL_CHANNEL = "taskflow:cancel"
+# long enough to outlive any queued or retried copy of the message
+CANCEL_MARKER_TTL_SECONDS = 86400
+
+
+def cancel_marker_key(task_id: int) -> str:
+    return f"task:{task_id}:cancelled"
+
+
+def request_cancel(redis_client: redis.Redis, task_id: int) -> int:
+    """Marks the task cancelled and notifies the workers. Returns how many workers got the message."""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(cancel_marker_key(task_id), 1, ex=CANCEL_MARKER_TTL_SECONDS)
+    pipe.publish(CANCEL_CHANNEL, task_id)
+    return pipe.execute()[1]
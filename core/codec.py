@@ -0,0 +1,77 @@
+"""
+Wire format of the messages TaskFlow passes through Redis: task messages on the
+queues and leases, and the user, API key and task entries cached by the API.
+
+An encoded message is a version byte followed by its body, so producers can
+change format while consumers still read the old one:
+
+- "\\x01" + orjson: written when MESSAGE_CODEC is "orjson" (default)
+- no version byte, stdlib json: written when MESSAGE_CODEC is "json", and by
+  releases before the version byte existed
+
+`decode` reads both. Every body is JSON, so the lease script in worker/main.py
+can still read a message's task id with cjson once it skips the version byte.
+When upgrading a cluster whose workers do not know the version byte yet, deploy
+with MESSAGE_CODEC=json first and switch once every consumer runs this module.
+
+A binary format (msgpack) would save a little more but does not fit here: all
+Redis clients use decode_responses=True and the Lua scripts decode JSON.
+"""
+import json
+from typing import Any, Callable, Dict, Union
+
+import orjson
+
+from .config import settings
+
+VERSION_ORJSON = "\x01"
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _dumps_orjson(obj: Any) -> str:
+    return VERSION_ORJSON + orjson.dumps(obj, option=_ORJSON_OPTIONS).decode()
+
+
+def _dumps_json(obj: Any) -> str:
+    return json.dumps(obj)
+
+
+# MESSAGE_CODEC name -> encoder
+_ENCODERS: Dict[str, Callable[[Any], str]] = {
+    "orjson": _dumps_orjson,
+    "json": _dumps_json,
+}
+# version byte -> decoder of the body after it
+_DECODERS: Dict[str, Callable[[Union[str, bytes]], Any]] = {
+    VERSION_ORJSON: orjson.loads,
+}
+
+
+def encode(obj: Any) -> str:
+    """Encodes a message in the format selected by MESSAGE_CODEC."""
+    try:
+        return _ENCODERS[settings.MESSAGE_CODEC](obj)
+    except orjson.JSONEncodeError:
+        # e.g. integers beyond 64 bits, which only the stdlib encoder handles
+        return _dumps_json(obj)
+
+
+def decode(raw: Union[str, bytes]) -> Any:
+    """Decodes a message written by `encode` in any format, or by plain json.dumps."""
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode()
+    decoder = _DECODERS.get(raw[:1])
+    if decoder is not None:
+        return decoder(raw[1:])
+    return json.loads(raw)
+
+
+def to_json(obj: Any, default: Callable[[Any], Any] = None) -> bytes:
+    """
+    Plain JSON without a version byte, for documents returned to clients as is
+    (task results). `default` is called for objects neither encoder supports.
+    """
+    try:
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, default=default).encode()
@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -26,12 +27,75 @@ class Settings(BaseSettings):
     LOCKOUT_DURATION_SECONDS: int
 
     HEARTBEAT_INTERVAL_SECONDS: int
+    HEARTBEAT_TTL_SECONDS: int = 0  # a worker is taken for dead this long after its last heartbeat, 0 = three intervals
     USER_RATE_LIMIT_PER_HOUR: int
 
+    # worker tuning
+    WORKER_PROCESSES: int = 1  # worker processes started by worker.supervisor in one pod
+    WORKER_CONCURRENCY: int = 4  # tasks a single worker process runs at the same time
+    WORKER_PREFETCH_COUNT: int = 8  # most messages claimed in one Redis round trip
+    WORKER_LEASE_SECONDS: int = 30  # a claimed task is requeued if its worker stops renewing it this long
+    WORKER_MAX_TASKS: int = 0  # a worker process drains and is replaced after this many tasks, 0 = never
+    WORKER_MAX_RSS_MB: int = 0  # ... or once its resident memory is above this, 0 = never
+    WORKER_METRICS_INTERVAL_SECONDS: int = 15  # how often a worker publishes worker:{id}:metrics
+    WORKER_HIGH_LOW_RATIO: int = 4  # high messages served per low one when both wait, 0 = strict
+    DRAIN_GRACE_SECONDS: int = 25  # on SIGTERM, how long in-flight tasks may finish before they are handed back
+    HANDLER_EXECUTOR: str = "thread"  # "thread" or "process" for sync handlers
+    HANDLER_PROCESS_MAX_TASKS: int = 50  # tasks a pool process runs before it is replaced
+    # default limits of handlers in the process pool, 0 = unlimited
+    HANDLER_MAX_MEMORY_MB: int = 0  # address space a handler may add to its process, capped to fit the pod
+    HANDLER_MAX_CPU_SECONDS: int = 0
+    HANDLER_MAX_OPEN_FILES: int = 0
+    TASK_CACHE_DIR: str = "/tmp/taskflow/code"  # node-local cache of published task file code
+    TASK_FILE_VERSION_TTL_MS: int = 1000  # how long a worker reuses its lookup of a title's current version
+    TASK_BATCH_MAX_SIZE: int = 100  # most tasks passed to one handler_batch call, a task file can set BATCH_MAX_SIZE
+    TASK_BATCH_MAX_WAIT_MS: int = 50  # how long a batch waits to fill up before it runs anyway
+    PROGRESS_FLUSH_INTERVAL_MS: int = 500  # a task's progress is written to Redis at most this often
+    # sampled profiling of task runs, see worker/profiling.py
+    PROFILE_SAMPLE_RATE: float = 0.0  # fraction of tasks profiled (0.01 = 1%), 0 = off
+    PROFILE_TOP_ALLOCATIONS: int = 10  # allocation sites kept per profile
+    PROFILE_HISTORY_SIZE: int = 100  # profiles kept per task file
+    PROFILE_TTL_SECONDS: int = 7 * 86400  # profiles of a task file expire this long after the last one
+    # validation of uploaded task files by worker.validator before workers see them
+    TASK_VALIDATION_ENABLED: bool = True  # False publishes uploads right away, without a validator
+    UPLOAD_STAGING_DIR: str = "/app/staging"  # shared by API and validator, never inside the tasks directory
+    TASK_VALIDATION_QUEUE_NAME: str = "task_validation_queue"
+    VALIDATOR_CONCURRENCY: int = 4  # uploads one validator checks at a time, each in its own sandbox
+    VALIDATION_TIMEOUT_SECONDS: int = 10  # wall clock limit of one sandbox run
+    # limits of a sandbox process, 0 = unlimited
+    VALIDATION_MAX_MEMORY_MB: int = 512  # address space
+    VALIDATION_MAX_CPU_SECONDS: int = 5
+    VALIDATION_MAX_OPEN_FILES: int = 64
+    VALIDATION_SANDBOX_UID: int = 65534  # sandboxes run as this uid and gid (nobody), -1 keeps the validator's
+    VALIDATION_STATUS_TTL_SECONDS: int = 86400  # how long taskfile:validation:{id} can be queried
+    WORKER_EVENT_LOOP: str = "asyncio"  # "asyncio" or "uvloop"
+    MESSAGE_CODEC: str = "orjson"  # format of new queue messages and API cache entries: "orjson" or "json"
+    STATUS_FLUSH_INTERVAL_MS: int = 5  # how long status changes are collected before one batched UPDATE
+    STATUS_FLUSH_MAX_BATCH: int = 500  # most rows written per status UPDATE
+
+    # task events (audit trail)
+    EVENT_FLUSH_INTERVAL_MS: int = 200  # how long events are buffered before one multi-row INSERT
+    EVENT_FLUSH_MAX_BATCH: int = 1000  # most events written per INSERT
+    EVENT_BUFFER_MAX: int = 50000  # events kept in memory while the DB is unavailable, newer ones are dropped
+
+    # task results
+    RESULT_STORE_DIR: str = "/app/results"  # large results are written here, shared by API and workers
+    RESULT_INLINE_MAX_BYTES: int = 256 * 1024  # results up to this size are kept in Redis
+    RESULT_TTL_SECONDS: int = 86400  # how long results can be fetched
+
     model_config = SettingsConfigDict(
         env_file=".env",
         extra="ignore",       # Ignores extra variables in .env
         case_sensitive=False  # Allows matching 'database_url' to 'DATABASE_URL'
     )
 
+    @model_validator(mode="after")
+    def _heartbeat_ttl(self):
+        if self.HEARTBEAT_TTL_SECONDS == 0:
+            self.HEARTBEAT_TTL_SECONDS = 3 * self.HEARTBEAT_INTERVAL_SECONDS
+        elif self.HEARTBEAT_TTL_SECONDS <= self.HEARTBEAT_INTERVAL_SECONDS:
+            # the heartbeat would expire between two beats and live workers look dead
+            raise ValueError("HEARTBEAT_TTL_SECONDS must be longer than HEARTBEAT_INTERVAL_SECONDS")
+        return self
+
 settings = Settings()
\ No newline at end of file
@@ -1,43 +1,90 @@
+"""
+Engines and session factories. They are created on first use, not at import:
+a process that never talks to the database (the validator, the supervisor) or
+only uses one of the engines does not pay for the other, and the worker can
+create its async engine while it connects to Redis instead of before it.
+
+`from core.database import SessionLocal` still works, it just creates the
+engine at that point; modules on the worker's startup path import the module
+and look the attribute up when they need it (`database.AsyncSessionLocal()`).
+"""
+import threading
+from uuid import uuid4
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 
 SQLALCHEMY_DATABASE_URL = str(settings.DATABASE_URL)
+ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True  # Checks connection health before query
-)
+Base = declarative_base()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+def _create_engine():
+    return create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_pre_ping=True  # Checks connection health before query
+    )
+
+
+def _create_session_local():
+    return sessionmaker(autocommit=False, autoflush=False, bind=_get("engine"))
+
+
+def _create_async_engine():
+    # imports the asyncpg dialect, only processes that use it pay for it
+    from sqlalchemy.ext.asyncio import create_async_engine
+    return create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        pool_pre_ping=True,  #Checks connection health before query
+        connect_args={
+            # asyncpg always prepares, so disable its statement cache and use unique names
+            # to keep prepared statements from clashing on pooled connections (PgBouncer)
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    )
+
+
+def _create_async_session_local():
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+    return async_sessionmaker(
+        _get("async_engine"),
+        class_=AsyncSession,
+        expire_on_commit=False
+    )
+
+
+_BUILDERS = {
+    "engine": _create_engine,
+    "SessionLocal": _create_session_local,
+    "async_engine": _create_async_engine,
+    "AsyncSessionLocal": _create_async_session_local,
+}
+# first use can come from several threads (executor, event writer)
+_lock = threading.RLock()
+
+
+def _get(name: str):
+    with _lock:
+        if name not in globals():
+            # stored as a module global, later lookups do not reach __getattr__
+            globals()[name] = _BUILDERS[name]()
+        return globals()[name]
+
+
+def __getattr__(name: str):
+    if name in _BUILDERS:
+        return _get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Dependency
 def get_db():
-    db = SessionLocal()
+    db = _get("SessionLocal")()
     try:
         yield db
     finally:
         db.close()
-
-ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
-
-# Create the Async Engine connecting to the same database
-async_engine = create_async_engine(
-    ASYNC_DATABASE_URL, 
-    echo=False,
-    pool_pre_ping=True,  #Checks connection health before query
-    connect_args={
-        "prepare_threshold": None # disable prepared statements(Required for PgBouncer)
-    }
-)
-
-# Create the async session factory
-AsyncSessionLocal = async_sessionmaker(
-    async_engine, 
-    class_=AsyncSession, 
-    expire_on_commit=False
-)
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Buffered writers for the `task_events` audit trail.
+
+Recording an event only appends a row to an in-memory buffer, the rows are
+written in the background with one multi-row INSERT per flush. The timestamp is
+taken when the event is recorded, not when it is written, so the trail keeps the
+real order of transitions. If the DB cannot keep up the buffer is capped at
+EVENT_BUFFER_MAX rows and further events are dropped with a warning: the audit
+trail must never slow down or fail a task.
+
+A batch that fails on a lost connection or a timeout is put back and retried on
+the next flush. Any other error would fail again (e.g. an event of a task that
+was deleted meanwhile): the batch is split until the rows the DB rejects are
+found, those are dropped and the rest is written.
+
+- `EventWriter` runs a daemon thread, for the sync Queue Manager.
+- `AsyncEventWriter` runs an asyncio task, for the async worker.
+"""
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import exc, insert
+
+from .config import settings
+from . import database
+from .models import EventType, TaskEvents
+
+logger = logging.getLogger(__name__)
+
+
+def event_row(task_id: int, event_type: EventType, message: Optional[str] = None) -> dict:
+    return {
+        "task_id": task_id,
+        "event_type": event_type,
+        "message": message,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def _insert_statement(rows: List[dict]):
+    # a single INSERT ... VALUES (...), (...) instead of an executemany
+    return insert(TaskEvents).values(rows)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Lost connections and timeouts are worth a retry, other errors come back."""
+    if isinstance(error, exc.DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (exc.OperationalError, exc.InterfaceError, exc.TimeoutError,
+                              OSError, asyncio.TimeoutError))
+
+
+def _split(rows: List[dict], error: Exception) -> List[List[dict]]:
+    """
+    The halves of rows the DB rejected for good, second half first as they go on
+    a stack. A single row is the one to blame and is dropped.
+    """
+    if len(rows) == 1:
+        reason = str(error).splitlines()[0]
+        logger.error(f"Dropping {rows[0]['event_type'].value} event of task {rows[0]['task_id']}: {reason}")
+        return []
+    middle = len(rows) // 2
+    return [rows[middle:], rows[:middle]]
+
+
+def _unwritten(rows: List[dict], pending: List[List[dict]]) -> List[dict]:
+    """`rows` and what is left on the stack, in their original order."""
+    return rows + [row for part in reversed(pending) for row in part]
+
+
+class EventWriter:
+    """Thread based event buffer for sync code."""
+
+    def __init__(self, flush_interval: float = None, max_batch: int = None):
+        if flush_interval is None:
+            flush_interval = settings.EVENT_FLUSH_INTERVAL_MS / 1000
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch or settings.EVENT_FLUSH_MAX_BATCH
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, task_id: int, event_type: EventType, message: Optional[str] = None):
+        with self._lock:
+            if len(self._rows) >= settings.EVENT_BUFFER_MAX:
+                logger.warning(f"Event buffer full, dropping {event_type.value} event of task {task_id}")
+                return
+            self._rows.append(event_row(task_id, event_type, message))
+            if len(self._rows) >= self.max_batch:
+                self._wakeup.set()
+
+    def _take(self) -> List[dict]:
+        with self._lock:
+            batch = self._rows[: self.max_batch]
+            del self._rows[: self.max_batch]
+        return batch
+
+    def _flush_loop(self):
+        while self._running or self._rows:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while True:
+                batch = self._take()
+                if not batch:
+                    break
+                retry = self._write_batch(batch)
+                if retry:
+                    if not self._running:
+                        return
+                    with self._lock:
+                        self._rows[:0] = retry
+                    break
+
+    def _write_batch(self, batch: List[dict]) -> List[dict]:
+        """Writes `batch`, returns the rows to retry after a transient error."""
+        pending = [batch]
+        while pending:
+            rows = pending.pop()
+            try:
+                self._write(rows)
+            except Exception as e:
+                if _is_transient(e):
+                    logger.error(f"Failed to write {len(rows)} task events: {e}")
+                    return _unwritten(rows, pending)
+                pending.extend(_split(rows, e))
+        return []
+
+    def _write(self, batch: List[dict]):
+        db = database.SessionLocal()
+        try:
+            db.execute(_insert_statement(batch))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = 10):
+        """Writes the remaining events and stops the background thread."""
+        if not self._thread:
+            return
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(timeout=timeout)
+        if self._rows:
+            logger.error(f"Dropping {len(self._rows)} unwritten task events on shutdown")
+        self._thread = None
+
+
+class AsyncEventWriter:
+    """asyncio based event buffer for the worker."""
+
+    def __init__(self, flush_interval: float = None, max_batch: int = None):
+        if flush_interval is None:
+            flush_interval = settings.EVENT_FLUSH_INTERVAL_MS / 1000
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch or settings.EVENT_FLUSH_MAX_BATCH
+        self._rows: List[dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._running = False
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def record(self, task_id: int, event_type: EventType, message: Optional[str] = None):
+        if len(self._rows) >= settings.EVENT_BUFFER_MAX:
+            logger.warning(f"Event buffer full, dropping {event_type.value} event of task {task_id}")
+            return
+        self._rows.append(event_row(task_id, event_type, message))
+        if len(self._rows) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while self._running or self._rows:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._rows:
+                batch = self._rows[: self.max_batch]
+                del self._rows[: self.max_batch]
+                retry = await self._write_batch(batch)
+                if retry:
+                    if not self._running:
+                        return
+                    self._rows[:0] = retry
+                    break
+
+    async def _write_batch(self, batch: List[dict]) -> List[dict]:
+        """Writes `batch`, returns the rows to retry after a transient error."""
+        pending = [batch]
+        while pending:
+            rows = pending.pop()
+            try:
+                async with database.AsyncSessionLocal() as session:
+                    await session.execute(_insert_statement(rows))
+                    await session.commit()
+            except Exception as e:
+                if _is_transient(e):
+                    logger.error(f"Failed to write {len(rows)} task events: {e}")
+                    return _unwritten(rows, pending)
+                pending.extend(_split(rows, e))
+        return []
+
+    async def stop(self, timeout: float = 10):
+        """Writes the remaining events and stops the background task."""
+        if not self._flusher:
+            return
+        self._running = False
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._flusher, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Dropping {len(self._rows)} unwritten task events on shutdown")
+        self._flusher = None
@@ -1,5 +1,6 @@
 from .database import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum as SQLAlchemyEnum, Text
+from .queues import DEFAULT_PRIORITY, PRIORITY_MIN, PRIORITY_MAX
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum as SQLAlchemyEnum, Text, CheckConstraint
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.orm import relationship
@@ -14,6 +15,8 @@ class TaskStatus(str, enum.Enum):
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
     RETRYING = "RETRYING"    
+    EXPIRED = "EXPIRED"       # Deadline passed before a worker could run it
+    CANCELLED = "CANCELLED"   # Cancelled by its owner through POST /tasks/{id}/cancel
 
 class EventType(str, enum.Enum):
     CREATED = "CREATED"
@@ -23,10 +26,7 @@ class EventType(str, enum.Enum):
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
     RETRIED = "RETRIED"
-
-class PriorityType(str, enum.Enum):
-    low = "low"
-    high = "high"
+    CANCELLED = "CANCELLED"
 
 
 class User(Base):
@@ -46,7 +46,8 @@ class Tasks(Base):
     id = Column(Integer, primary_key=True, nullable=False)
     title = Column(String, nullable=False) # tasks can have the same title but the title and payload cant be same togethor
     payload = Column(JSONB, nullable=False)
-    priority = Column(SQLAlchemyEnum(PriorityType), server_default=PriorityType.low, 
+    # 0 (backfill) .. 9 (interactive), see core/queues.py for the queue layout
+    priority = Column(Integer, server_default=text(str(DEFAULT_PRIORITY)), 
                       nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"),
                       nullable=False)
@@ -58,6 +59,8 @@ class Tasks(Base):
     retry_count = Column(Integer, default=0)
     # If status is SCHEDULED, this field tells the QueueManager when to push it to Redis
     scheduled_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # Optional hard deadline, tasks still waiting after this point are EXPIRED instead of run
+    deadline = Column(TIMESTAMP(timezone=True), nullable=True)
     # the defualt value is the time at which the task was created 
     updated_at = Column(TIMESTAMP(timezone=True), 
                         server_default=func.now(), onupdate=func.now())
@@ -65,6 +68,11 @@ class Tasks(Base):
     owner = relationship("User")
     events = relationship("TaskEvents", back_populates="task")
 
+    __table_args__ = (
+        CheckConstraint(f"priority BETWEEN {PRIORITY_MIN} AND {PRIORITY_MAX}",
+                        name="ck_tasks_priority_range"),
+    )
+
 
 # A entry is added only once some action is done on the task 
 class TaskEvents(Base):
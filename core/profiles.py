@@ -0,0 +1,25 @@
+"""
+Profiles of sampled task runs.
+
+With PROFILE_SAMPLE_RATE above 0 workers profile that fraction of the tasks they
+run (see worker/profiling.py) and keep the last PROFILE_HISTORY_SIZE profiles of
+each task file in the list `taskfile:{title}:profiles` on the low-priority
+instance, newest first. Each entry is a codec-encoded dict with `task_id`,
+`worker_id`, `recorded_at` (epoch seconds), `ok`, `wall_ms`, `cpu_ms`,
+`peak_memory_kb`, `isolated` and `top_allocations`. The list expires
+PROFILE_TTL_SECONDS after its last write.
+"""
+from typing import List
+
+import redis
+
+from . import codec
+
+
+def profiles_key(title: str) -> str:
+    return f"taskfile:{title}:profiles"
+
+
+def get_profiles(redis_client: redis.Redis, title: str, limit: int) -> List[dict]:
+    """Returns up to `limit` profiles of a task file, newest first."""
+    return [codec.decode(raw) for raw in redis_client.lrange(profiles_key(title), 0, limit - 1)]
@@ -0,0 +1,22 @@
+"""
+Progress reported by running task handlers.
+
+The latest report of a task is kept in the hash `task:{id}:progress` on the
+low-priority instance, next to its result, with the fields `done`, `total`,
+`message` and `updated_at` (epoch seconds). Workers write it at most once per
+PROGRESS_FLUSH_INTERVAL_MS per task; it expires with the result after
+RESULT_TTL_SECONDS.
+"""
+from typing import Optional
+
+import redis
+
+
+def progress_key(task_id: int) -> str:
+    return f"task:{task_id}:progress"
+
+
+def get_progress(redis_client: redis.Redis, task_id: int) -> Optional[dict]:
+    """Returns the last reported progress of a task, or None if it never reported any."""
+    entry = redis_client.hgetall(progress_key(task_id))
+    return entry or None
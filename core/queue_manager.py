@@ -1,8 +1,14 @@
-import uuid, logging, json, threading, time, signal
+import uuid, logging, threading, time, signal
+from . import codec
 from .redis_client import get_redis, get_redis_client
 from datetime import timezone, datetime
 from .database import SessionLocal
-from .models import Tasks, TaskStatus 
+from .models import Tasks, TaskStatus, EventType
+from .events import EventWriter
+from .queues import (
+    PRIORITY_MIN, PRIORITY_MAX, DEFAULT_PRIORITY, ENQUEUE_LUA, ENQUEUE_SCRIPT,
+    queue_key, lease_key, leased_messages_key,
+)
 
 # Configuration
 LEADER_KEY = "taskflow:leader"
@@ -13,6 +19,9 @@ RECLAIM_INTERVAL_S = 10
 MAX_RETRIES = 3
 PROCESSING_QUEUE_PREFIX = "processing"
 PROCESSING_RECLAIM_S = 30  
+RECLAIM_BATCH = 100
+LEASES = lease_key("default")
+LEASED_MESSAGES = leased_messages_key("default")
 
 import os
 os.makedirs("logs", exist_ok=True)
@@ -35,19 +44,83 @@ else
 end
 """
 
-def push_task(queue_name: str, message: dict, priority: str = "low") -> bool:
+# Returns up to ARGV[1] leases that expired by the Redis clock in the lease set
+# (KEYS[1]) as [task_id, message, ...] without removing them, so a lease is only
+# gone once REQUEUE_LEASE_SCRIPT requeued it or the reclaimer found its task
+# final. Leases of tasks that were acked in the meantime (completion marker set)
+# or without a message are dropped.
+RECLAIM_SCRIPT = """
+local now = redis.call("TIME")
+local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+local ids = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", now_ms, "LIMIT", 0, tonumber(ARGV[1]))
+local expired = {}
+for _, id in ipairs(ids) do
+    local msg = redis.call("HGET", KEYS[2], id)
+    if msg and redis.call("EXISTS", "task:" .. id .. ":done") == 0 then
+        expired[#expired + 1] = id
+        expired[#expired + 1] = msg
+    else
+        redis.call("ZREM", KEYS[1], id)
+        redis.call("HDEL", KEYS[2], id)
+    end
+end
+return expired
+"""
+
+# Requeues the lease of task ARGV[1] if it is still expired by the Redis clock (its
+# worker did not renew it since it was read): drops the lease and puts the message
+# ARGV[2] back at the head of its level list KEYS[3] in one step. Returns 1 if it did.
+REQUEUE_LEASE_SCRIPT = ENQUEUE_LUA + """
+local now = redis.call("TIME")
+local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+local expires = redis.call("ZSCORE", KEYS[1], ARGV[1])
+if not expires or tonumber(expires) > now_ms then
+    return 0
+end
+redis.call("ZREM", KEYS[1], ARGV[1])
+redis.call("HDEL", KEYS[2], ARGV[1])
+enqueue(KEYS[3], ARGV[2], true)
+return 1
+"""
+
+# redis client -> registered ENQUEUE_SCRIPT
+_enqueue_scripts = {}
+
+
+def enqueue(r, key: str, raw: str, head: bool = False) -> int:
+    """
+    Puts an encoded message on a level list in deadline order (see core/queues.py).
+    `head` is for tasks given back after they already waited once.
+    """
+    script = _enqueue_scripts.get(r)
+    if script is None:
+        script = _enqueue_scripts[r] = r.register_script(ENQUEUE_SCRIPT)
+    return script(keys=[key], args=[raw, int(head)])
+
+
+def push_task(queue_name: str, message: dict, priority: int = DEFAULT_PRIORITY) -> bool:
     """Pushes task with full payload to ensure workers can execute immediately."""
     try:
         r = get_redis_client(priority)
-        json_message = json.dumps(message)
-        r.rpush(queue_name, json_message)
-        length = r.llen(queue_name)
-        logger.debug(f"Pushed task {message.get('task_id')} to {queue_name} (len={length})")
+        key = queue_key(queue_name, priority)
+        length = enqueue(r, key, codec.encode(message))
+        logger.debug(f"Pushed task {message.get('task_id')} to {key} (len={length})")
         return True
     except Exception as e:
         logger.error(f"Error pushing to {priority} Redis: {e}")
         return False
 
+def build_task_message(task: Tasks) -> dict:
+    """Builds the message a worker needs to execute the task without touching the DB."""
+    return {
+        "task_id": task.id,
+        "title": task.title,
+        "payload": task.payload if task.payload is not None else {},
+        "priority": task.priority,
+        # epoch seconds so the worker can drop the task without parsing dates
+        "deadline": task.deadline.timestamp() if task.deadline else None
+    }
+
 class QueueManager:
     def __init__(self):
         self.instance_id = str(uuid.uuid4())
@@ -55,6 +128,10 @@ class QueueManager:
         self.running = True
         self.is_leader = False
         self.renew = self.redis.register_script(RENEW_SCRIPT)
+        self.reclaim = {r: r.register_script(RECLAIM_SCRIPT)
+                        for r in (get_redis_client('high'), get_redis_client('low'))}
+        self.requeue_lease = {r: r.register_script(REQUEUE_LEASE_SCRIPT) for r in self.reclaim}
+        self.events = EventWriter()
         signal.signal(signal.SIGTERM, self.shutdown)
         signal.signal(signal.SIGINT, self.shutdown)
 
@@ -117,40 +194,21 @@ class QueueManager:
             db = SessionLocal()
             try:
                 now = datetime.now(timezone.utc)
-                candidates = (
-                    db.query(Tasks)
-                    .filter(Tasks.status == TaskStatus.PENDING, Tasks.scheduled_at <= now)
-                    .order_by(Tasks.scheduled_at.asc())
-                    .limit(100).with_for_update(skip_locked=True).all()
+                # Late tasks are never pushed, nobody is waiting for their result anymore
+                expired = db.query(Tasks).filter(
+                    Tasks.status == TaskStatus.PENDING, Tasks.deadline < now
+                ).update(
+                    {Tasks.status: TaskStatus.EXPIRED, Tasks.updated_at: now},
+                    synchronize_session=False
                 )
-                
-                if not candidates:
-                    db.close()
-                    time.sleep(SCHEDULER_INTERVAL_S)
-                    continue
-
-                queued_ids = []
-                # Updated mapping for push_task logic in queue_manager.py
-                for task in candidates:
-                    task_title = str(task.title)
-                    task_payload = task.payload if task.payload is not None else {}
-                    logger.info(f"This is the task_title: {task.title} that we got from the database")
-                    payload = {
-                        "task_id": task.id,
-                        "title": task_title,
-                        "payload": task_payload
-                    }
-                    
-                    priority = getattr(task, "priority", "low") or "low"
-                    if push_task("default", payload, priority=priority):
-                        queued_ids.append(task.id)
-
-                if queued_ids:
-                    db.query(Tasks).filter(Tasks.id.in_(queued_ids)).update(
-                        {Tasks.status: TaskStatus.QUEUED, Tasks.updated_at: datetime.now(timezone.utc)},
-                        synchronize_session=False
-                    )
+                if expired:
+                    logger.info(f"Expired {expired} pending tasks past their deadline")
                     db.commit()
+
+                # One pass per priority level, highest first, each with its own batch limit
+                # so a backlog of low tasks never delays a high one
+                for level in range(PRIORITY_MAX, PRIORITY_MIN - 1, -1):
+                    self._schedule_band(db, level, now)
             except Exception as e:
                 logger.error(f"Scheduler Error: {e}")
                 db.rollback()
@@ -158,6 +216,37 @@ class QueueManager:
                 db.close()
             time.sleep(SCHEDULER_INTERVAL_S)
 
+    def _schedule_band(self, db, level: int, now: datetime) -> int:
+        """Pushes due PENDING tasks of a single priority level and marks them QUEUED."""
+        # Earliest deadline first, tasks without a deadline keep FIFO order behind them.
+        # push_task inserts each one by deadline, also ahead of tasks queued in earlier passes.
+        candidates = (
+            db.query(Tasks)
+            .filter(Tasks.status == TaskStatus.PENDING, Tasks.priority == level,
+                    Tasks.scheduled_at <= now)
+            .order_by(Tasks.deadline.asc().nulls_last(), Tasks.scheduled_at.asc())
+            .limit(100).with_for_update(skip_locked=True).all()
+        )
+        if not candidates:
+            return 0
+
+        queued_ids = []
+        for task in candidates:
+            logger.info(f"This is the task_title: {task.title} that we got from the database")
+            if push_task("default", build_task_message(task), priority=level):
+                queued_ids.append(task.id)
+
+        if queued_ids:
+            db.query(Tasks).filter(Tasks.id.in_(queued_ids)).update(
+                {Tasks.status: TaskStatus.QUEUED, Tasks.updated_at: datetime.now(timezone.utc)},
+                synchronize_session=False
+            )
+        # commit per band to release the row locks before the next level is scanned
+        db.commit()
+        for task_id in queued_ids:
+            self.events.record(task_id, EventType.QUEUED, f"priority {level}")
+        return len(queued_ids)
+
     def pel_scanner_loop(self):
         """Recovery mechanism that respects the worker startup window."""
         while self.running: 
@@ -169,8 +258,12 @@ class QueueManager:
                         # FIX: Wait for worker_id to be written to avoid race condition
                         if not task.worker_id: continue
                             
-                        if not self.redis.exists(f"worker:{task.worker_id}:heartbeat"):
-                            self._recover_task(db, task, f"Worker {task.worker_id} dead")
+                        if self.redis.exists(f"worker:{task.worker_id}:heartbeat"):
+                            continue
+                        # still leased: the reclaimer returns it once the lease expires
+                        if get_redis_client(task.priority).zscore(LEASES, task.id) is not None:
+                            continue
+                        self._recover_task(db, task, f"Worker {task.worker_id} dead")
                     db.commit()
                 except Exception as e:
                     logger.error(f"PEL Scanner Error: {e}")
@@ -179,43 +272,105 @@ class QueueManager:
                     db.close()  
             time.sleep(RECLAIM_INTERVAL_S)
 
-    def _recover_task(self, db, task: Tasks, reason):
-        """Re-queues task with script payload if retry limit not exceeded."""
-        if task.retry_count < MAX_RETRIES:
-            # FIX: Payload must include title/code for the worker
-            payload = {"task_id": task.id, "title": task.title, "payload": task.payload}
-            if push_task("default", payload, priority=getattr(task, "priority", "low")):
+    def _recover_task(self, db, task: Tasks, reason, requeue=None):
+        """
+        Re-queues task with script payload if retry limit not exceeded.
+        `requeue` pushes the message back and returns whether it worked, by default
+        a fresh message is built from the row and appended to its level.
+        """
+        if task.deadline and task.deadline < datetime.now(timezone.utc):
+            logger.info(f"Task {task.id} not recovered ({reason}): deadline passed")
+            task.status = TaskStatus.EXPIRED
+            task.updated_at = datetime.now(timezone.utc)
+        elif task.retry_count < MAX_RETRIES:
+            if requeue is None:
+                # FIX: Payload must include title/code for the worker
+                requeue = lambda: push_task("default", build_task_message(task), priority=task.priority)
+            if requeue():
                 task.status = TaskStatus.QUEUED
                 task.worker_id = None
                 task.retry_count += 1
                 task.updated_at = datetime.now(timezone.utc)
+                self.events.record(task.id, EventType.RETRIED,
+                                   f"Attempt {task.retry_count}: {reason}")
         else:
             task.status = TaskStatus.FAILED
             task.updated_at = datetime.now(timezone.utc)
+            self.events.record(task.id, EventType.FAILED, f"Retries exhausted: {reason}")
 
 
     def processing_reclaimer_loop(self):
-        """Moves stale items from processing lists back to main queue."""
-        low_redis = get_redis_client('low')
+        """
+        Requeues tasks whose lease expired, i.e. whose worker stopped renewing it.
+        Only expired leases are touched, so the cost does not depend on how many
+        tasks are running. Retry limits and deadlines are applied as for dead workers.
+        """
         p_queue = f"{PROCESSING_QUEUE_PREFIX}:default"
         while self.running:
             if not self.is_leader:
                 time.sleep(RECLAIM_INTERVAL_S)
                 continue
-            try:
-                items = low_redis.lrange(p_queue, 0, -1) or []
-                for raw in items:
-                    data = json.loads(raw)
-                    db = SessionLocal()
-                    task = db.query(Tasks).filter(Tasks.id == data.get('task_id')).first()
-                    if task and task.status != TaskStatus.IN_PROGRESS:
-                        low_redis.lrem(p_queue, 0, raw)
-                        low_redis.lpush('default', raw)
-                    db.close()
-            except Exception as e:
-                logger.error(f"Reclaimer Error: {e}")
+            for r, reclaim in self.reclaim.items():
+                try:
+                    expired = reclaim(keys=[LEASES, LEASED_MESSAGES], args=[RECLAIM_BATCH])
+                    if expired:
+                        self._requeue_expired(r, expired)
+                    # entries left in the old processing list by workers from before leases
+                    self._reclaim_processing_list(r, p_queue)
+                except Exception as e:
+                    logger.error(f"Reclaimer Error: {e}")
             time.sleep(RECLAIM_INTERVAL_S)
 
+    def _requeue_expired(self, r, expired):
+        """
+        Settles expired leases read by RECLAIM_SCRIPT one at a time. A lease is
+        removed together with the requeue of its message, or once the task's row
+        says it needs no lease anymore, so if the DB fails halfway the leases not
+        settled yet stay and are read again on the next pass.
+        """
+        db = SessionLocal()
+        try:
+            for task_id, raw in zip(expired[::2], expired[1::2]):
+                task = db.query(Tasks).filter(Tasks.id == int(task_id)).with_for_update().first()
+                # finished, cancelled or already recovered through another path
+                if task is None or task.status not in (TaskStatus.QUEUED, TaskStatus.IN_PROGRESS):
+                    db.rollback()
+                    self._drop_lease(r, task_id)
+                    continue
+                # back to the head of its level (by deadline if it has one), it has already waited once
+                key = queue_key('default', task.priority)
+                requeue = lambda: bool(self.requeue_lease[r](keys=[LEASES, LEASED_MESSAGES, key],
+                                                             args=[task_id, raw]))
+                self._recover_task(db, task, "lease expired", requeue=requeue)
+                db.commit()
+                # expired or out of retries instead of requeued
+                if task.status in (TaskStatus.EXPIRED, TaskStatus.FAILED):
+                    self._drop_lease(r, task_id)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _drop_lease(self, r, task_id):
+        with r.pipeline(transaction=True) as pipe:
+            pipe.zrem(LEASES, task_id)
+            pipe.hdel(LEASED_MESSAGES, task_id)
+            pipe.execute()
+
+    def _reclaim_processing_list(self, r, p_queue):
+        for raw in r.lrange(p_queue, 0, -1) or []:
+            data = codec.decode(raw)
+            db = SessionLocal()
+            try:
+                task = db.query(Tasks).filter(Tasks.id == data.get('task_id')).first()
+                if task and task.status != TaskStatus.IN_PROGRESS:
+                    priority = data.get('priority', DEFAULT_PRIORITY)
+                    r.lrem(p_queue, 0, raw)
+                    enqueue(get_redis_client(priority), queue_key('default', priority), raw, head=True)
+            finally:
+                db.close()
+
 
     def queued_reconciliation_loop(self):
         """Fixes sync issues where DB says QUEUED but Redis is empty."""
@@ -225,7 +380,7 @@ class QueueManager:
                 try:
                     queued = db.query(Tasks).filter(Tasks.status == TaskStatus.QUEUED).limit(100).all()
                     for t in queued:
-                        push_task("default", {"task_id": t.id, "title": t.title, "payload": t.payload})
+                        push_task("default", build_task_message(t), priority=t.priority)
                 finally:
                     db.close()
             time.sleep(30)
@@ -233,6 +388,7 @@ class QueueManager:
 
     def start(self): 
         logger.info(f"Queue Manager {self.instance_id} online.")
+        self.events.start()
         t_list = [
             threading.Thread(target=self.maintain_leadership, daemon=True),
             threading.Thread(target=self.scheduler_loop, daemon=True),
@@ -242,6 +398,7 @@ class QueueManager:
         ]
         for t in t_list: t.start()
         while self.running: time.sleep(1)
+        self.events.stop()
 
 if __name__ == "__main__":
     QueueManager().start()
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""
+Queue layout shared by the API, the Queue Manager and the workers.
+
+Every priority level has its own Redis list (`default:p0` ... `default:p9`),
+so a worker can pop the most urgent message with a single BLMPOP over the
+keys ordered from the highest level down. Levels at or above
+HIGH_INSTANCE_MIN_PRIORITY live on the high-priority Redis instance, the
+rest on the low-priority one.
+
+Within a level, messages are consumed earliest deadline first: a list holds
+the messages that have a deadline, earliest first, followed by the ones
+without, in FIFO order. Every producer inserts through ENQUEUE_LUA to keep it
+that way, so consumers only ever pop the head.
+"""
+from typing import List, Union
+
+PRIORITY_MIN = 0
+PRIORITY_MAX = 9
+DEFAULT_PRIORITY = 2
+
+# Named tiers from the old low/high API, each sits in the middle of its Redis instance's range
+PRIORITY_NAMES = {"low": 2, "high": 7}
+
+# Levels at or above this are routed to the high-priority Redis instance
+HIGH_INSTANCE_MIN_PRIORITY = 5
+
+
+# Lua function enqueue(key, msg, head) shared by every script that puts a message
+# on a level list. A message with a deadline (epoch seconds in its "deadline"
+# field) is inserted before the first message with a later deadline or none, found
+# by binary search over the sorted part, so an insert costs O(log N) LINDEX calls
+# plus one LINSERT. A message without one is appended, or with `head` (a task
+# given back after it waited once) placed before the other messages without one.
+# With `head` a message also goes before messages with the same deadline.
+# A leading version byte (see core/codec.py) is skipped before decoding.
+ENQUEUE_LUA = """
+local function deadline_of(msg)
+    local body = msg
+    if string.byte(msg, 1) == 1 then
+        body = string.sub(msg, 2)
+    end
+    local ok, decoded = pcall(cjson.decode, body)
+    if ok and type(decoded) == "table" and type(decoded.deadline) == "number" then
+        return decoded.deadline
+    end
+    return nil
+end
+local function enqueue(key, msg, head)
+    local deadline = deadline_of(msg)
+    if deadline == nil and not head then
+        return redis.call("RPUSH", key, msg)
+    end
+    local len = redis.call("LLEN", key)
+    local lo, hi = 0, len
+    while lo < hi do
+        local mid = math.floor((lo + hi) / 2)
+        local other = deadline_of(redis.call("LINDEX", key, mid))
+        local after
+        if other == nil then
+            after = true
+        elseif deadline == nil then
+            after = false
+        elseif head then
+            after = other >= deadline
+        else
+            after = other > deadline
+        end
+        if after then
+            hi = mid
+        else
+            lo = mid + 1
+        end
+    end
+    if lo == len then
+        return redis.call("RPUSH", key, msg)
+    end
+    return redis.call("LINSERT", key, "BEFORE", redis.call("LINDEX", key, lo), msg)
+end
+"""
+
+# Puts message ARGV[1] on the level list KEYS[1], with ARGV[2] == "1" as a task
+# given back. Returns the length of the list.
+ENQUEUE_SCRIPT = ENQUEUE_LUA + """
+return enqueue(KEYS[1], ARGV[1], ARGV[2] == "1")
+"""
+
+
+def normalize_priority(priority: Union[int, str, None]) -> int:
+    """
+    Converts a priority given as a level (0-9), a numeric string or a legacy
+    tier name ("low"/"high") into a level. Raises ValueError for anything else.
+    """
+    if priority is None:
+        return DEFAULT_PRIORITY
+    if isinstance(priority, str):
+        name = priority.strip().lower()
+        if name in PRIORITY_NAMES:
+            return PRIORITY_NAMES[name]
+        if not name.lstrip("-").isdigit():
+            raise ValueError(f"Unknown priority '{priority}'")
+        priority = int(name)
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        raise ValueError(f"Unknown priority '{priority}'")
+    if not PRIORITY_MIN <= priority <= PRIORITY_MAX:
+        raise ValueError(f"Priority must be between {PRIORITY_MIN} and {PRIORITY_MAX}")
+    return priority
+
+
+def instance_for_priority(priority: Union[int, str, None]) -> str:
+    """Returns "high" or "low", the Redis instance that holds this level."""
+    return "high" if normalize_priority(priority) >= HIGH_INSTANCE_MIN_PRIORITY else "low"
+
+
+def queue_key(queue_name: str, priority: Union[int, str, None]) -> str:
+    """Redis list holding messages of one priority level, e.g. `default:p7`."""
+    return f"{queue_name}:p{normalize_priority(priority)}"
+
+
+def lease_key(queue_name: str) -> str:
+    """
+    ZSET of the task ids claimed from `queue_name` on one instance, scored by the
+    time (epoch ms) their lease runs out. Workers extend the leases of the tasks
+    they hold, the Queue Manager requeues the ones that expire.
+    """
+    return f"processing:{queue_name}:leases"
+
+
+def leased_messages_key(queue_name: str) -> str:
+    """Hash task id -> message of every leased task, used to requeue expired leases."""
+    return f"processing:{queue_name}:messages"
+
+
+def completion_key(task_id) -> str:
+    """Set when a worker acks a task, so a copy of its message is never run again."""
+    return f"task:{task_id}:done"
+
+
+def execution_token_key(task_id) -> str:
+    """
+    Held (SET NX, value = worker id) by the worker running a task, with the same
+    TTL as its lease. A second delivery of the task finds it taken and is dropped.
+    """
+    return f"task:{task_id}:running"
+
+
+def priority_queue_keys(queue_name: str) -> List[str]:
+    """
+    All level lists from the highest priority down, followed by the bare
+    `queue_name` list that older producers pushed to, so messages enqueued
+    before the upgrade are still drained.
+    """
+    keys = [f"{queue_name}:p{level}" for level in range(PRIORITY_MAX, PRIORITY_MIN - 1, -1)]
+    keys.append(queue_name)
+    return keys
@@ -1,5 +1,6 @@
 import redis
 from .config import settings
+from .queues import instance_for_priority
 import redis.asyncio as aioredis
 
 # Used for: Auth, Caching, Rate Limiting, and "High Priority" Tasks.
@@ -19,12 +20,13 @@ redis_low = redis.Redis(
 )
 
 
-def get_redis_client(priority: str = "low") -> redis.Redis:
+def get_redis_client(priority: int | str = "low") -> redis.Redis:
     """
     Returns the appropriate Redis connection based on priority.
+    Accepts a priority level (0-9) or an instance name ("low"/"high").
     Used by the Queue Manager (push_task) to route jobs.
     """
-    if priority == "high":
+    if instance_for_priority(priority) == "high":
         return redis_high
     return redis_low
 
@@ -40,12 +42,12 @@ def get_redis():
 
 # ================ to get the async redis client ====================
 
-async def get_async_redis_client(priority: str = "low") -> aioredis.Redis:
+async def get_async_redis_client(priority: int | str = "low") -> aioredis.Redis:
     """
     Returns an ASYNC Redis connection based on priority.
     Used by the Async Worker to pop tasks and send heartbeats without blocking.
     """
-    if priority == "high":
+    if instance_for_priority(priority) == "high":
         host = settings.REDIS_HOST_HIGH
         port = settings.REDIS_PORT_HIGH
     else:
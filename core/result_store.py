@@ -0,0 +1,119 @@
+"""
+Storage for task results.
+
+Every result is serialized to JSON once. Results up to RESULT_INLINE_MAX_BYTES are
+kept directly in Redis (low-priority instance, `task:{id}:result`), larger ones are
+written in chunks to a file under RESULT_STORE_DIR (a directory on the shared task
+volume) and Redis only keeps a pointer to it. Both expire after RESULT_TTL_SECONDS:
+the Redis key through its TTL, the files through `cleanup_expired_results`.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Iterator, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from . import codec
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+RESULT_CHUNK_SIZE = 1024 * 1024
+
+
+def result_key(task_id: int) -> str:
+    return f"task:{task_id}:result"
+
+
+def result_path(task_id: int) -> str:
+    return os.path.join(settings.RESULT_STORE_DIR, f"{task_id}.json")
+
+
+def _write_chunks(path: str, data: bytes):
+    """Writes `data` in chunks to a temp file and renames it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            view = memoryview(data)
+            for start in range(0, len(view), RESULT_CHUNK_SIZE):
+                f.write(view[start:start + RESULT_CHUNK_SIZE])
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _encode(result: Any) -> bytes:
+    # default=str so handler results with Decimals, sets etc. are still stored
+    return codec.to_json(result, default=str)
+
+
+async def save_result(redis_client: aioredis.Redis, task_id: int, result: Any):
+    """
+    Stores a handler's return value. Used by the worker before it marks the task
+    COMPLETED, so a client that sees COMPLETED can always fetch the result.
+    Serializing and writing large results happens off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, _encode, result)
+    ttl = settings.RESULT_TTL_SECONDS
+
+    if len(data) <= settings.RESULT_INLINE_MAX_BYTES:
+        entry = {"kind": "inline", "size": len(data), "data": data.decode()}
+    else:
+        path = result_path(task_id)
+        await loop.run_in_executor(None, _write_chunks, path, data)
+        entry = {"kind": "file", "size": len(data), "path": path}
+
+    key = result_key(task_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=entry)
+        pipe.expire(key, ttl)
+        await pipe.execute()
+
+
+def get_result(redis_client: redis.Redis, task_id: int) -> Optional[dict]:
+    """
+    Returns the stored entry ({"kind", "size", and "data" or "path"}) or None when
+    there is no result, or it has expired.
+    """
+    entry = redis_client.hgetall(result_key(task_id))
+    if not entry:
+        return None
+    if entry.get("kind") == "file" and not os.path.exists(entry.get("path", "")):
+        return None
+    return entry
+
+
+def iter_result_file(path: str, chunk_size: int = RESULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields a stored result file in chunks, so it is never fully held in memory."""
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def cleanup_expired_results() -> int:
+    """Deletes result files older than RESULT_TTL_SECONDS. Returns how many were removed."""
+    results_dir = settings.RESULT_STORE_DIR
+    if not os.path.isdir(results_dir):
+        return 0
+
+    cutoff = time.time() - settings.RESULT_TTL_SECONDS
+    removed = 0
+    for entry in os.scandir(results_dir):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.error(f"Failed to remove result file {entry.path}: {e}")
+    return removed
@@ -0,0 +1,199 @@
+"""
+Compiled task files.
+
+On upload the API checks a task file statically (it must parse and define a
+top-level `handler`), compiles it once and publishes it on the high-priority Redis:
+
+- `taskfile:{title}:current` holds the sha256 of the current source
+- `taskfile:blob:{sha256}` is a hash with the source, the marshalled code object
+  (base64) and the bytecode magic number it was compiled for
+
+Workers look the current hash up and keep the code in a node-local cache keyed by
+it, so the shared volume is not read on the task path. The source is still
+written to the volume, it is the fallback for files that were never published.
+
+With TASK_VALIDATION_ENABLED an upload is not published by the API. It is
+written to UPLOAD_STAGING_DIR, described by the hash `taskfile:validation:{id}`
+and its id pushed to TASK_VALIDATION_QUEUE_NAME; `worker/validator.py` runs it
+in a sandbox and promotes it. Every upload of a title gets a sequence number
+(`taskfile:{title}:uploads`) and a validated upload is only promoted if no later
+one of the same title was promoted first (`taskfile:{title}:promoted`).
+"""
+import ast
+import base64
+import hashlib
+import marshal
+import time
+from importlib.util import MAGIC_NUMBER
+from types import CodeType
+from typing import Optional, Tuple
+
+import redis
+
+# a replaced version stays available this long for workers that still run it
+SUPERSEDED_BLOB_TTL_SECONDS = 3600
+MAGIC = MAGIC_NUMBER.hex()
+
+VALIDATION_PENDING = "PENDING"
+VALIDATION_RUNNING = "RUNNING"
+VALIDATION_VALIDATED = "VALIDATED"
+VALIDATION_REJECTED = "REJECTED"
+VALIDATION_FINAL = (VALIDATION_VALIDATED, VALIDATION_REJECTED)
+
+
+INVALID_TITLE = "A title may not contain '/', '\\', '..' or start with '.'"
+
+
+class TaskFileError(Exception):
+    """A task file that cannot be run: it does not parse or has no `handler`."""
+
+
+def is_valid_title(title: str) -> bool:
+    """
+    A title names `{title}.py` in the tasks directory, so it may not point
+    outside of it or at hidden files and directories in it.
+    """
+    return bool(title) and not title.startswith(".") and not any(
+        part in title for part in ("/", "\\", "..", "\0"))
+
+
+def current_key(title: str) -> str:
+    return f"taskfile:{title}:current"
+
+
+def blob_key(digest: str) -> str:
+    return f"taskfile:blob:{digest}"
+
+
+def uploads_key(title: str) -> str:
+    return f"taskfile:{title}:uploads"
+
+
+def promoted_key(title: str) -> str:
+    return f"taskfile:{title}:promoted"
+
+
+def validation_key(validation_id: str) -> str:
+    return f"taskfile:validation:{validation_id}"
+
+
+def _defines_handler(tree: ast.Module) -> bool:
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "handler":
+            return True
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            if any(isinstance(t, ast.Name) and t.id == "handler" for t in targets):
+                return True
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if any((alias.asname or alias.name) == "handler" for alias in node.names):
+                return True
+    return False
+
+
+def compile_task_file(title: str, source: bytes) -> Tuple[str, CodeType]:
+    """
+    Checks and compiles a task file without running it.
+    Returns (sha256 of the source, code object), raises TaskFileError.
+    """
+    try:
+        text = source.decode("utf-8")
+    except UnicodeDecodeError:
+        raise TaskFileError("Task file is not valid UTF-8")
+    try:
+        tree = ast.parse(text, filename=f"{title}.py")
+    except SyntaxError as e:
+        raise TaskFileError(f"Syntax error at line {e.lineno}: {e.msg}")
+    if not _defines_handler(tree):
+        raise TaskFileError("Task file does not define a top-level 'handler'")
+    code = compile(tree, f"{title}.py", "exec")
+    return hashlib.sha256(source).hexdigest(), code
+
+
+def _queue_publish(pipe, title: str, source: bytes, code: CodeType, digest: str, previous: Optional[str]):
+    pipe.hset(blob_key(digest), mapping={
+        "source": source.decode("utf-8"),
+        "code": base64.b64encode(marshal.dumps(code)).decode(),
+        "magic": MAGIC,
+    })
+    pipe.persist(blob_key(digest))
+    pipe.set(current_key(title), digest)
+    if previous and previous != digest:
+        pipe.expire(blob_key(previous), SUPERSEDED_BLOB_TTL_SECONDS)
+
+
+def publish_task_file(redis_client: redis.Redis, title: str, source: bytes, code: CodeType, digest: str):
+    """Makes `digest` the current version of `title`."""
+    previous = redis_client.get(current_key(title))
+    with redis_client.pipeline(transaction=True) as pipe:
+        _queue_publish(pipe, title, source, code, digest, previous)
+        pipe.execute()
+
+
+def promote_task_file(redis_client: redis.Redis, title: str, source: bytes, code: CodeType,
+                      digest: str, upload_seq: int) -> bool:
+    """
+    Publishes a validated upload unless a later upload of the same title was
+    promoted already. Returns False when it was skipped for that reason.
+    """
+    with redis_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                pipe.watch(promoted_key(title), current_key(title))
+                promoted = pipe.get(promoted_key(title))
+                if promoted is not None and int(promoted) >= upload_seq:
+                    pipe.unwatch()
+                    return False
+                previous = pipe.get(current_key(title))
+                pipe.multi()
+                _queue_publish(pipe, title, source, code, digest, previous)
+                pipe.set(promoted_key(title), upload_seq)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+
+def request_validation(redis_client: redis.Redis, validation_id: str, title: str, digest: str,
+                       owner_id: int, staged_path: str, queue_name: str, ttl: int) -> int:
+    """Records a staged upload as PENDING and queues it for the validator. Returns its upload sequence."""
+    upload_seq = redis_client.incr(uploads_key(title))
+    key = validation_key(validation_id)
+    with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            "status": VALIDATION_PENDING,
+            "title": title,
+            "digest": digest,
+            "owner_id": owner_id,
+            "staged_path": staged_path,
+            "upload_seq": upload_seq,
+            "created_at": round(time.time(), 3),
+        })
+        pipe.expire(key, ttl)
+        pipe.lpush(queue_name, validation_id)
+        pipe.execute()
+    return upload_seq
+
+
+def get_validation(redis_client: redis.Redis, validation_id: str) -> Optional[dict]:
+    return redis_client.hgetall(validation_key(validation_id)) or None
+
+
+def unpublish_task_file(redis_client: redis.Redis, title: str):
+    previous = redis_client.get(current_key(title))
+    with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(current_key(title))
+        if previous:
+            pipe.expire(blob_key(previous), SUPERSEDED_BLOB_TTL_SECONDS)
+        pipe.execute()
+
+
+def code_from_blob(title: str, blob: dict) -> bytes:
+    """
+    Marshalled code of a published blob for this interpreter. The stored bytecode
+    is used as is when it was compiled by the same Python version, otherwise the
+    source is compiled again.
+    """
+    if blob.get("magic") == MAGIC:
+        return base64.b64decode(blob["code"])
+    return marshal.dumps(compile(blob["source"], f"{title}.py", "exec"))
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta, timezone
 from core.database import SessionLocal
 from core import models
 from core.redis_client import get_redis
+from core.result_store import cleanup_expired_results
 import redis
 
 def cleanup_inactive_keys(redis_client: redis.Redis = Depends(get_redis)):
@@ -84,7 +85,18 @@ def delete_old_inactive_keys():
     
 
 
+def delete_expired_results():
+    """Removes large task result files whose Redis entry has expired."""
+    try:
+        removed = cleanup_expired_results()
+        print(f"Deleted {removed} expired task result files.")
+    except Exception as e:
+        print(f"Error while deleting expired results: {e}")
+
+
+
 # we will call this function in our docker file while creating a container 
 if __name__ == "__main__":
     cleanup_inactive_keys()
-    delete_old_inactive_keys()
\ No newline at end of file
+    delete_old_inactive_keys()
+    delete_expired_results()
\ No newline at end of file
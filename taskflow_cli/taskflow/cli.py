@@ -129,6 +129,11 @@ def upload_file(
         console.print("\n[bold red]✗[/] Could not connect to TaskFlow API")
 
     
+    elif response.status_code == 202:
+        result = response.json()
+        console.print(f"\n[bold green]✓[/] {result['message']}")
+        console.print(f"[dim]Validation ID:[/] {result['validation_id']}")
+        console.print(f"\n[yellow]→[/] Check it with: [bold]taskflow validation-status {result['validation_id']}[/]")
     elif response.status_code == 201:
         result = response.json()
         console.print(f"\n[bold green]✓[/] {result['message']}")
@@ -140,6 +145,38 @@ def upload_file(
         console.print("\n[bold red]✗[/] Could not connect to TaskFlow API")
 
 
+@app.command()
+def validation_status(
+    validation_id: str = typer.Argument(..., help="Validation ID returned by upload-file")
+):
+    """Show whether an uploaded task file passed validation."""
+    if not get_token():
+        console.print("[bold red]✗[/] You must be logged in to check uploads.")
+        console.print("[dim]Run:[/] taskflow login")
+        return
+
+    response = api_request("GET", f"/tasks/validation_status/{validation_id}")
+
+    if response is None:
+        console.print("\n[bold red]✗[/] Could not connect to TaskFlow API")
+    elif response.status_code == 200:
+        result = response.json()
+        colors = {"VALIDATED": "green", "REJECTED": "red"}
+        color = colors.get(result["status"], "yellow")
+        console.print(f"\n[dim]Title:[/] {result['title']}")
+        console.print(f"[dim]Status:[/] [bold {color}]{result['status']}[/]")
+        if result.get("message"):
+            console.print(f"[dim]Message:[/] {result['message']}")
+        if result["status"] == "VALIDATED" and result.get("promoted"):
+            console.print(f"\n[yellow]→[/] You can now create tasks with title: [bold]{result['title']}[/]")
+    else:
+        try:
+            error = response.json().get("detail", "Could not get the validation status")
+        except:
+            error = "Could not get the validation status"
+        console.print(f"\n[bold red]✗[/] {error}")
+
+
 @app.command()
 def create_task(
     title: str = typer.Option(..., "--title", "-t", help="Task title (must match uploaded file)"),
@@ -83,6 +83,7 @@ def main(ctx: typer.Context):
         console.print("  [bold]register[/]              - Create a new account")
         console.print("  [bold]login[/]                 - Login to your account")
         console.print("  [bold]upload-file[/]           - Upload a task Python file")
+        console.print("  [bold]validation-status[/]     - Check an uploaded file's validation")
         console.print("  [bold]create-task[/]           - Create a new task")
         console.print("  [bold]list-tasks[/]            - View all your tasks")
         console.print("\n[dim]Type a command or [bold]help[/bold] to see all commands.")
@@ -206,6 +207,7 @@ def display_help():
     table.add_row("upload-file <filepath> --title <name>", "Upload a Python task file")
     table.add_row("  <filepath>", "  Path to the .py file to upload")
     table.add_row("  --title <name> (required)", "  Task name to use when creating tasks")
+    table.add_row("validation-status <validation-id>", "Check whether an upload passed validation")
     table.add_row("delete-file --title <name>", "Delete an uploaded task file")
     table.add_row("list-worker-files", "List task files in worker pod (/app/worker/tasks)")
     
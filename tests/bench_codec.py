@@ -0,0 +1,101 @@
+"""
+CPU cost per message of the wire formats in core/codec.py, and of rendering API
+responses, compared with the stdlib json they replace.
+
+Run from the repository root with the usual .env in place:
+
+    python -m tests.bench_codec
+"""
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from core import codec
+from core.config import settings
+
+ROUNDS = 20000
+
+
+def task_message(payload_items: int) -> dict:
+    # the shape core.queue_manager.build_task_message produces
+    return {
+        "task_id": 123456,
+        "title": "resize_images",
+        "payload": {
+            "data": {f"field_{i}": {"value": i * 1.5, "tags": ["a", "b"], "ok": True}
+                     for i in range(payload_items)},
+            "_run_id": str(uuid.uuid4()),
+        },
+        "priority": 7,
+        "deadline": time.time() + 600,
+    }
+
+
+def cpu_us_per_round(func, rounds: int = ROUNDS) -> float:
+    start = time.process_time()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - start) / rounds * 1e6
+
+
+def bench_messages():
+    print(f"{'message':<22}{'bytes':>8}{'json us':>10}{'codec us':>10}{'saved':>8}")
+    for items in (1, 20, 200):
+        message = task_message(items)
+        settings.MESSAGE_CODEC = "orjson"
+        encoded = codec.encode(message)
+        legacy = json.dumps(message)
+        assert codec.decode(encoded) == codec.decode(legacy) == json.loads(legacy)
+
+        stdlib = cpu_us_per_round(lambda: json.loads(json.dumps(message)))
+        fast = cpu_us_per_round(lambda: codec.decode(codec.encode(message)))
+        print(f"{f'{items} payload fields':<22}{len(encoded):>8}{stdlib:>10.2f}{fast:>10.2f}"
+              f"{(1 - fast / stdlib) * 100:>7.0f}%")
+
+
+def bench_responses():
+    tasks = [{"id": i, "title": "resize_images", "status": "COMPLETED", "priority": 7,
+              "payload": task_message(5)["payload"], "owner_id": 1} for i in range(100)]
+    stdlib = cpu_us_per_round(lambda: JSONResponse(tasks), 2000)
+    fast = cpu_us_per_round(lambda: ORJSONResponse(tasks), 2000)
+    print(f"\nGET /tasks body, 100 tasks: JSONResponse {stdlib:.1f} us, "
+          f"ORJSONResponse {fast:.1f} us ({(1 - fast / stdlib) * 100:.0f}% saved)")
+
+
+async def _loop_work(n: int):
+    queue = asyncio.Queue()
+
+    async def consumer():
+        for _ in range(n):
+            await queue.get()
+
+    task = asyncio.create_task(consumer())
+    for i in range(n):
+        queue.put_nowait(i)
+        await asyncio.sleep(0)
+    await task
+
+
+def bench_event_loop(n: int = 100000):
+    results = {}
+    for name in ("asyncio", "uvloop"):
+        settings.WORKER_EVENT_LOOP = name
+        from worker.main import event_loop_factory
+        factory = event_loop_factory()
+        if name == "uvloop" and factory is None:
+            continue
+        with asyncio.Runner(loop_factory=factory) as runner:
+            start = time.process_time()
+            runner.run(_loop_work(n))
+            results[name] = (time.process_time() - start) / n * 1e6
+    print("\nEvent loop, queue hand-off per item: " +
+          ", ".join(f"{name} {us:.2f} us" for name, us in results.items()))
+
+
+if __name__ == "__main__":
+    bench_messages()
+    bench_responses()
+    bench_event_loop()
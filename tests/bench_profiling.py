@@ -0,0 +1,42 @@
+"""
+Overhead of sampled task profiling (worker/profiling.py) on a sync handler that
+allocates, at several PROFILE_SAMPLE_RATE values, against running it unprofiled.
+
+Run from the repository root with the usual .env in place:
+
+    python -m tests.bench_profiling
+"""
+import time
+
+from worker.profiling import Measurement, ProfileWriter, run_measured
+
+ROUNDS = 3000
+
+
+def handler(payload):
+    # a small task: builds and summarizes a few thousand records
+    rows = [{"id": i, "name": f"item-{i}", "tags": ["a", "b"]} for i in range(payload["rows"])]
+    return sum(len(row["name"]) for row in rows)
+
+
+def run(sample_rate: float, payload: dict) -> float:
+    """Seconds for ROUNDS calls, sampled as the worker does it."""
+    writer = ProfileWriter("bench", sample_rate)
+    start = time.perf_counter()
+    for task_id in range(ROUNDS):
+        profiler = writer.sample(task_id)
+        if profiler is None:
+            handler(payload)
+        else:
+            run_measured(Measurement(), handler, payload)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    payload = {"rows": 2000}
+    baseline = min(run(0, payload) for _ in range(3))
+    print(f"{ROUNDS} calls unprofiled: {baseline / ROUNDS * 1e6:.0f} us per call")
+    for rate in (0.01, 0.1):
+        elapsed = min(run(rate, payload) for _ in range(3))
+        print(f"PROFILE_SAMPLE_RATE={rate:<5} {elapsed / ROUNDS * 1e6:6.0f} us per call, "
+              f"overhead {(elapsed / baseline - 1) * 100:5.1f}%")
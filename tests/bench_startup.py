@@ -0,0 +1,86 @@
+"""
+Cold start budget of a worker process: the time from process start until the
+worker object is built (interpreter start plus imports), measured in fresh
+interpreters, and checks that nothing on that path opens the database early.
+Exits with status 1 when the median is over the budget or a check fails, so it
+can run in CI to catch startup regressions.
+
+Run from the repository root with the usual .env in place:
+
+    python -m tests.bench_startup --runs 7 --budget-ms 1000
+
+A running worker reports the full figures (connections warmed, first task
+claimed) in `worker:{id}:metrics`, see worker/startup.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, sys
+import worker.main as main
+w = main.AsyncWorker()
+import core.database as database
+print(json.dumps({
+    "imported_ms": w.startup.get("startup_imported_ms"),
+    "engines_created": sorted(n for n in ("engine", "async_engine") if n in vars(database)),
+    "asyncpg_imported": "asyncpg" in sys.modules,
+}))
+"""
+
+
+def run_probe(importtime: bool = False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE]
+    env = dict(os.environ, WORKER_SUPERVISED="1")
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env, cwd=os.getcwd())
+    if proc.returncode != 0:
+        sys.exit(f"probe failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def slowest_imports(importtime_log: str, count: int = 10):
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # only top level entries, nested ones are part of their parent's time
+        if not name.startswith("  "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    results = [run_probe()[0] for _ in range(args.runs)]
+    times = [r["imported_ms"] for r in results]
+    median = statistics.median(times)
+    print(f"process start -> worker built: median {median:.0f} ms, "
+          f"min {min(times):.0f} ms, max {max(times):.0f} ms over {args.runs} runs")
+
+    _, log = run_probe(importtime=True)
+    print("\nslowest top level imports (cumulative):")
+    for ms, name in slowest_imports(log):
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"median {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    if results[0]["engines_created"]:
+        failures.append(f"database engines created during startup: {results[0]['engines_created']}")
+    if results[0]["asyncpg_imported"]:
+        failures.append("asyncpg was imported during startup")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items: List[Tuple[object, asyncio.Future]] = []
+        self.full = asyncio.Event()
+
+
+def _consume(future: asyncio.Future):
+    # the waiting task may have been cancelled, do not log its exception as lost
+    if not future.cancelled():
+        future.exception()
+
+
+class TaskBatcher:
+    """
+    Groups tasks of titles whose file defines `handler_batch(payloads)`.
+
+    The first task of a title opens a batch, the following ones join it until it
+    holds `max_size` payloads or TASK_BATCH_MAX_WAIT_MS have passed. The batch then
+    runs once through `run_batch(title, digest, payloads)`, which must return one
+    result per payload, in order. A result that is an exception fails only its
+    task; an exception raised by the batch fails all of them. Every task still
+    waits for its own result, so status, result storage, events and ack stay per
+    task, and a task that is cancelled while waiting only drops its own result.
+    """
+    def __init__(
+        self,
+        run_batch: Callable[[str, Optional[str], list], Awaitable[list]],
+        on_join: Callable[[], None] = None,
+        max_wait: float = None,
+    ):
+        self.run_batch = run_batch
+        # called in the task that joins an existing batch
+        self.on_join = on_join
+        if max_wait is None:
+            max_wait = settings.TASK_BATCH_MAX_WAIT_MS / 1000
+        self.max_wait = max_wait
+        self._open: Dict[Tuple[str, Optional[str]], _Batch] = {}
+        self._running = set()
+
+    async def submit(self, task_title: str, digest: Optional[str], payload, max_size: int):
+        """Adds one payload to the open batch of its title and returns its own result."""
+        key = (task_title, digest)
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _Batch(max(1, max_size))
+            runner = asyncio.create_task(self._run(key, batch))
+            self._running.add(runner)
+            runner.add_done_callback(self._running.discard)
+        elif self.on_join:
+            self.on_join()
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume)
+        batch.items.append((payload, future))
+        if len(batch.items) >= batch.max_size:
+            batch.full.set()
+            # later tasks of this title start the next batch
+            del self._open[key]
+        return await asyncio.shield(future)
+
+    async def _run(self, key, batch: _Batch):
+        task_title, digest = key
+        try:
+            await asyncio.wait_for(batch.full.wait(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        if self._open.get(key) is batch:
+            del self._open[key]
+
+        payloads = [payload for payload, _ in batch.items]
+        futures = [future for _, future in batch.items]
+        logger.info(f"Running a batch of {len(payloads)} '{task_title}' tasks")
+        try:
+            results = await self.run_batch(task_title, digest, payloads)
+            if not isinstance(results, (list, tuple)) or len(results) != len(payloads):
+                count = len(results) if isinstance(results, (list, tuple)) else type(results).__name__
+                raise Exception(f"handler_batch returned {count} results for {len(payloads)} payloads")
+        except asyncio.CancelledError:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(Exception("Batch was stopped before it finished"))
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def stop(self):
+        """Stops batches still running, their tasks were handed back or cancelled by now."""
+        for runner in list(self._running):
+            runner.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
@@ -1,4 +1,5 @@
 import asyncio, logging, os
+from core.config import settings
 from core.redis_client import get_async_redis_client
 
 # Ensure logs directory exists
@@ -15,16 +16,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class HeartbeatService:
-    def __init__(self, worker_id: str, ttl_seconds: int=10, interval: int = 3):
+    def __init__(self, worker_id: str, ttl_seconds: int = None, interval: int = None):
         self.worker_id = worker_id
-        self.ttl_seconds = ttl_seconds
-        self.interval = interval
+        self.ttl_seconds = settings.HEARTBEAT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.interval = settings.HEARTBEAT_INTERVAL_SECONDS if interval is None else interval
         self.running = True
         self._task = None
+        self._owns_client = True
 
-    async def start(self):
-        """ Starts the background hearbeat loop """
-        self.redis = await get_async_redis_client("high")
+    async def start(self, redis_client=None):
+        """
+        Starts the background hearbeat loop, on the worker's own high priority
+        client when given (it is not closed on stop) or on a new one.
+        """
+        self._owns_client = redis_client is None
+        self.redis = redis_client or await get_async_redis_client("high")
         self._task = asyncio.create_task(self._loop())
 
     async def _loop(self):
@@ -43,7 +49,17 @@ class HeartbeatService:
         """ Stops the heartbeat of the worker and closes the redis connection """
         self.running = False
         if self._task:
-            await self._task  # wait for the task loop to get over 
-        else:
-            await self.redis.close()
-        logger.info(f"Heartbeat of worker:{self.worker_id} stopped")
\ No newline at end of file
+            # don't sit out the rest of the sleep interval while the pod is terminating
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            try:
+                # the worker is gone, no need to look alive until the key expires
+                await self.redis.delete(f"worker:{self.worker_id}:heartbeat")
+            except Exception as e:
+                logger.error(f"Failed to remove heartbeat: {e}")
+        if self._owns_client:
+            await self.redis.aclose()
+        logger.info(f"Heartbeat of worker:{self.worker_id} stopped")
@@ -0,0 +1,101 @@
+import asyncio
+import inspect
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def _takes_argument(func: Callable) -> bool:
+    try:
+        return bool(inspect.signature(func).parameters)
+    except (TypeError, ValueError):
+        return False
+
+
+class TaskContext:
+    """
+    State of one loaded version of a task file in this process.
+
+    A task file may define `init()` and `teardown(context)`. `init()` runs once,
+    on first use, and its return value is passed as `context` to every handler call
+    that declares that parameter. `teardown` runs once the version is replaced,
+    evicted from the handler cache or the process shuts down, and never while a
+    task of that version is still running in this process.
+    """
+    def __init__(self, task_title: str, module_globals: Dict[str, Any]):
+        self.task_title = task_title
+        init = module_globals.get("init")
+        teardown = module_globals.get("teardown")
+        self._init = init if callable(init) else None
+        self._teardown = teardown if callable(teardown) else None
+        self.value = None
+        self.ready = self._init is None
+        self.active = 0
+        self.retired = False
+        self._closed = False
+        # guards active/retired/_closed, taken on the event loop, so never held for long
+        self._lock = threading.Lock()
+        # init can be slow (model loading), concurrent first tasks wait for one call
+        self._init_lock = threading.Lock()
+
+    def get(self) -> Any:
+        """
+        Returns the context, running `init()` first if it did not run yet. Blocking,
+        callers hold the context (`acquire`) so that it is not torn down meanwhile.
+        """
+        if self.ready:
+            return self.value
+        with self._init_lock:
+            if not self.ready:
+                logger.info(f"Running init() of task file '{self.task_title}'")
+                self.value = self._init()
+                self.ready = True
+        return self.value
+
+    def acquire(self):
+        with self._lock:
+            self.active += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            due = self.retired and self.active == 0
+        if due:
+            self._close()
+
+    def retire(self):
+        """The version is no longer used for new tasks, tear it down once idle."""
+        with self._lock:
+            self.retired = True
+            due = self.active == 0
+        if due:
+            self._close()
+
+    def _close(self):
+        with self._lock:
+            if self._closed or not self.ready or self._teardown is None:
+                self._closed = True
+                return
+            self._closed = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            # keep a slow teardown off the event loop
+            loop.run_in_executor(None, self._run_teardown)
+        else:
+            self._run_teardown()
+
+    def _run_teardown(self):
+        logger.info(f"Running teardown() of task file '{self.task_title}'")
+        try:
+            if _takes_argument(self._teardown):
+                self._teardown(self.value)
+            else:
+                self._teardown()
+        except Exception:
+            logger.exception(f"teardown() of task file '{self.task_title}' failed")
+        self.value = None
@@ -0,0 +1,157 @@
+import functools
+import math
+import os
+import resource
+import signal
+from typing import Callable, Dict, Optional
+
+from core.config import settings
+
+# name -> (rlimit, bytes per unit)
+_RLIMITS = {
+    "memory_mb": (resource.RLIMIT_AS, 1024 * 1024),
+    "cpu_seconds": (resource.RLIMIT_CPU, 1),
+    "open_files": (resource.RLIMIT_NOFILE, 1),
+}
+LIMIT_NAMES = tuple(_RLIMITS)
+# a handler may always grow its process by this much, however small the pod
+MIN_MEMORY_MB = 16
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# cgroup v2, then v1
+_CGROUP_MEMORY_LIMITS = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+
+
+class ResourceLimitExceeded(Exception):
+    """A handler went over one of its memory, CPU time or open file limits."""
+
+    def __init__(self, limit: str, value: int):
+        self.limit = limit
+        self.value = value
+        super().__init__(f"Resource limit exceeded: {limit}={value}")
+
+
+def default_limits() -> Dict[str, int]:
+    limits = {
+        "memory_mb": settings.HANDLER_MAX_MEMORY_MB,
+        "cpu_seconds": settings.HANDLER_MAX_CPU_SECONDS,
+        "open_files": settings.HANDLER_MAX_OPEN_FILES,
+    }
+    return {name: value for name, value in limits.items() if value > 0}
+
+
+@functools.lru_cache(maxsize=1)
+def container_memory_mb() -> Optional[int]:
+    """Memory limit of the container from its cgroup, None when there is none."""
+    for path in _CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # "max" (v2) or a huge number (v1) when unlimited
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+        return None
+    return None
+
+
+def pool_process_memory_mb() -> Optional[int]:
+    """
+    Memory one pool process may use in total so that all of them fit in the
+    container next to their worker processes: what is left after WORKER_MAX_RSS_MB
+    per worker process, split across the WORKER_CONCURRENCY pool processes of each.
+    Without WORKER_MAX_RSS_MB worker and pool processes get equal shares.
+    None outside a memory limited container.
+    """
+    limit = container_memory_mb()
+    if limit is None:
+        return None
+    workers = max(1, settings.WORKER_PROCESSES)
+    pool = workers * max(1, settings.WORKER_CONCURRENCY)
+    if settings.WORKER_MAX_RSS_MB > 0:
+        return (limit - workers * settings.WORKER_MAX_RSS_MB) // pool
+    return limit // (workers + pool)
+
+
+def _statm_mb(field: int) -> int:
+    """Size (0) or resident set (1) of this process from /proc/self/statm, in MB."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[field]) * _PAGE_SIZE // (1024 * 1024)
+
+
+def resolve_limits(handler: Callable, payload) -> Dict[str, int]:
+    """
+    Limits for one run of `handler`. Settings give the defaults, a task file can
+    override them with a module level `RESOURCE_LIMITS` dict and a single task with
+    the `limits` it was created with (stored as `payload["_limits"]`).
+    In a memory limited container `memory_mb` is also capped, unset or not, by the
+    room left in this process's share of it (`pool_process_memory_mb`), so a
+    runaway allocation fails the task before the kernel OOM-kills the pod.
+    """
+    limits = default_limits()
+    for overrides in (
+        getattr(handler, "__globals__", {}).get("RESOURCE_LIMITS"),
+        payload.get("_limits") if isinstance(payload, dict) else None,
+    ):
+        if isinstance(overrides, dict):
+            limits.update({name: int(value) for name, value in overrides.items()
+                           if name in _RLIMITS and value})
+
+    share = pool_process_memory_mb()
+    if share is not None:
+        room = max(share - _statm_mb(1), MIN_MEMORY_MB)
+        limits["memory_mb"] = min(limits.get("memory_mb", room), room)
+    return limits
+
+
+# limits of the handler running in this process, for the SIGXCPU handler
+_active: Dict[str, int] = {}
+
+
+def _raise_cpu_exceeded(signum, frame):
+    raise ResourceLimitExceeded("cpu_seconds", _active.get("cpu_seconds", 0))
+
+
+def apply_limits(limits: Dict[str, int]) -> Callable[[], None]:
+    """
+    Lowers the soft limits of the current process for one handler run and returns
+    a function that restores them. Only soft limits are changed, so the same pool
+    process can run the next task with other limits. RLIMIT_CPU counts the whole
+    life of the process, so the budget is added to the CPU time already used, and
+    likewise `memory_mb` to the address space the process already maps: it is how
+    much the handler may allocate, not the size of the interpreter plus that.
+    """
+    previous = {}
+    try:
+        for name, value in limits.items():
+            rlimit, unit = _RLIMITS[name]
+            soft, hard = resource.getrlimit(rlimit)
+            target = value * unit
+            if name == "cpu_seconds":
+                usage = resource.getrusage(resource.RUSAGE_SELF)
+                target += math.ceil(usage.ru_utime + usage.ru_stime)
+            elif name == "memory_mb":
+                target += _statm_mb(0) * unit
+            if hard != resource.RLIM_INFINITY:
+                target = min(target, hard)
+            resource.setrlimit(rlimit, (target, hard))
+            previous[rlimit] = (soft, hard)
+    except Exception:
+        for rlimit, values in previous.items():
+            resource.setrlimit(rlimit, values)
+        raise
+
+    _active.clear()
+    _active.update(limits)
+    old_handler: Optional[Callable] = None
+    if "cpu_seconds" in limits:
+        old_handler = signal.signal(signal.SIGXCPU, _raise_cpu_exceeded)
+
+    def restore():
+        for rlimit, values in previous.items():
+            resource.setrlimit(rlimit, values)
+        if "cpu_seconds" in limits:
+            signal.signal(signal.SIGXCPU, old_handler or signal.SIG_DFL)
+        _active.clear()
+
+    return restore
@@ -4,13 +4,35 @@ import json
 import signal
 import asyncio
 import os
+import sys
+import time
 
 # Core imports
+from core.config import settings
 from core.redis_client import get_async_redis_client
+from core.result_store import save_result
+from core import codec
+from core.cancellation import CANCEL_CHANNEL, cancel_marker_key
+from core.queues import (
+    priority_queue_keys, queue_key, lease_key, leased_messages_key, completion_key, execution_token_key,
+    DEFAULT_PRIORITY, ENQUEUE_LUA,
+)
+from sqlalchemy import select
+from core import database
+from core.models import Tasks
+from collections import deque
 from .heartbeat import HeartbeatService
-from .task_handler import execute_dynamic_task
-# Import the updated database helper that supports worker_id
-from .utils import update_task_status 
+from .task_handler import execute_dynamic_batch, execute_dynamic_task, teardown_all
+from .batching import TaskBatcher
+from .progress import ProgressWriter
+from .profiling import ProfileWriter
+from .recycling import RECYCLE_EXIT_CODE, RecyclePolicy, metrics_key
+from .startup import StartupClock
+from .process_pool import ProcessPool
+# Batched, write-behind status updates
+from .status_writer import FINAL_STATUSES, StatusWriter
+from core.events import AsyncEventWriter
+from core.models import EventType
 
 # Ensure logs directory exists
 os.makedirs("logs", exist_ok=True)
@@ -27,100 +49,748 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 QUEUE_NAME = "default"
-PROCESSING_QUEUE = f"processing:{QUEUE_NAME}"
+LEASES = lease_key(QUEUE_NAME)
+LEASED_MESSAGES = leased_messages_key(QUEUE_NAME)
+# Level lists from the highest priority down, popped together with one BLMPOP
+QUEUE_KEYS = priority_queue_keys(QUEUE_NAME)
+# Leases are renewed three times per period, a worker has to miss two renewals to lose one
+LEASE_RENEW_INTERVAL_S = settings.WORKER_LEASE_SECONDS / 3
+COMPLETION_MARKER_TTL_S = 86400
+
+# Shared by the scripts below: `expires` is the lease deadline in epoch ms taken from
+# the Redis clock, so workers with skewed clocks agree on it. Leases a message
+# under its task id; messages that are not valid JSON are returned but not leased.
+# A leading version byte (see core/codec.py) is skipped before decoding.
+_LEASE_LUA = """
+local now = redis.call("TIME")
+local expires = now[1] * 1000 + math.floor(now[2] / 1000) + tonumber(ARGV[1])
+local function lease(msg)
+    local body = msg
+    if string.byte(msg, 1) == 1 then
+        body = string.sub(msg, 2)
+    end
+    local ok, decoded = pcall(cjson.decode, body)
+    if ok and type(decoded) == "table" and decoded.task_id then
+        local id = tostring(decoded.task_id)
+        redis.call("ZADD", KEYS[1], expires, id)
+        redis.call("HSET", KEYS[2], id, msg)
+    end
+end
+"""
+
+# Moves up to ARGV[2] messages from the level lists (KEYS[3..], most urgent first)
+# into leases (KEYS[1], KEYS[2]) lasting ARGV[1] ms, in one atomic round trip.
+CLAIM_SCRIPT = _LEASE_LUA + """
+local want = tonumber(ARGV[2])
+local claimed = {}
+for i = 3, #KEYS do
+    local msgs = redis.call("LPOP", KEYS[i], want - #claimed)
+    if msgs then
+        for _, msg in ipairs(msgs) do
+            lease(msg)
+            claimed[#claimed + 1] = msg
+        end
+        if #claimed >= want then
+            break
+        end
+    end
+end
+return claimed
+"""
+
+# Leases a message popped with BLMPOP (ARGV[2]) for ARGV[1] ms.
+LEASE_SCRIPT = _LEASE_LUA + """
+lease(ARGV[2])
+return 1
+"""
+
+# Deletes an execution token (see core.queues.execution_token_key) held by worker `owner`.
+_RELEASE_LUA = """
+local function release(key, owner)
+    if redis.call("GET", key) == owner then
+        redis.call("DEL", key)
+    end
+end
+"""
+
+# Extends the leases of task ids ARGV[3..] that still exist (XX), so a lease that was
+# acked or already reclaimed is never brought back, and the execution tokens that
+# worker ARGV[2] holds for them.
+RENEW_SCRIPT = _LEASE_LUA + """
+for i = 3, #ARGV do
+    redis.call("ZADD", KEYS[1], "XX", expires, ARGV[i])
+    local token = "task:" .. ARGV[i] .. ":running"
+    if redis.call("GET", token) == ARGV[2] then
+        redis.call("PEXPIRE", token, ARGV[1])
+    end
+end
+return 1
+"""
+
+# Execution guard, run before a task starts: -1 if it was already acked (KEYS[1]),
+# 0 if another delivery holds its token (KEYS[2]), 1 once worker ARGV[1] took the
+# token for ARGV[2] ms.
+GUARD_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return -1
+end
+if redis.call("SET", KEYS[2], ARGV[1], "NX", "PX", ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# Ack: drops the lease of task ARGV[1] and records its completion (KEYS[3]) with
+# the final status ARGV[2] for ARGV[3] seconds. O(log N) in the number of leases.
+# The execution token (KEYS[4]) of worker ARGV[4] is released.
+ACK_SCRIPT = _RELEASE_LUA + """
+redis.call("ZREM", KEYS[1], ARGV[1])
+redis.call("HDEL", KEYS[2], ARGV[1])
+redis.call("SET", KEYS[3], ARGV[2], "EX", ARGV[3])
+release(KEYS[4], ARGV[4])
+return 1
+"""
+
+# Drops a duplicate delivery of task ARGV[1] whose run already ended: its lease and
+# leased message, and the execution token (KEYS[3]) if worker ARGV[2] took it.
+DROP_SCRIPT = _RELEASE_LUA + """
+redis.call("ZREM", KEYS[1], ARGV[1])
+redis.call("HDEL", KEYS[2], ARGV[1])
+release(KEYS[3], ARGV[2])
+return 1
+"""
+
+# Hands a claimed message (ARGV[2]) of task ARGV[1] back: drops its lease, releases
+# the execution token (KEYS[4]) of worker ARGV[3] if it started, and puts it back at
+# the head of its level list (KEYS[3]), by deadline if it has one.
+REQUEUE_SCRIPT = _RELEASE_LUA + ENQUEUE_LUA + """
+if redis.call("ZREM", KEYS[1], ARGV[1]) > 0 then
+    redis.call("HDEL", KEYS[2], ARGV[1])
+    release(KEYS[4], ARGV[3])
+    enqueue(KEYS[3], ARGV[2], true)
+    return 1
+end
+return 0
+"""
 
 class AsyncWorker:
-    def __init__(self):
-        # Generate a unique short ID for this worker instance
-        self.worker_id = str(uuid.uuid4())[:8]
+    def __init__(self, concurrency: int = settings.WORKER_CONCURRENCY):
+        self.startup = StartupClock()
+        # Generate a unique short ID for this worker instance, unless the supervisor assigned one
+        self.worker_id = os.environ.get("WORKER_ID") or str(uuid.uuid4())[:8]
         self.running = True
         self.redis_high = None
         self.redis_low = None
-        self.heartbeat = HeartbeatService(self.worker_id)
+        # Under worker.supervisor the supervisor beats for all of its children
+        self.heartbeat = None
+        if not os.environ.get("WORKER_SUPERVISED"):
+            self.heartbeat = HeartbeatService(self.worker_id)
+        # At most `concurrency` tasks run at the same time, a slot is taken before claiming
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._inflight = set()
+        # In-flight tasks that gave their slot back while they wait in a batch opened by another task
+        self._slotless = set()
+        # Messages claimed in a batch but not started yet, as (redis, raw_data).
+        # A batch is capped by the free slots, so everything here starts right away.
+        self.prefetch = max(1, settings.WORKER_PREFETCH_COUNT)
+        self._buffer = deque()
+        # redis client -> registered Lua scripts by name
+        self._scripts = {}
+        # task_id -> instance it was claimed from, for every task past the buffer
+        self._held = {}
+        self.lease_ms = settings.WORKER_LEASE_SECONDS * 1000
+        self._lease_renewer = None
+        # Blocking claims still running, at most one per instance
+        self._waiters = {}
+        # High messages taken in a row while low may have been waiting
+        self.high_low_ratio = settings.WORKER_HIGH_LOW_RATIO
+        self._high_streak = 0
+        self.status_writer = StatusWriter()
+        # Set by request_shutdown, wakes the claim loop so draining starts right away
+        self._stopping = asyncio.Event()
+        # Tasks whose handler is running, the only ones cancelled when the drain grace runs out
+        self._executing = set()
+        self.handed_back = 0
+        # task_id -> asyncio task running it, to find the task a cancel message is about
+        self._by_task_id = {}
+        self._cancel_requested = set()
+        self._cancel_listener = None
+        self.events = AsyncEventWriter()
+        # Sync handlers run in child processes instead of the thread pool when enabled
+        self.process_pool = None
+        if settings.HANDLER_EXECUTOR == "process":
+            self.process_pool = ProcessPool(self.concurrency, settings.HANDLER_PROCESS_MAX_TASKS)
+        # Groups tasks of titles that define handler_batch, each batch runs in the slot of its first task
+        self.batcher = TaskBatcher(self._run_batch, on_join=self._give_back_slot)
+        # Coalesced progress reports of running handlers, written to the low instance
+        self.progress = ProgressWriter()
+        # Profiles of the PROFILE_SAMPLE_RATE sampled tasks, written to the low instance
+        self.profiles = ProfileWriter(self.worker_id)
+        # Drains and exits after WORKER_MAX_TASKS tasks or above WORKER_MAX_RSS_MB
+        self.recycle = RecyclePolicy()
+        self.recycle_reason = None
+        self._metrics_reporter = None
 
     async def start(self):
         logger.info(f"Async worker:{self.worker_id} starting up on TaskFlow cluster...")
         
         self.redis_high = await get_async_redis_client("high")
         self.redis_low = await get_async_redis_client("low")
+        for redis in (self.redis_high, self.redis_low):
+            self._scripts[redis] = {name: redis.register_script(script) for name, script in (
+                ("claim", CLAIM_SCRIPT), ("lease", LEASE_SCRIPT), ("renew", RENEW_SCRIPT),
+                ("ack", ACK_SCRIPT), ("requeue", REQUEUE_SCRIPT), ("guard", GUARD_SCRIPT),
+                ("drop", DROP_SCRIPT),
+            )}
         
+        await self.status_writer.start()
+        await self.events.start()
+        await self.progress.start(self.redis_low)
+        self.profiles.start(self.redis_low)
+        if self.process_pool:
+            await asyncio.gather(self._warm_up(), self.process_pool.start())
+        else:
+            await self._warm_up()
+
         # Start the heartbeat so the Leader knows this worker is alive
-        await self.heartbeat.start()
+        if self.heartbeat:
+            await self.heartbeat.start(self.redis_high)
+        self._cancel_listener = asyncio.create_task(self._listen_for_cancels())
+        self._lease_renewer = asyncio.create_task(self._renew_leases())
+        self._metrics_reporter = asyncio.create_task(self._report_metrics())
 
-        logger.info(f"Worker:{self.worker_id} listening for tasks on Redis.")
+        self.startup.mark("startup_ready_ms")
+        logger.info(f"Worker:{self.worker_id} listening for tasks on Redis "
+                    f"(concurrency={self.concurrency}, ready "
+                    f"{self.startup.get('startup_ready_ms')} ms after process start).")
         
         while self.running:
+            # Never claim more than we can start right away
+            if not await self._acquire_slot():
+                break
             try:
-                raw_data = None
-                # Atomically move task from main queue to processing queue
-                raw_data = await self.redis_high.brpoplpush(QUEUE_NAME, PROCESSING_QUEUE, 1)
-                
-                if not raw_data:
-                    raw_data = await self.redis_low.brpoplpush(QUEUE_NAME, PROCESSING_QUEUE, 1)
-
-                if raw_data:
-                    try:
-                        data = json.loads(raw_data)
-                    except json.JSONDecodeError:
-                        logger.error(f"Worker:{self.worker_id} failed to decode JSON")
-                        await self._cleanup_malformed(raw_data)
-                        continue
-
-                    task_id = data.get('task_id')
-                    task_title = data.get('title')
-                    payload = data.get('payload') 
-
-                    logger.info(f"Worker:{self.worker_id} claiming Task: {task_id}")
-
-                    try:
-                        # --- THE CRITICAL FIX ---
-                        # Pass self.worker_id so the Leader's PEL scanner sees this task is claimed
-                        await update_task_status(task_id, "IN_PROGRESS", self.worker_id)
-
-                        # Execute the dynamically loaded script
-                        await execute_dynamic_task(task_title, payload)
-                        
-                        logger.info(f"Task {task_id} COMPLETED successfully.")
-                        await update_task_status(task_id, "COMPLETED")
-                        
-                    except Exception as e:
-                        logger.error(f"Execution failed for Task {task_id}: {str(e)}")
-                        # Mark as failed in DB
-                        await update_task_status(task_id, "FAILED")
-                    
-                    finally:
-                        # Task is finished (success or fail), remove from processing queue
-                        await self._remove_from_processing(raw_data)
-
+                message = await self._next_message()
             except Exception as e:
+                self._slots.release()
                 if self.running:
                     logger.error(f"Worker {self.worker_id} Loop Error: {e}")
                     await asyncio.sleep(2)
+                continue
+
+            if not message:
+                self._slots.release()
+                continue
+            if not self.running:
+                # claimed while the drain started, hand it back with the rest of the buffer
+                self._buffer.appendleft(message)
+                self._slots.release()
+                break
 
-        # Shutdown Logic
-        logger.info(f"Worker:{self.worker_id} gracefully shutting down...")
-        await self.heartbeat.stop()
+            task = asyncio.create_task(self._process(*message))
+            self._inflight.add(task)
+            task.add_done_callback(self._task_done)
+            if self.startup.mark("cold_start_ms"):
+                logger.info(f"Worker:{self.worker_id} claimed its first task "
+                            f"{self.startup.get('cold_start_ms')} ms after process start")
+                asyncio.create_task(self._publish_metrics())
+
+        await self._drain()
+        self._cancel_listener.cancel()
+        self._lease_renewer.cancel()
+        self._metrics_reporter.cancel()
+        await asyncio.gather(self._cancel_listener, self._lease_renewer, self._metrics_reporter,
+                             return_exceptions=True)
+        await self._publish_metrics()
+        await self.batcher.stop()
+        if self.process_pool:
+            await self.process_pool.stop()
+        # teardown() of every task file loaded in this process, off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, teardown_all)
+        await self.status_writer.stop()
+        await self.events.stop()
+        await self.progress.stop()
+        await self.profiles.stop()
+        if self.heartbeat:
+            await self.heartbeat.stop()
         if self.redis_low: await self.redis_low.aclose()
         if self.redis_high: await self.redis_high.aclose()
 
-    async def _remove_from_processing(self, raw_data):
-        """Clean up the processing queue in both Redis instances"""
+    async def _warm_up(self):
+        """
+        Opens what the first task needs concurrently instead of one after another
+        on first use: a connection to each Redis instance with every Lua script
+        already loaded, and the async database engine with one pooled connection.
+        Failures are only logged, the same work is retried on first use.
+        """
+        async def load_scripts(redis):
+            async with redis.pipeline(transaction=False) as pipe:
+                for script in self._scripts[redis].values():
+                    pipe.script_load(script.script)
+                await pipe.execute()
+
+        async def connect_database():
+            # building the engine imports the asyncpg dialect, keep that off the loop
+            engine = await asyncio.to_thread(getattr, database, "async_engine")
+            async with engine.connect():
+                pass
+
+        results = await asyncio.gather(
+            load_scripts(self.redis_high), load_scripts(self.redis_low), connect_database(),
+            return_exceptions=True,
+        )
+        for name, result in zip(("high Redis", "low Redis", "database"), results):
+            if isinstance(result, Exception):
+                logger.warning(f"Worker {self.worker_id} could not warm up the {name} connection: {result}")
+
+    async def _acquire_slot(self) -> bool:
+        """Waits for a free slot, returns False instead if shutdown was requested meanwhile."""
+        acquire = asyncio.ensure_future(self._slots.acquire())
+        stop = asyncio.ensure_future(self._stopping.wait())
+        await asyncio.wait({acquire, stop}, return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        if not acquire.done():
+            acquire.cancel()
+            return False
+        if not self.running:
+            self._slots.release()
+            return False
+        return True
+
+    async def _drain(self):
+        """
+        Shutdown after SIGTERM (e.g. a KEDA scale-in). No new messages are claimed,
+        prefetched ones go straight back to the head of their queue, in-flight tasks
+        get DRAIN_GRACE_SECONDS to finish, and handlers still running after that are
+        cancelled and their messages handed back, so another worker picks them up
+        immediately instead of after the reclaimer notices them.
+        """
+        logger.info(f"Worker:{self.worker_id} draining...")
+        await self._requeue_buffered()
+        if not self._inflight:
+            return
+
+        logger.info(f"Worker:{self.worker_id} waiting up to {settings.DRAIN_GRACE_SECONDS}s "
+                    f"for {len(self._inflight)} in-flight tasks")
+        await asyncio.wait(self._inflight, timeout=settings.DRAIN_GRACE_SECONDS)
+
+        if self._executing:
+            logger.warning(f"Worker:{self.worker_id} handing back {len(self._executing)} unfinished tasks")
+            for task in self._executing:
+                task.cancel()
+        # tasks already past their handler only have status/ack writes left
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _hand_back(self, redis, raw_data, task_id, priority):
+        """Returns a message whose handler was cancelled by the drain to the head of its queue."""
+        try:
+            # status first, so it cannot overwrite the IN_PROGRESS of the next worker
+            await self.status_writer.set_status(task_id, "QUEUED")
+            await self._requeue(redis, raw_data, task_id, priority)
+            self.events.record(task_id, EventType.QUEUED, f"handed back by draining worker {self.worker_id}")
+            self.handed_back += 1
+        except Exception:
+            # the lease is still there, the reclaimer will return it once it expires
+            logger.exception(f"Failed to hand back Task {task_id}")
+
+    async def _listen_for_cancels(self):
+        """Stops running tasks whose cancellation is published by POST /tasks/{id}/cancel."""
+        pubsub = self.redis_high.pubsub()
+        try:
+            await pubsub.subscribe(CANCEL_CHANNEL)
+            while True:
+                try:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                except Exception as e:
+                    logger.error(f"Worker {self.worker_id} cancel listener error: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                if not message:
+                    continue
+                try:
+                    task_id = int(message["data"])
+                except (KeyError, TypeError, ValueError):
+                    # anyone with access to Redis can publish, a bad message must not stop cancels
+                    logger.warning(f"Worker {self.worker_id} ignoring cancel message {message!r}")
+                    continue
+                self._cancel_running(task_id)
+        finally:
+            await pubsub.aclose()
+
+    def _cancel_running(self, task_id: int):
+        task = self._by_task_id.get(task_id)
+        # only while the handler runs, once it returned the result is kept
+        if task is None or task not in self._executing:
+            return
+        logger.info(f"Worker:{self.worker_id} cancelling Task: {task_id}")
+        self._cancel_requested.add(task_id)
+        task.cancel()
+
+    async def _record_cancelled(self, task_id, message: str):
+        await self.status_writer.set_status(task_id, "CANCELLED")
+        self.events.record(task_id, EventType.CANCELLED, message)
+
+    def _task_done(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        if task in self._slotless:
+            self._slotless.discard(task)
+        else:
+            self._slots.release()
+        reason = self.recycle.task_done()
+        if reason:
+            self._start_recycle(reason)
+
+    def _start_recycle(self, reason: str):
+        """
+        Replaces this process before leaked handler state piles up: it drains like
+        on SIGTERM and exits with RECYCLE_EXIT_CODE, the supervisor (or Kubernetes,
+        without one) starts a fresh one.
+        """
+        if not self.running:
+            return
+        logger.info(f"Worker:{self.worker_id} recycling, it {reason}")
+        self.recycle_reason = reason
+        self.request_shutdown()
+
+    async def _report_metrics(self):
+        """Checks the RSS limit and publishes the worker's metrics every WORKER_METRICS_INTERVAL_SECONDS."""
+        while True:
+            await asyncio.sleep(settings.WORKER_METRICS_INTERVAL_SECONDS)
+            reason = self.recycle.check_memory()
+            await self._publish_metrics()
+            if reason:
+                self._start_recycle(reason)
+
+    async def _publish_metrics(self):
+        """Tasks run and RSS growth, in `worker:{id}:metrics` on the high instance."""
+        metrics = self.recycle.snapshot()
+        metrics.update(self.startup.snapshot())
+        metrics["concurrency"] = self.concurrency
+        metrics["inflight"] = len(self._inflight)
+        if self.recycle_reason:
+            metrics["recycle_reason"] = self.recycle_reason
+        key = metrics_key(self.worker_id)
+        try:
+            async with self.redis_high.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=metrics)
+                pipe.expire(key, settings.WORKER_METRICS_INTERVAL_SECONDS * 3)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id} failed to publish metrics: {e}")
+
+    def _give_back_slot(self):
+        """
+        Called by a task that joins a batch opened by another one: the batch runs in
+        the opener's slot, so this one frees its own and more tasks can be claimed
+        to fill the batch. Bounded, as every open batch holds one slot.
+        """
+        task = asyncio.current_task()
+        if task in self._inflight and task not in self._slotless:
+            self._slotless.add(task)
+            self._slots.release()
+
+    async def _run_batch(self, task_title, digest, payloads):
+        return await execute_dynamic_batch(task_title, digest, payloads, self.process_pool)
+
+    async def _next_message(self):
+        """
+        Returns the next (redis, raw_data) to run. Served from the local buffer when
+        possible, otherwise claims as many messages as there are free slots (up to
+        WORKER_PREFETCH_COUNT) in one round trip per instance, following the
+        high:low ratio. Falls back to waiting on both instances at once when empty.
+        """
+        self._collect_waiters()
+        if self._buffer:
+            return self._buffer.popleft()
+
+        # the caller already holds one slot, so at least one credit is available
+        credits = min(self.prefetch, self.concurrency - len(self._inflight) + len(self._slotless))
+        for redis, limit in self._claim_plan(credits):
+            want = min(limit, credits - len(self._buffer))
+            if want <= 0:
+                break
+            claimed = await self._scripts[redis]["claim"](
+                keys=[LEASES, LEASED_MESSAGES, *QUEUE_KEYS], args=[self.lease_ms, want]
+            )
+            for raw_data in claimed or []:
+                self._buffer_claimed(redis, raw_data)
+        if self._buffer:
+            return self._buffer.popleft()
+
+        await self._wait_for_messages()
+        if self._buffer:
+            return self._buffer.popleft()
+        return None
+
+    def _claim_plan(self, credits: int):
+        """
+        Order in which the instances are asked for messages. Up to
+        WORKER_HIGH_LOW_RATIO high messages are taken in a row while low has work,
+        then low gets a turn, so low priority work is slowed down but never starved.
+        """
+        if self.high_low_ratio <= 0:
+            return [(self.redis_high, credits), (self.redis_low, credits)]
+        owed = self.high_low_ratio - self._high_streak
+        if owed <= 0:
+            return [(self.redis_low, credits), (self.redis_high, credits)]
+        # high up to its share, then low, then high again if low was empty
+        return [(self.redis_high, min(credits, owed)), (self.redis_low, credits),
+                (self.redis_high, credits)]
+
+    def _buffer_claimed(self, redis, raw_data):
+        self._buffer.append((redis, raw_data))
+        if redis is self.redis_high:
+            self._high_streak += 1
+        else:
+            self._high_streak = 0
+
+    async def _wait_for_messages(self):
+        """
+        Blocks on both instances at the same time, so an idle worker picks up a
+        message from either within milliseconds. A wait is never cancelled, since
+        that could drop a message already popped server side; the slower one keeps
+        running and its message is buffered by a later call.
+        """
+        for redis in (self.redis_high, self.redis_low):
+            if redis not in self._waiters:
+                self._waiters[redis] = asyncio.create_task(self._claim(redis))
+        stop = asyncio.ensure_future(self._stopping.wait())
+        await asyncio.wait([*self._waiters.values(), stop], return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        self._collect_waiters()
+
+    def _collect_waiters(self):
+        """Moves messages from finished blocking waits into the buffer."""
+        for redis, waiter in list(self._waiters.items()):
+            if not waiter.done():
+                continue
+            del self._waiters[redis]
+            if waiter.exception():
+                logger.error(f"Worker {self.worker_id} blocking claim failed: {waiter.exception()}")
+            elif waiter.result():
+                self._buffer_claimed(redis, waiter.result())
+
+    async def _requeue_buffered(self):
+        """Gives claimed messages that never started back to the head of their queue."""
+        if self._waiters:
+            await asyncio.wait(self._waiters.values())
+            self._collect_waiters()
+        # newest first, so putting each back at the head restores the original order
+        while self._buffer:
+            redis, raw_data = self._buffer.pop()
+            try:
+                data = codec.decode(raw_data)
+            except json.JSONDecodeError:
+                continue
+            try:
+                await self._requeue(redis, raw_data, data.get('task_id'),
+                                    data.get('priority', DEFAULT_PRIORITY))
+            except Exception:
+                logger.exception("Failed to requeue a prefetched message")
+
+    async def _requeue(self, redis, raw_data, task_id, priority):
+        await self._scripts[redis]["requeue"](
+            keys=[LEASES, LEASED_MESSAGES, queue_key(QUEUE_NAME, priority), execution_token_key(task_id)],
+            args=[task_id, raw_data, self.worker_id],
+        )
+
+    async def _process(self, redis, raw_data):
+        """Runs a single claimed message end to end: status updates, execution and ack."""
         try:
-            await self.redis_low.lrem(PROCESSING_QUEUE, 0, raw_data)
-            await self.redis_high.lrem(PROCESSING_QUEUE, 0, raw_data)
+            data = codec.decode(raw_data)
+        except json.JSONDecodeError:
+            # never leased, dropping it from the buffer is all the cleanup there is
+            logger.error(f"Worker:{self.worker_id} dropping a message that is not valid JSON")
+            return
+
+        task_id = data.get('task_id')
+        task_title = data.get('title')
+        payload = data.get('payload') 
+        deadline = data.get('deadline')
+
+        # before any status is written: a duplicate of a finished task is dropped here
+        if not await self._take_execution_token(redis, task_id):
+            return
+
+        if deadline and time.time() > deadline:
+            logger.info(f"Worker:{self.worker_id} skipping Task: {task_id}, deadline passed")
+            await self.status_writer.set_status(task_id, "EXPIRED")
+            await self._ack(redis, task_id, "EXPIRED")
+            return
+
+        try:
+            cancelled = await self.redis_high.exists(cancel_marker_key(task_id))
         except Exception:
-            logger.exception("Failed to remove item from processing queue")
+            logger.exception(f"Failed to check cancellation of Task {task_id}")
+            cancelled = False
+        if cancelled:
+            logger.info(f"Worker:{self.worker_id} skipping Task: {task_id}, cancelled")
+            await self._record_cancelled(task_id, "Cancelled before it started")
+            await self._ack(redis, task_id, "CANCELLED")
+            return
+
+        logger.info(f"Worker:{self.worker_id} claiming Task: {task_id}")
+        outcome = None
+        self._by_task_id[task_id] = asyncio.current_task()
+        # its lease is renewed until the ack
+        self._held[task_id] = redis
 
-    async def _cleanup_malformed(self, raw_data):
-        """Remove messages that cannot be parsed as JSON"""
         try:
-            await self.redis_low.lrem(PROCESSING_QUEUE, 0, raw_data)
-            await self.redis_high.lrem(PROCESSING_QUEUE, 0, raw_data)
+            # --- THE CRITICAL FIX ---
+            # Pass self.worker_id so the Leader's PEL scanner sees this task is claimed
+            # Not awaited: written with the next batch, or replaced by the final status
+            await self.status_writer.set_status(task_id, "IN_PROGRESS", self.worker_id, wait=False)
+            self.events.record(task_id, EventType.PICKED_UP, f"worker {self.worker_id}")
+
+            # Execute the dynamically loaded script
+            self._executing.add(asyncio.current_task())
+            try:
+                result = await execute_dynamic_task(
+                    task_title, payload, self.process_pool, self.redis_high, self.batcher,
+                    self.progress.reporter(task_id), self.profiles.sample(task_id),
+                )
+            except asyncio.CancelledError:
+                if task_id in self._cancel_requested:
+                    asyncio.current_task().uncancel()
+                    self._cancel_requested.discard(task_id)
+                    logger.info(f"Task {task_id} CANCELLED while running.")
+                    await self._record_cancelled(task_id, f"Stopped on worker {self.worker_id}")
+                    outcome = "CANCELLED"
+                    return
+                if self.running:
+                    raise
+                # drain grace ran out, another worker runs it from the start
+                asyncio.current_task().uncancel()
+                await self._hand_back(redis, raw_data, task_id, data.get('priority', DEFAULT_PRIORITY))
+                return
+            finally:
+                self._executing.discard(asyncio.current_task())
+            # stored before COMPLETED so the result can be fetched as soon as the status says so
+            await save_result(self.redis_low, task_id, result)
+            
+            logger.info(f"Task {task_id} COMPLETED successfully.")
+            await self.status_writer.set_status(task_id, "COMPLETED")
+            self.events.record(task_id, EventType.COMPLETED)
+            outcome = "COMPLETED"
+            
+        except Exception as e:
+            logger.error(f"Execution failed for Task {task_id}: {str(e)}")
+            outcome = "FAILED"
+            # Mark as failed in DB
+            try:
+                await self.status_writer.set_status(task_id, "FAILED")
+                self.events.record(task_id, EventType.FAILED, str(e))
+            except Exception:
+                logger.exception(f"Failed to mark Task {task_id} as FAILED")
+        
+        finally:
+            self._by_task_id.pop(task_id, None)
+            self._held.pop(task_id, None)
+            # Task is finished (success or fail), release its lease. Handed back tasks
+            # have no outcome, their lease was already turned back into a queue entry.
+            if outcome:
+                await self._ack(redis, task_id, outcome)
+
+    async def _take_execution_token(self, redis, task_id) -> bool:
+        """
+        Completion guard. The reclaimer, the reconciliation loop and the PEL scanner
+        can each push a task again while it still runs elsewhere or after it
+        finished; such a duplicate delivery is dropped here before its handler runs.
+        The token is taken atomically in Redis, then the DB status is checked for
+        runs whose completion marker has already expired.
+        """
+        try:
+            taken = await self._scripts[redis]["guard"](
+                keys=[completion_key(task_id), execution_token_key(task_id)],
+                args=[self.worker_id, self.lease_ms],
+            )
+        except Exception:
+            # without the guard a duplicate may run, never drop the task because of it
+            logger.exception(f"Failed to take the execution token of Task {task_id}")
+            return True
+        if taken == 0:
+            # the other delivery owns the lease and acks it
+            logger.warning(f"Worker:{self.worker_id} dropping duplicate of Task {task_id}, it is running elsewhere")
+            return False
+
+        status = None
+        if taken == 1:
+            try:
+                async with database.AsyncSessionLocal() as session:
+                    status = (await session.execute(
+                        select(Tasks.status).where(Tasks.id == task_id)
+                    )).scalar()
+            except Exception:
+                logger.exception(f"Failed to check the status of Task {task_id}")
+        # a delivery of a task in a final state is a duplicate, its handler never runs again
+        if taken == 1 and status not in FINAL_STATUSES:
+            return True
+
+        logger.warning(f"Worker:{self.worker_id} dropping duplicate of Task {task_id}, it already finished")
+        try:
+            await self._scripts[redis]["drop"](
+                keys=[LEASES, LEASED_MESSAGES, execution_token_key(task_id)],
+                args=[task_id, self.worker_id],
+            )
+        except Exception:
+            logger.exception(f"Failed to drop the duplicate of Task {task_id}")
+        return False
+
+    async def _claim(self, redis):
+        """
+        Blocks up to a second for the most urgent message across all priority levels
+        with a single BLMPOP and leases it. Only used when the queues were empty, a
+        crash between the pop and the lease leaves the task QUEUED in the DB for the
+        reconciliation loop.
+        """
+        result = await redis.blmpop(1, len(QUEUE_KEYS), *QUEUE_KEYS, direction="LEFT", count=1)
+        if not result:
+            return None
+        raw_data = result[1][0]
+        await self._scripts[redis]["lease"](keys=[LEASES, LEASED_MESSAGES], args=[self.lease_ms, raw_data])
+        return raw_data
+
+    async def _ack(self, redis, task_id, status: str):
+        """Releases the task's lease on the instance it was claimed from and marks it done."""
+        try:
+            await self._scripts[redis]["ack"](
+                keys=[LEASES, LEASED_MESSAGES, completion_key(task_id), execution_token_key(task_id)],
+                args=[task_id, status, COMPLETION_MARKER_TTL_S, self.worker_id],
+            )
         except Exception:
-            logger.exception("Failed to remove malformed message")
+            logger.exception(f"Failed to ack Task {task_id}")
+
+    async def _renew_leases(self):
+        """
+        Extends the leases of every task this worker holds, running or prefetched,
+        with one call per instance every LEASE_RENEW_INTERVAL_S. A worker that stops
+        renewing (crash, network partition) loses its tasks to the reclaimer once
+        WORKER_LEASE_SECONDS have passed.
+        """
+        while True:
+            await asyncio.sleep(LEASE_RENEW_INTERVAL_S)
+            held = {self.redis_high: [], self.redis_low: []}
+            for task_id, redis in self._held.items():
+                held[redis].append(task_id)
+            for redis, raw_data in self._buffer:
+                try:
+                    held[redis].append(codec.decode(raw_data)["task_id"])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+            for redis, task_ids in held.items():
+                if not task_ids:
+                    continue
+                try:
+                    await self._scripts[redis]["renew"](
+                        keys=[LEASES], args=[self.lease_ms, self.worker_id, *task_ids]
+                    )
+                except Exception as e:
+                    logger.error(f"Worker {self.worker_id} failed to renew leases: {e}")
 
     def request_shutdown(self):
         self.running = False
+        self._stopping.set()
 
 async def main():
     worker = AsyncWorker()
@@ -129,9 +799,33 @@ async def main():
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, worker.request_shutdown)
     await worker.start()
+    exit_code = RECYCLE_EXIT_CODE if worker.recycle_reason else 0
+    if worker.handed_back and not worker.process_pool:
+        # Cancelled sync handlers may still be running in executor threads, which
+        # asyncio.run() would wait for. Their tasks are already back in the queue.
+        logging.shutdown()
+        os._exit(exit_code)
+    return exit_code
 
-if __name__ == "__main__":
+def event_loop_factory():
+    """Loop selected by WORKER_EVENT_LOOP, None for the default asyncio loop."""
+    if settings.WORKER_EVENT_LOOP != "uvloop":
+        return None
     try:
-        asyncio.run(main())
+        import uvloop
+    except ImportError:
+        logger.warning("WORKER_EVENT_LOOP is uvloop but uvloop is not installed, using asyncio")
+        return None
+    return uvloop.new_event_loop
+
+def run():
+    """Runs the worker until it is stopped, see worker/run_worker.py."""
+    try:
+        with asyncio.Runner(loop_factory=event_loop_factory()) as runner:
+            sys.exit(runner.run(main()))
     except KeyboardInterrupt:
-        pass
\ No newline at end of file
+        pass
+
+if __name__ == "__main__":
+    # works, but every process pool child imports this module again: use worker.run_worker
+    run()
@@ -0,0 +1,286 @@
+import asyncio
+import contextlib
+import errno
+import logging
+import multiprocessing
+import pickle
+import time
+from typing import Any, Callable, Optional
+
+from core.config import settings
+from .limits import ResourceLimitExceeded, apply_limits, resolve_limits
+from .task_handler import batch_handler, handler_kwargs, load_task_handler, task_context, teardown_all
+from .profiling import Measurement
+from .progress import progress_state
+
+logger = logging.getLogger(__name__)
+
+# Children are forked from a small fork server instead of the worker itself, so they
+# do not inherit the event loop or open Redis/DB sockets. The server preloads this
+# module and what it imports. A child still imports the worker's main module again
+# (multiprocessing always does), which is why the worker is started through the
+# import-free worker/run_worker.py: then a child starts in a few ms.
+_CONTEXT = multiprocessing.get_context("forkserver")
+_CONTEXT.set_forkserver_preload(["worker.process_pool"])
+
+
+def _child_main(conn):
+    """
+    Entry point of a pool process. Serves one request at a time until the parent
+    sends None or closes the pipe. Messages are pickled with the highest protocol
+    so large payloads/results are copied once instead of going through the default
+    protocol's intermediate buffers.
+    """
+    try:
+        _serve(conn)
+    finally:
+        teardown_all()
+
+
+def _serve(conn):
+    while True:
+        try:
+            request = pickle.loads(conn.recv_bytes())
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+
+        task_title, digest, payload, batch, report, profile = request
+        handler, error = load_task_handler(task_title, digest)
+        if not error and batch:
+            handler = batch_handler(handler)
+            if handler is None:
+                error = "Missing 'handler_batch' function"
+        context = task_context(task_title)
+        if not error:
+            try:
+                context.get()
+            except Exception as e:
+                error = f"init() failed: {e}"
+        if error:
+            response = ("error", f"Loading Error: {error}")
+        else:
+            progress = _PipeProgress(conn) if report else None
+            context.acquire()
+            try:
+                # nothing else runs in this process, so the whole of it is the handler's
+                with Measurement(isolated=True) if profile else contextlib.nullcontext() as measurement:
+                    response = _run_limited(handler, payload, handler_kwargs(handler, progress, context))
+            finally:
+                context.release()
+            if progress:
+                progress.flush()
+            if profile:
+                conn.send_bytes(pickle.dumps(("profile", measurement.profile)))
+
+        try:
+            data = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = pickle.dumps(("error", f"Result is not serializable: {e}"))
+        conn.send_bytes(data)
+
+
+class _PipeProgress:
+    """
+    `progress` callback of a handler in a pool process. Reports are sent to the
+    parent over the request pipe, at most one per PROGRESS_FLUSH_INTERVAL_MS; the
+    last one is sent before the response.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.interval = settings.PROGRESS_FLUSH_INTERVAL_MS / 1000
+        self.sent_at = 0.0
+        self.unsent = None
+
+    def __call__(self, done, total=None, message=None):
+        self.unsent = progress_state(done, total, message)
+        if time.monotonic() - self.sent_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.unsent is not None:
+            self.conn.send_bytes(pickle.dumps(("progress", self.unsent)))
+            self.sent_at = time.monotonic()
+            self.unsent = None
+
+
+def _run_limited(handler, payload, kwargs=None):
+    """
+    Runs the handler under its resource limits. A violation is answered with
+    "limit" so the parent reports it as such and replaces this process, whose
+    state after a failed allocation cannot be trusted.
+    """
+    limits = resolve_limits(handler, payload)
+    try:
+        restore = apply_limits(limits)
+    except (ValueError, OSError) as e:
+        return ("error", f"Invalid resource limits {limits}: {e}")
+    try:
+        return ("ok", handler(payload, **(kwargs or {})))
+    except ResourceLimitExceeded as e:
+        return ("limit", (e.limit, e.value))
+    except MemoryError:
+        if "memory_mb" in limits:
+            return ("limit", ("memory_mb", limits["memory_mb"]))
+        return ("error", "MemoryError")
+    except OSError as e:
+        if e.errno == errno.EMFILE and "open_files" in limits:
+            return ("limit", ("open_files", limits["open_files"]))
+        return ("error", f"{type(e).__name__}: {e}")
+    except Exception as e:
+        return ("error", f"{type(e).__name__}: {e}")
+    finally:
+        restore()
+
+
+class _Child:
+    def __init__(self):
+        self.conn, child_conn = _CONTEXT.Pipe()
+        self.process = _CONTEXT.Process(target=_child_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks_run = 0
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send_bytes(pickle.dumps(None))
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ProcessPool:
+    """
+    Runs sync task handlers in a pool of child processes.
+
+    Unlike the default thread pool, CPU-bound handlers are not serialized by the
+    GIL, and a handler that exceeds its timeout is stopped by killing its process
+    instead of leaking a thread. Every child is replaced after `max_tasks_per_child`
+    tasks so state leaked by handler modules does not pile up.
+    """
+    def __init__(self, size: int, max_tasks_per_child: int = 50):
+        self.size = max(1, size)
+        self.max_tasks_per_child = max(1, max_tasks_per_child)
+        self._idle: Optional[asyncio.Queue] = None
+        self._children = set()
+        self._background = set()
+        self._running = False
+
+    async def start(self):
+        self._idle = asyncio.Queue()
+        self._running = True
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        logger.info(f"Process pool started with {self.size} children")
+
+    async def _spawn(self):
+        loop = asyncio.get_running_loop()
+        # Process.start() blocks while the fork server forks, keep the loop free
+        child = await loop.run_in_executor(None, _Child)
+        if not self._running:
+            await loop.run_in_executor(None, child.close)
+            return
+        self._children.add(child)
+        self._idle.put_nowait(child)
+
+    async def _retire(self, child: _Child, kill: bool = False):
+        self._children.discard(child)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, child.kill if kill else child.close)
+        if self._running:
+            await self._spawn()
+
+    async def _recv(self, child: _Child):
+        """Waits for the child's answer without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        fd = child.conn.fileno()
+        ready = loop.create_future()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+        return pickle.loads(child.conn.recv_bytes())
+
+    async def _recv_answer(self, child: _Child, progress: Optional[Callable],
+                           profile: Optional[Callable[[dict], None]] = None):
+        """
+        Waits for the final answer, passing progress reports sent before it on to
+        `progress` and the measurement of a profiled call to `profile`.
+        """
+        while True:
+            status, value = await self._recv(child)
+            if status == "progress":
+                if progress:
+                    progress.report_state(value)
+            elif status == "profile":
+                if profile:
+                    profile(value)
+            else:
+                return status, value
+
+    async def run(self, task_title: str, payload: Any, timeout: float, digest: Optional[str] = None,
+                  batch: bool = False, progress=None, profile: Optional[Callable[[dict], None]] = None) -> Any:
+        """
+        Executes `handler(payload)` of the task file in a pool process, from the
+        node-local code of version `digest` when it is given. With `batch` calls
+        `handler_batch(payload)` with a list of payloads instead. With `progress`
+        (a ProgressReporter) the handler gets a `progress` callback. With `profile`
+        the call is measured in the pool process (see worker/profiling.py) and the
+        profile passed to it.
+        Raises asyncio.TimeoutError after `timeout` seconds, by then the process
+        running the handler has been killed and is being replaced, and
+        ResourceLimitExceeded when the handler went over its resource limits.
+        """
+        if not self._running:
+            raise RuntimeError("Process pool is not running")
+
+        child = await self._idle.get()
+        answered = False
+        try:
+            child.conn.send_bytes(pickle.dumps((task_title, digest, payload, batch, progress is not None,
+                                                profile is not None), protocol=pickle.HIGHEST_PROTOCOL))
+            try:
+                status, value = await asyncio.wait_for(self._recv_answer(child, progress, profile), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Killing pool process {child.process.pid} running '{task_title}' after {timeout}s")
+                raise
+            except (EOFError, OSError):
+                raise Exception(f"Handler process exited unexpectedly (exit code {child.process.exitcode})")
+
+            answered = True
+            child.tasks_run += 1
+            if status == "limit":
+                # never reuse a process that hit its limits
+                child.tasks_run = self.max_tasks_per_child
+                raise ResourceLimitExceeded(*value)
+            if status == "error":
+                raise Exception(value)
+            return value
+        finally:
+            if answered and child.tasks_run < self.max_tasks_per_child:
+                self._idle.put_nowait(child)
+            else:
+                # Timed out, crashed, cancelled or used up: replace it in the background
+                retire = asyncio.create_task(self._retire(child, kill=not answered))
+                self._background.add(retire)
+                retire.add_done_callback(self._background.discard)
+
+    async def stop(self):
+        self._running = False
+        loop = asyncio.get_running_loop()
+        children, self._children = list(self._children), set()
+        await asyncio.gather(*(loop.run_in_executor(None, c.close) for c in children),
+                             return_exceptions=True)
+        logger.info("Process pool stopped")
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional, Set
+
+from core import codec
+from core.config import settings
+from core.profiles import profiles_key
+
+logger = logging.getLogger(__name__)
+
+# tracemalloc is per process, only one measurement at a time traces memory
+_tracing = threading.Lock()
+# allocations made by the tracing itself and the import machinery, not the handler.
+# Dropped from the per-line statistics, filtering the raw traces costs far more.
+_IGNORED_FILES = frozenset((
+    tracemalloc.__file__,
+    __file__,
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+    "<unknown>",
+))
+
+
+class Measurement:
+    """
+    Wall time, CPU time, peak traced memory and top allocation sites of one
+    handler call, made with `with Measurement(): ...`. The result is in `profile`
+    and passed to `on_done` when the block exits, also when it raised.
+
+    CPU time is read from `cpu_clock`: time.thread_time around a sync handler
+    counts its own thread only, time.process_time around an async one also counts
+    whatever else ran on the event loop meanwhile. Memory is traced with
+    tracemalloc, which sees the whole process; `isolated` says that nothing else
+    ran in it (a pool process). `top_allocations` are the lines holding the most
+    memory when the call returns, memory freed before that only shows in the
+    peak. If another measurement in the same process is tracing already, this
+    one only records times.
+    """
+    def __init__(self, cpu_clock: Callable[[], float] = time.thread_time, isolated: bool = False,
+                 on_done: Optional[Callable[[dict], None]] = None):
+        self.cpu_clock = cpu_clock
+        self.isolated = isolated
+        self.on_done = on_done
+        self.profile: Dict = {}
+        self._tracing = False
+        self._started_tracing = False
+        self._baseline = None
+        self._traced_before = 0
+
+    def __enter__(self):
+        self._tracing = _tracing.acquire(blocking=False)
+        if self._tracing:
+            if tracemalloc.is_tracing():
+                # traced for someone else (PYTHONTRACEMALLOC), only count what the call adds
+                self._baseline = tracemalloc.take_snapshot()
+            else:
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            self._traced_before = tracemalloc.get_traced_memory()[0]
+        self._cpu = self.cpu_clock()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall_ms = (time.perf_counter() - self._wall) * 1000
+        cpu_ms = (self.cpu_clock() - self._cpu) * 1000
+        self.profile = {
+            "wall_ms": round(wall_ms, 2),
+            "cpu_ms": round(cpu_ms, 2),
+            "peak_memory_kb": None,
+            "top_allocations": [],
+            "isolated": self.isolated,
+        }
+        if self._tracing:
+            try:
+                peak = tracemalloc.get_traced_memory()[1] - self._traced_before
+                self.profile["peak_memory_kb"] = round(max(peak, 0) / 1024, 1)
+                self.profile["top_allocations"] = self._top_allocations(tracemalloc.take_snapshot())
+            finally:
+                if self._started_tracing:
+                    tracemalloc.stop()
+                _tracing.release()
+        if self.on_done is not None:
+            self.on_done(self.profile)
+        return False
+
+    def _top_allocations(self, snapshot: tracemalloc.Snapshot) -> list:
+        if self._baseline is not None:
+            stats = [(s.traceback[0], s.size_diff, s.count_diff)
+                     for s in snapshot.compare_to(self._baseline, "lineno") if s.size_diff > 0]
+        else:
+            stats = [(s.traceback[0], s.size, s.count) for s in snapshot.statistics("lineno")]
+        top = []
+        for frame, size, count in stats:
+            if frame.filename in _IGNORED_FILES:
+                continue
+            top.append({"file": frame.filename, "line": frame.lineno,
+                        "size_kb": round(size / 1024, 1), "count": count})
+            if len(top) == settings.PROFILE_TOP_ALLOCATIONS:
+                break
+        return top
+
+
+def run_measured(measurement: Measurement, func: Callable, *args, **kwargs):
+    """Calls `func` inside `measurement`, for handlers run on an executor thread."""
+    with measurement:
+        return func(*args, **kwargs)
+
+
+class TaskProfiler:
+    """
+    A task picked for profiling by `ProfileWriter.sample`. execute_dynamic_task
+    measures the handler call with `measure()` (or in the pool process, which
+    sends back its measurement to `measured`) and calls `record` once the task
+    finished.
+    """
+    def __init__(self, writer: "ProfileWriter", task_id: int):
+        self._writer = writer
+        self.task_id = task_id
+        self.profile: Dict = {}
+
+    def measure(self, cpu_clock: Callable[[], float] = time.thread_time) -> Measurement:
+        return Measurement(cpu_clock, on_done=self.measured)
+
+    def measured(self, profile: dict):
+        self.profile = profile
+
+    def record(self, task_title: str, ok: bool, wall_ms: float):
+        """
+        Stores the profile of the task. `wall_ms` is measured around the whole
+        run and only used when the handler call itself was not measured to the
+        end (it timed out).
+        """
+        entry = {
+            "task_id": self.task_id,
+            "worker_id": self._writer.worker_id,
+            "recorded_at": time.time(),
+            "ok": ok,
+            "wall_ms": round(wall_ms, 2),
+            "cpu_ms": None,
+            "peak_memory_kb": None,
+            "top_allocations": [],
+            "isolated": False,
+        }
+        entry.update(self.profile)
+        self._writer.record(task_title, entry)
+
+
+class ProfileWriter:
+    """
+    Picks PROFILE_SAMPLE_RATE of the tasks run by the worker for profiling and
+    stores their profiles per task file (see core/profiles.py). A task that is not
+    picked costs one random number; with the rate at 0 (default) not even that.
+    Profiles are written in the background, one pipelined call each.
+    """
+    def __init__(self, worker_id: str, sample_rate: float = None):
+        self.worker_id = worker_id
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.redis = None
+        self._writes: Set[asyncio.Task] = set()
+
+    def start(self, redis_client):
+        self.redis = redis_client
+
+    def sample(self, task_id: int) -> Optional[TaskProfiler]:
+        """A TaskProfiler if this task is to be profiled, otherwise None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return TaskProfiler(self, task_id)
+
+    def record(self, task_title: str, entry: dict):
+        if self.redis is None:
+            return
+        write = asyncio.create_task(self._write(task_title, entry))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+
+    async def _write(self, task_title: str, entry: dict):
+        key = profiles_key(task_title)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lpush(key, codec.encode(entry))
+                pipe.ltrim(key, 0, settings.PROFILE_HISTORY_SIZE - 1)
+                pipe.expire(key, settings.PROFILE_TTL_SECONDS)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to store the profile of task {entry['task_id']}: {e}")
+
+    async def stop(self):
+        """Waits for the profiles still being written."""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from core.config import settings
+from core.progress import progress_key
+
+logger = logging.getLogger(__name__)
+
+# done, total, message, reported at (epoch seconds)
+ProgressState = Tuple[float, Optional[float], Optional[str], float]
+
+
+def progress_state(done, total=None, message=None) -> ProgressState:
+    return (
+        float(done),
+        None if total is None else float(total),
+        None if message is None else str(message)[:500],
+        time.time(),
+    )
+
+
+class ProgressReporter:
+    """
+    The `progress` callback passed to a handler that declares a `progress`
+    parameter: `progress(done, total=None, message=None)`. Calling it only records
+    the latest values, it never waits for Redis, so handlers can call it as often
+    as they like from the event loop or a thread.
+    """
+    def __init__(self, writer: "ProgressWriter", task_id: int):
+        self._writer = writer
+        self.task_id = task_id
+
+    def __call__(self, done, total=None, message=None):
+        self._writer.report(self.task_id, progress_state(done, total, message))
+
+    def report_state(self, state: ProgressState):
+        """Records a report made in a pool process, which sends the already built state."""
+        self._writer.report(self.task_id, state)
+
+
+class ProgressWriter:
+    """
+    Coalesces progress reports of all tasks in the worker. Every
+    PROGRESS_FLUSH_INTERVAL_MS the latest report of each task that reported since
+    the last flush is written with one pipelined call, so a task costs Redis at
+    most one write per interval however often its handler reports.
+    """
+    def __init__(self, flush_interval: float = None):
+        if flush_interval is None:
+            flush_interval = settings.PROGRESS_FLUSH_INTERVAL_MS / 1000
+        self.flush_interval = flush_interval
+        self.redis = None
+        self._pending: Dict[int, ProgressState] = {}
+        # reports come from handler threads as well as the event loop
+        self._lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._running = False
+
+    async def start(self, redis_client):
+        self.redis = redis_client
+        self._running = True
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def reporter(self, task_id: int) -> ProgressReporter:
+        return ProgressReporter(self, task_id)
+
+    def report(self, task_id: int, state: ProgressState):
+        with self._lock:
+            self._pending[task_id] = state
+
+    async def _flush_loop(self):
+        while self._running:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"Failed to write task progress: {e}")
+
+    async def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        ttl = settings.RESULT_TTL_SECONDS
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for task_id, (done, total, message, updated_at) in batch.items():
+                entry = {"done": done, "updated_at": updated_at}
+                if total is not None:
+                    entry["total"] = total
+                if message is not None:
+                    entry["message"] = message
+                key = progress_key(task_id)
+                pipe.delete(key)
+                pipe.hset(key, mapping=entry)
+                pipe.expire(key, ttl)
+            await pipe.execute()
+
+    async def stop(self):
+        """Writes the last reports and stops the background task."""
+        if not self._flusher:
+            return
+        self._running = False
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        try:
+            await self._flush()
+        except Exception as e:
+            logger.error(f"Failed to write task progress on shutdown: {e}")
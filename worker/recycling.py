@@ -0,0 +1,84 @@
+import os
+import random
+import time
+from typing import Optional
+
+from core.config import settings
+
+# Exit code of a worker that stopped to be recycled, restarted right away by the supervisor
+RECYCLE_EXIT_CODE = 75
+# /proc is read at most this often when checking the RSS limit after tasks
+RSS_CHECK_INTERVAL_S = 1.0
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (ValueError, OSError, AttributeError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process from /proc/self/statm, None where there is no /proc."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def metrics_key(worker_id: str) -> str:
+    return f"worker:{worker_id}:metrics"
+
+
+class RecyclePolicy:
+    """
+    Decides when a long lived worker process should be replaced: after
+    WORKER_MAX_TASKS finished tasks or once its RSS is above WORKER_MAX_RSS_MB
+    (0 disables either). The task limit gets up to 10% random jitter so the
+    processes of a deployment do not all drain at the same moment.
+    """
+    def __init__(self, max_tasks: int = None, max_rss_mb: int = None):
+        max_tasks = settings.WORKER_MAX_TASKS if max_tasks is None else max_tasks
+        max_rss_mb = settings.WORKER_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        self.max_tasks = int(max_tasks * (1 + random.uniform(0, 0.1))) if max_tasks > 0 else 0
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.tasks_done = 0
+        self.started_at = time.time()
+        self.start_rss = current_rss_bytes()
+        self.rss = self.start_rss
+        self._rss_checked_at = 0.0
+
+    def sample_rss(self) -> Optional[int]:
+        self.rss = current_rss_bytes()
+        self._rss_checked_at = time.monotonic()
+        return self.rss
+
+    def task_done(self) -> Optional[str]:
+        """Counts a finished task, returns why the worker should recycle or None."""
+        self.tasks_done += 1
+        if self.max_tasks and self.tasks_done >= self.max_tasks:
+            return f"ran {self.tasks_done} tasks (WORKER_MAX_TASKS)"
+        if self.max_rss and time.monotonic() - self._rss_checked_at >= RSS_CHECK_INTERVAL_S:
+            return self.check_memory()
+        return None
+
+    def check_memory(self) -> Optional[str]:
+        rss = self.sample_rss()
+        if self.max_rss and rss and rss >= self.max_rss:
+            return f"RSS {rss // (1024 * 1024)} MB reached WORKER_MAX_RSS_MB"
+        return None
+
+    def snapshot(self) -> dict:
+        """Values published in the worker's metrics hash."""
+        mb = 1024 * 1024
+        metrics = {
+            "tasks_done": self.tasks_done,
+            "started_at": round(self.started_at, 3),
+            "updated_at": round(time.time(), 3),
+        }
+        if self.rss is not None and self.start_rss is not None:
+            metrics["rss_mb"] = round(self.rss / mb, 1)
+            metrics["rss_start_mb"] = round(self.start_rss / mb, 1)
+            metrics["rss_growth_mb"] = round((self.rss - self.start_rss) / mb, 1)
+            if self.tasks_done:
+                metrics["rss_growth_kb_per_task"] = round((self.rss - self.start_rss) / 1024 / self.tasks_done, 2)
+        return metrics
@@ -0,0 +1,12 @@
+"""
+Starts the task file validator (worker/validator.py): `python -m worker.run_validator`.
+
+multiprocessing imports the main module again in every sandbox it starts, so
+this one imports nothing unless it runs as the program. Sandboxes must not load
+the settings or a Redis client.
+"""
+
+if __name__ == "__main__":
+    from worker.validator import TaskFileValidator
+
+    TaskFileValidator().start()
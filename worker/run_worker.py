@@ -0,0 +1,13 @@
+"""
+Starts one worker process (worker/main.py): `python -m worker.run_worker`, which
+is what worker.supervisor runs for each of its processes.
+
+multiprocessing imports the main module again in every process pool child it
+starts, so this one imports nothing unless it runs as the program. A new child
+then costs a fork, not the worker's imports and logging setup.
+"""
+
+if __name__ == "__main__":
+    from worker.main import run
+
+    run()
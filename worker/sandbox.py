@@ -0,0 +1,382 @@
+import asyncio
+import ctypes
+import errno
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import platform
+import queue
+import resource
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sandboxes are forked from a fork server that already imported this module, so a
+# new one costs a fork instead of an interpreter start. Each one checks a single
+# upload and exits, no state of one task file can leak into the next. Only this
+# module is preloaded: it imports nothing from core, so neither the settings nor a
+# Redis client are in a sandbox's memory.
+_CONTEXT = multiprocessing.get_context("forkserver")
+_CONTEXT.set_forkserver_preload(["worker.sandbox"])
+
+# name -> (rlimit, bytes per unit)
+_RLIMITS = {
+    "memory_mb": (resource.RLIMIT_AS, 1024 * 1024),
+    "cpu_seconds": (resource.RLIMIT_CPU, 1),
+    "open_files": (resource.RLIMIT_NOFILE, 1),
+}
+# environment a task file sees while it is checked
+_SANDBOX_ENV = ("PATH", "LANG", "LC_ALL", "PYTHONPATH", "PYTHONUNBUFFERED")
+
+# seccomp filter of a sandbox, see _deny_network
+_PR_SET_SECCOMP = 22
+_PR_SET_DUMPABLE = 4
+_PR_SET_NO_NEW_PRIVS = 38
+_SECCOMP_MODE_FILTER = 2
+_SECCOMP_RET_KILL_PROCESS = 0x80000000
+_SECCOMP_RET_ERRNO = 0x00050000
+_SECCOMP_RET_ALLOW = 0x7FFF0000
+_X32_SYSCALL_BIT = 0x40000000
+_IO_URING_SETUP = 425
+# machine -> (AUDIT_ARCH, number of the socket syscall)
+_SECCOMP_ARCH = {
+    "x86_64": (0xC000003E, 41),
+    "aarch64": (0xC00000B7, 198),
+}
+
+
+class SandboxError(Exception):
+    """The sandbox itself failed, the upload it was given says nothing about that."""
+
+
+class _Rejected(Exception):
+    pass
+
+
+class _CpuLimitExceeded(BaseException):
+    # BaseException so a broad `except Exception` in the task file does not swallow it
+    pass
+
+
+def _raise_cpu_exceeded(signum, frame):
+    raise _CpuLimitExceeded()
+
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_ushort), ("jt", ctypes.c_ubyte), ("jf", ctypes.c_ubyte), ("k", ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.POINTER(_SockFilter))]
+
+
+def _prctl(option: int, *args):
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(option, *args, *[ctypes.c_ulong(0)] * (4 - len(args))) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, f"prctl({option}) failed: {os.strerror(error)}")
+
+
+def _deny_network():
+    """
+    Installs a seccomp filter that fails socket() for every family but AF_UNIX,
+    and io_uring, which can open sockets too. It holds for this process and all it
+    starts and cannot be lifted again, so the task file cannot reach Redis or
+    anything else on the pod's network. Raises OSError where it cannot be installed.
+    """
+    if platform.machine() not in _SECCOMP_ARCH:
+        raise OSError(f"No seccomp filter for {platform.machine()}")
+    audit_arch, socket_call = _SECCOMP_ARCH[platform.machine()]
+    denied = _SECCOMP_RET_ERRNO | errno.EACCES
+    # classic BPF over struct seccomp_data: nr at 0, arch at 4, args[0] at 16
+    program = [
+        (0x20, 0, 0, 4),                        # A = arch
+        (0x15, 1, 0, audit_arch),               # other ABIs are killed
+        (0x06, 0, 0, _SECCOMP_RET_KILL_PROCESS),
+        (0x20, 0, 0, 0),                        # A = syscall number
+        (0x35, 0, 1, _X32_SYSCALL_BIT),         # x32 calls are refused
+        (0x06, 0, 0, denied),
+        (0x15, 0, 1, _IO_URING_SETUP),
+        (0x06, 0, 0, denied),
+        (0x15, 0, 3, socket_call),
+        (0x20, 0, 0, 16),                       # A = socket family
+        (0x15, 1, 0, socket.AF_UNIX),
+        (0x06, 0, 0, denied),
+        (0x06, 0, 0, _SECCOMP_RET_ALLOW),
+    ]
+    filters = (_SockFilter * len(program))(*program)
+    fprog = _SockFprog(len(program), filters)
+    _prctl(_PR_SET_NO_NEW_PRIVS, ctypes.c_ulong(1))
+    _prctl(_PR_SET_SECCOMP, ctypes.c_ulong(_SECCOMP_MODE_FILTER), ctypes.byref(fprog))
+
+
+def protect_secrets():
+    """
+    Call once in the process that uses a SandboxPool, after its settings were read
+    and before it starts sandboxes or other threads. The fork server, and so every
+    sandbox, inherits its environment: all but _SANDBOX_ENV is dropped from it,
+    the Redis password included. The process is also made non-dumpable, so
+    sandboxes cannot read its memory or initial environment through /proc.
+    """
+    kept = {name: os.environ[name] for name in _SANDBOX_ENV if name in os.environ}
+    os.environ.clear()
+    os.environ.update(kept)
+    _prctl(_PR_SET_DUMPABLE, ctypes.c_ulong(0))
+
+
+def _confine(workdir: str, limits: Dict[str, int], uid: int):
+    """
+    Runs in the sandbox before it gets the upload: an empty working directory, a
+    minimal environment, hard limits the task file cannot raise again, no network
+    and, with `uid` 0 or above, that unprivileged user instead of the validator's.
+    As that user it can neither write the shared volume nor signal the validator.
+    """
+    os.chdir(workdir)
+    kept = {name: os.environ[name] for name in _SANDBOX_ENV if name in os.environ}
+    os.environ.clear()
+    os.environ.update(kept, HOME=workdir, TMPDIR=workdir)
+    for name, value in limits.items():
+        rlimit, unit = _RLIMITS[name]
+        if name == "cpu_seconds":
+            # SIGXCPU at the soft limit is reported, the hard limit a second later kills
+            signal.signal(signal.SIGXCPU, _raise_cpu_exceeded)
+            resource.setrlimit(rlimit, (value, value + 1))
+        else:
+            resource.setrlimit(rlimit, (value * unit, value * unit))
+    if uid >= 0:
+        os.setgroups([])
+        os.setgid(uid)
+        os.setuid(uid)
+        # the other sandboxes run as the same user, keep them from tracing this one
+        _prctl(_PR_SET_DUMPABLE, ctypes.c_ulong(0))
+    _deny_network()
+
+
+def _describe(title: str, error: BaseException) -> str:
+    line = None
+    tb = error.__traceback__
+    while tb is not None:
+        if tb.tb_frame.f_code.co_filename == f"{title}.py":
+            line = tb.tb_lineno
+        tb = tb.tb_next
+    message = f"{type(error).__name__}: {error}"
+    return f"{message} (line {line})" if line else message
+
+
+def _takes(func, name: str) -> bool:
+    try:
+        return name in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _ignore_progress(done, total=None, message=None):
+    pass
+
+
+def _run_payloads(namespace: dict, payloads) -> int:
+    """
+    Calls the handler once per entry of the file's VALIDATION_PAYLOADS, wrapped
+    like the payload of a real task, between init() and teardown() when defined.
+    """
+    if not isinstance(payloads, (list, tuple)):
+        raise _Rejected("VALIDATION_PAYLOADS must be a list")
+    handler = namespace["handler"]
+    init = namespace.get("init")
+    teardown = namespace.get("teardown")
+    context = init() if callable(init) else None
+    try:
+        for index, data in enumerate(payloads):
+            kwargs = {}
+            if _takes(handler, "progress"):
+                kwargs["progress"] = _ignore_progress
+            if _takes(handler, "context"):
+                kwargs["context"] = context
+            payload = {"data": data, "_run_id": f"validation-{index}"}
+            if inspect.iscoroutinefunction(handler):
+                result = asyncio.run(handler(payload, **kwargs))
+            else:
+                result = handler(payload, **kwargs)
+            try:
+                json.dumps(result, default=str)
+            except (TypeError, ValueError) as e:
+                raise _Rejected(f"Result for VALIDATION_PAYLOADS[{index}] cannot be stored: {e}")
+    finally:
+        if callable(teardown):
+            try:
+                takes_context = bool(inspect.signature(teardown).parameters)
+            except (TypeError, ValueError):
+                takes_context = False
+            if takes_context:
+                teardown(context)
+            else:
+                teardown()
+    return len(payloads)
+
+
+def _check(title: str, source: str) -> dict:
+    """Imports the file like a worker does and runs its VALIDATION_PAYLOADS."""
+    started = time.perf_counter()
+    module = types.ModuleType(title)
+    module.__file__ = f"{title}.py"
+    exec(compile(source, module.__file__, "exec"), module.__dict__)
+    imported = time.perf_counter()
+
+    namespace = module.__dict__
+    if not callable(namespace.get("handler")):
+        raise _Rejected("'handler' is not callable")
+    for name in ("handler_batch", "init", "teardown"):
+        if name in namespace and not callable(namespace[name]):
+            raise _Rejected(f"'{name}' is defined but not callable")
+
+    runs = 0
+    if "VALIDATION_PAYLOADS" in namespace:
+        runs = _run_payloads(namespace, namespace["VALIDATION_PAYLOADS"])
+    return {
+        "import_ms": round((imported - started) * 1000, 2),
+        "run_ms": round((time.perf_counter() - imported) * 1000, 2),
+        "payloads_run": runs,
+    }
+
+
+def _sandbox_main(conn, workdir: str, limits: Dict[str, int], uid: int):
+    """Entry point of a sandbox: confine, wait for one upload, check it, answer, exit."""
+    try:
+        _confine(workdir, limits, uid)
+    except OSError as e:
+        # never runs an upload unconfined
+        conn.send_bytes(pickle.dumps(("unconfined", str(e))))
+        return
+    try:
+        title, source = pickle.loads(conn.recv_bytes())
+    except (EOFError, OSError):
+        return
+    try:
+        response = ("ok", _check(title, source))
+    except _Rejected as e:
+        response = ("rejected", str(e))
+    except _CpuLimitExceeded:
+        response = ("rejected", f"CPU time limit exceeded ({limits.get('cpu_seconds')}s)")
+    except MemoryError:
+        response = ("rejected", f"Memory limit exceeded ({limits.get('memory_mb')} MB)")
+    except BaseException as e:
+        response = ("rejected", _describe(title, e))
+    try:
+        conn.send_bytes(pickle.dumps(response))
+    except Exception as e:
+        conn.send_bytes(pickle.dumps(("rejected", f"Check result cannot be sent: {e}")))
+
+
+class Sandbox:
+    """One started sandbox process, waiting for the upload it will check."""
+
+    def __init__(self, limits: Dict[str, int], uid: int = -1):
+        self.limits = limits
+        self.workdir = tempfile.mkdtemp(prefix="taskflow-sandbox-")
+        if uid >= 0:
+            os.chown(self.workdir, uid, uid)
+        self.conn, child_conn = _CONTEXT.Pipe()
+        self.process = _CONTEXT.Process(
+            target=_sandbox_main, args=(child_conn, self.workdir, limits, uid), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def run(self, title: str, source: str, timeout: float) -> Tuple[bool, str, dict]:
+        """
+        Checks one upload, returns (accepted, message, details). Raises SandboxError
+        if the sandbox was gone before it got the upload or could not be confined.
+        """
+        try:
+            self.conn.send_bytes(pickle.dumps((title, source)))
+        except OSError as e:
+            raise SandboxError(f"Sandbox exited before use: {e}")
+
+        if not self.conn.poll(timeout):
+            return False, f"Timed out after {timeout:g}s", {}
+        try:
+            status, value = pickle.loads(self.conn.recv_bytes())
+        except (EOFError, OSError):
+            return False, self._exit_reason(), {}
+        if status == "unconfined":
+            raise SandboxError(f"Sandbox could not be confined: {value}")
+        if status == "ok":
+            return True, "Task file passed validation", value
+        return False, value, {}
+
+    def _exit_reason(self) -> str:
+        self.process.join(1)
+        code = self.process.exitcode
+        if code in (-signal.SIGXCPU, -signal.SIGKILL) and "cpu_seconds" in self.limits:
+            return f"Killed after exceeding the CPU time limit ({self.limits['cpu_seconds']}s)"
+        if code is not None and code < 0:
+            return f"Killed by signal {signal.Signals(-code).name}"
+        return f"Exited with code {code} while being checked"
+
+    def close(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class SandboxPool:
+    """
+    Keeps `size` sandboxes started ahead of time. A check takes an idle one and a
+    replacement is started in the background, so uploads never wait for a
+    process to come up while the pool keeps up with them.
+    """
+
+    def __init__(self, size: int, limits: Dict[str, int], uid: int = -1):
+        self.size = max(1, size)
+        self.limits = {name: value for name, value in limits.items() if value > 0}
+        self.uid = uid
+        self._idle: "queue.Queue[Sandbox]" = queue.Queue()
+        self._refill = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sandbox-refill")
+        self._closed = threading.Event()
+        for _ in range(self.size):
+            self._idle.put(Sandbox(self.limits, self.uid))
+
+    def _replace(self):
+        while not self._closed.is_set():
+            try:
+                self._idle.put(Sandbox(self.limits, self.uid))
+                return
+            except Exception as e:
+                logger.error(f"Failed to start a sandbox: {e}")
+                self._closed.wait(1)
+
+    def validate(self, title: str, source: str, timeout: float) -> Tuple[bool, str, dict]:
+        """Checks one upload in a pre-started sandbox, see Sandbox.run."""
+        for attempt in range(2):
+            sandbox = self._idle.get()
+            self._refill.submit(self._replace)
+            try:
+                return sandbox.run(title, source, timeout)
+            except SandboxError:
+                if attempt:
+                    raise
+                logger.warning("Sandbox was gone before use, retrying with another one")
+            finally:
+                sandbox.close()
+
+    def close(self):
+        self._closed.set()
+        self._refill.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,56 @@
+import os
+import time
+from typing import Dict, Optional
+
+try:
+    _CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+except (ValueError, OSError, AttributeError):
+    _CLOCK_TICKS = 100
+
+
+def process_started_at() -> Optional[float]:
+    """
+    Epoch seconds at which this process was started, from /proc (10 ms
+    resolution), so interpreter start and imports are counted too. None where
+    there is no /proc.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after the command name, which may itself contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - int(fields[19]) / _CLOCK_TICKS
+        return time.time() - max(age, 0.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupClock:
+    """
+    Cold start of a worker process, measured from process start:
+
+    - `startup_imported_ms`: modules imported, the worker object is being built
+    - `startup_ready_ms`: connections warmed, the first claim is sent
+    - `cold_start_ms`: the first task was claimed. On an idle queue this also
+      counts the wait for that task; `startup_ready_ms` is the startup cost alone.
+
+    Published in `worker:{id}:metrics` with the other worker metrics.
+    """
+    def __init__(self):
+        self.started_at = process_started_at() or time.time()
+        self._marks: Dict[str, float] = {}
+        self.mark("startup_imported_ms")
+
+    def mark(self, name: str) -> bool:
+        """Records `name` once, returns False if it was recorded before."""
+        if name in self._marks:
+            return False
+        self._marks[name] = round((time.time() - self.started_at) * 1000, 1)
+        return True
+
+    def get(self, name: str) -> Optional[float]:
+        return self._marks.get(name)
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(self._marks)
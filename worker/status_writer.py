@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Integer, String, cast, column, func, update, values
+
+from core.config import settings
+from core import database
+from core.models import Tasks, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# statuses a worker never changes again, e.g. a duplicate delivery or an API cancel won the race
+FINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.EXPIRED, TaskStatus.CANCELLED)
+
+
+class StatusWriter:
+    """
+    Write-behind buffer for task status changes made by a worker.
+
+    Transitions from all tasks running in the process are collected for
+    `flush_interval` seconds and written with a single
+    `UPDATE tasks ... FROM (VALUES ...)` on the async engine, so the DB sees one
+    short transaction per batch instead of two per task, and the writes never wait
+    behind sync handlers in the default executor. Only the last status of a task
+    within a batch is written, a task that starts and finishes between two flushes
+    costs one row.
+    """
+    def __init__(self, flush_interval: float = None, max_batch: int = None):
+        if flush_interval is None:
+            flush_interval = settings.STATUS_FLUSH_INTERVAL_MS / 1000
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch or settings.STATUS_FLUSH_MAX_BATCH
+        # task_id -> (status, worker_id), insertion order is the write order
+        self._pending: Dict[int, Tuple[str, Optional[str]]] = {}
+        # futures resolved once the write they wait for is committed
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._running = False
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def set_status(self, task_id: int, status: str, worker_id: str = None, wait: bool = True):
+        """
+        Queues a status change. With `wait` (the default) returns once it is
+        committed, use it for final states that must be durable before the
+        message is acked. Without it the call returns immediately.
+        """
+        if not self._running:
+            raise RuntimeError("Status writer is not running")
+
+        previous = self._pending.get(task_id)
+        if worker_id is None and previous:
+            # keep the worker_id of an IN_PROGRESS that has not been written yet
+            worker_id = previous[1]
+        self._pending.pop(task_id, None)
+        self._pending[task_id] = (status, worker_id)
+
+        future = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(task_id, []).append(future)
+        self._wakeup.set()
+        if future:
+            await asyncio.shield(future)
+
+    async def _flush_loop(self):
+        backoff = self.flush_interval
+        while self._running or self._pending:
+            if not self._pending:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if not self._pending:
+                    continue
+            # let other tasks add their transitions to this batch
+            if self._running and len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.flush_interval)
+
+            try:
+                await self._flush()
+                backoff = self.flush_interval
+            except Exception:
+                logger.exception(f"Status flush failed, retrying in {backoff:.2f}s")
+                if not self._running:
+                    # stop() gave up waiting for the DB, fail the callers instead of hanging
+                    self._fail_waiters(RuntimeError("Status writer stopped before the write was committed"))
+                    return
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5)
+
+    async def _flush(self):
+        batch = list(self._pending.items())[: self.max_batch]
+        rows = [(task_id, status, worker_id) for task_id, (status, worker_id) in batch]
+
+        v = values(
+            column("id", Integer), column("status", String), column("worker_id", String),
+            name="v",
+        ).data(rows)
+        stmt = (
+            update(Tasks)
+            .where(Tasks.id == v.c.id)
+            # a final status stays, whatever the worker saw: a task cancelled through the
+            # API stays CANCELLED, a duplicate delivery never overwrites COMPLETED
+            .where(Tasks.status.notin_(FINAL_STATUSES))
+            .values(
+                status=cast(v.c.status, Tasks.status.type),
+                worker_id=func.coalesce(v.c.worker_id, Tasks.worker_id),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        async with database.AsyncSessionLocal() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+        for task_id, entry in batch:
+            # a newer status queued while we were writing stays pending
+            if self._pending.get(task_id) is entry:
+                del self._pending[task_id]
+                for future in self._waiters.pop(task_id, []):
+                    if not future.done():
+                        future.set_result(None)
+
+    def _fail_waiters(self, error: Exception):
+        for futures in self._waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+        self._waiters.clear()
+
+    async def stop(self, timeout: float = 10):
+        """Flushes everything still pending, then stops the background writer."""
+        if not self._flusher:
+            return
+        self._running = False
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._flusher, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Dropping {len(self._pending)} unwritten status changes on shutdown")
+            self._fail_waiters(RuntimeError("Status writer stopped before the write was committed"))
+        self._flusher = None
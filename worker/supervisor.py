@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+import uuid
+
+from core.config import settings
+from core.redis_client import get_async_redis_client
+from .recycling import RECYCLE_EXIT_CODE
+
+logger = logging.getLogger(__name__)
+
+# a child that ran at least this long is restarted without backoff
+STABLE_RUN_SECONDS = 60
+MAX_RESTART_BACKOFF_SECONDS = 30
+
+
+class _Child:
+    def __init__(self, index: int):
+        self.index = index
+        self.worker_id = None
+        self.process = None
+        self.started_at = 0.0
+        self.backoff = 1
+
+
+class WorkerSupervisor:
+    """
+    Runs WORKER_PROCESSES `worker.run_worker` processes in one pod so a pod can use more
+    than one core for Python work.
+
+    Children are started as fresh interpreters (not forked from the supervisor), so
+    each has its own Redis and DB pools. Each gets its own worker_id through the
+    WORKER_ID variable, and a new one after a restart so its previous tasks are
+    recovered like those of any dead worker. The supervisor keeps the heartbeat of
+    every running child with one pipelined call; children do not beat themselves
+    (WORKER_SUPERVISED). A child that exits is restarted, with an exponential
+    backoff if it keeps crashing, a recycled one (RECYCLE_EXIT_CODE) right away. SIGTERM is forwarded to all children, which
+    drain as usual, and the supervisor exits once they are gone.
+    """
+    command = (sys.executable, "-m", "worker.run_worker")
+
+    def __init__(self, processes: int = settings.WORKER_PROCESSES):
+        self.children = [_Child(i) for i in range(max(1, processes))]
+        self.running = True
+        self.redis = None
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        self.redis = await get_async_redis_client("high")
+        logger.info(f"Worker supervisor starting {len(self.children)} worker processes")
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            await asyncio.gather(*(self._run_child(child) for child in self.children))
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            await self.redis.aclose()
+        logger.info("Worker supervisor stopped")
+
+    async def _spawn(self, child: _Child):
+        child.worker_id = str(uuid.uuid4())[:8]
+        env = dict(os.environ, WORKER_ID=child.worker_id, WORKER_SUPERVISED="1")
+        child.process = await asyncio.create_subprocess_exec(*self.command, env=env)
+        child.started_at = time.monotonic()
+        if not self.running:
+            # shutdown was requested while it was starting
+            child.process.send_signal(signal.SIGTERM)
+        logger.info(f"Started worker:{child.worker_id} (pid {child.process.pid}, slot {child.index})")
+
+    async def _run_child(self, child: _Child):
+        """Keeps one worker process running until shutdown."""
+        while self.running:
+            await self._spawn(child)
+            # beat right away, the PEL scanner only trusts workers with a heartbeat
+            await self._beat()
+            code = await child.process.wait()
+            await self._forget(child)
+            if not self.running:
+                break
+
+            if code == RECYCLE_EXIT_CODE:
+                # planned replacement (WORKER_MAX_TASKS / WORKER_MAX_RSS_MB), not a crash
+                logger.info(f"Worker:{child.worker_id} recycled, starting a fresh one")
+                child.backoff = 1
+                continue
+            if time.monotonic() - child.started_at >= STABLE_RUN_SECONDS:
+                child.backoff = 1
+            logger.warning(f"Worker:{child.worker_id} exited with code {code}, "
+                           f"restarting in {child.backoff}s")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=child.backoff)
+            except asyncio.TimeoutError:
+                pass
+            child.backoff = min(child.backoff * 2, MAX_RESTART_BACKOFF_SECONDS)
+
+    def _alive(self):
+        return [c for c in self.children if c.process and c.process.returncode is None]
+
+    async def _beat(self):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for child in self._alive():
+                    pipe.set(f"worker:{child.worker_id}:heartbeat", "alive", ex=settings.HEARTBEAT_TTL_SECONDS)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Supervisor heartbeat failed: {e}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await self._beat()
+            await asyncio.sleep(settings.HEARTBEAT_INTERVAL_SECONDS)
+
+    async def _forget(self, child: _Child):
+        """Drops the heartbeat of an exited child so its tasks are recovered right away."""
+        try:
+            await self.redis.delete(f"worker:{child.worker_id}:heartbeat")
+        except Exception as e:
+            logger.error(f"Failed to remove heartbeat of worker:{child.worker_id}: {e}")
+
+    def request_shutdown(self):
+        """Forwards SIGTERM to every child; they drain and the supervisor exits after them."""
+        if not self.running:
+            return
+        self.running = False
+        self._stopping.set()
+        for child in self._alive():
+            child.process.send_signal(signal.SIGTERM)
+        logger.info("Worker supervisor draining workers...")
+
+
+async def main():
+    supervisor = WorkerSupervisor()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, supervisor.request_shutdown)
+    await supervisor.start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - [Supervisor] - %(levelname)s - %(message)s',
+    )
+    asyncio.run(main())
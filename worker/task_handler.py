@@ -4,23 +4,169 @@ import os
 import logging
 import inspect
 import asyncio
-from typing import Callable, Optional, Tuple, Any
+import contextlib
+import functools
+import marshal
+import time
+import types
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple, Any
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.task_files import blob_key, code_from_blob, current_key, is_valid_title
+from .lifecycle import TaskContext
+from .profiling import run_measured
 
 logger = logging.getLogger(__name__)
 TASKS_DIR = "/app/worker/tasks"
 TASK_TIMEOUT_SECONDS = 180  # 3 minutes
+HANDLER_CACHE_SIZE = 64  # task files kept loaded per worker process
+
+# title -> (file version, handler), least recently used first
+_handler_cache: "OrderedDict[str, Tuple[Any, Callable]]" = OrderedDict()
+# title -> (published hash or None, monotonic time the lookup expires)
+_versions: Dict[str, Tuple[Optional[str], float]] = {}
+# hashes whose code is known to be in the node-local cache
+_local_code = set()
+# title -> init/teardown state of the cached version
+_contexts: Dict[str, TaskContext] = {}
+# handler -> names of its parameters, goes away with the handler when its file is replaced
+_parameters: "weakref.WeakKeyDictionary[Callable, frozenset]" = weakref.WeakKeyDictionary()
+
+
+def _file_version(stat: os.stat_result) -> tuple:
+    """
+    Identifies one upload of a task file. Uploads replace the file atomically,
+    so a new version always has a new inode even when mtime has coarse resolution.
+    """
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _code_path(digest: str) -> str:
+    return os.path.join(settings.TASK_CACHE_DIR, f"{digest}.code")
+
+
+def _write_code(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def resolve_task_file(redis_client, task_title: str) -> Optional[str]:
+    """
+    Returns the hash of the published version of a task file once its code is in
+    the node-local cache, or None when it has to be read from the shared volume
+    (never published, or Redis unavailable). The current version of a title is
+    looked up at most once per TASK_FILE_VERSION_TTL_MS, the code once per hash.
+    """
+    now = time.monotonic()
+    cached = _versions.get(task_title)
+    try:
+        if cached and cached[1] > now:
+            digest = cached[0]
+        else:
+            digest = await redis_client.get(current_key(task_title))
+            _versions[task_title] = (digest, now + settings.TASK_FILE_VERSION_TTL_MS / 1000)
+        if not digest or digest in _local_code:
+            return digest
+
+        path = _code_path(digest)
+        if not os.path.exists(path):
+            blob = await redis_client.hgetall(blob_key(digest))
+            if not blob:
+                logger.warning(f"Published code of '{task_title}' ({digest[:12]}) is gone, using the shared volume")
+                return None
+            data = code_from_blob(task_title, blob)
+            await asyncio.get_running_loop().run_in_executor(None, _write_code, path, data)
+        _local_code.add(digest)
+        return digest
+    except RedisError as e:
+        logger.error(f"Failed to resolve task file '{task_title}': {e}, using the shared volume")
+        return None
+
+
+def _load_published(task_title: str, digest: str) -> Callable:
+    with open(_code_path(digest), "rb") as f:
+        code = marshal.loads(f.read())
+    module = types.ModuleType(task_title)
+    module.__file__ = os.path.join(TASKS_DIR, f"{task_title}.py")
+    exec(code, module.__dict__)
+    return module.handler
+
+
+def _forget(task_title: str):
+    _handler_cache.pop(task_title, None)
+    context = _contexts.pop(task_title, None)
+    if context:
+        context.retire()
+
+
+def _remember(task_title: str, version, handler: Callable):
+    _forget(task_title)
+    _handler_cache[task_title] = (version, handler)
+    _contexts[task_title] = TaskContext(task_title, handler.__globals__)
+    while len(_handler_cache) > HANDLER_CACHE_SIZE:
+        _forget(next(iter(_handler_cache)))
+
+
+def task_context(task_title: str) -> Optional[TaskContext]:
+    """init/teardown state of the version of `task_title` last returned by load_task_handler."""
+    return _contexts.get(task_title)
+
+
+def teardown_all():
+    """Tears down every loaded task file, on worker or pool process shutdown."""
+    for task_title in list(_handler_cache):
+        _forget(task_title)
 
 
-def load_task_handler(task_title: str) -> Tuple[Optional[Callable], Optional[str]]:
+def load_task_handler(task_title: str, digest: Optional[str] = None) -> Tuple[Optional[Callable], Optional[str]]:
+    """
+    Returns the `handler` of a task file. Loaded handlers are kept in an LRU cache.
+    With the `digest` from `resolve_task_file` the code comes from the node-local
+    cache, otherwise from the shared volume, where a single stat() tells whether
+    the file changed since it was loaded.
+    """
+    if not is_valid_title(task_title):
+        # tasks created before titles were checked, never a path outside TASKS_DIR
+        return None, "Invalid task title"
+    if digest:
+        cached = _handler_cache.get(task_title)
+        if cached and cached[0] == digest:
+            _handler_cache.move_to_end(task_title)
+            return cached[1], None
+        logger.info(f"Loading task file: title='{task_title}', version={digest[:12]}")
+        try:
+            handler_func = _load_published(task_title, digest)
+        except AttributeError:
+            return None, "Missing 'handler' function"
+        except Exception as e:
+            return None, str(e)
+        _remember(task_title, digest, handler_func)
+        return handler_func, None
+
     file_path = os.path.join(TASKS_DIR, f"{task_title}.py")
-    
-    logger.info(f"[DEBUG] Loading task: title='{task_title}', path='{file_path}'")
-    logger.info(f"[DEBUG] TASKS_DIR='{TASKS_DIR}', exists={os.path.exists(file_path)}")
 
-    if not os.path.exists(file_path):
+    try:
+        version = _file_version(os.stat(file_path))
+    except FileNotFoundError:
         logger.error(f"File not found: {file_path}")
+        _forget(task_title)
         return None, "File not found"
 
+    cached = _handler_cache.get(task_title)
+    if cached and cached[0] == version:
+        _handler_cache.move_to_end(task_title)
+        return cached[1], None
+
+    logger.info(f"Loading task file: title='{task_title}', path='{file_path}'")
+
     # --- FIX FOR ZOMBIE MODULES ---
     # If the module was loaded before, remove it from the cache
     if task_title in sys.modules:
@@ -37,40 +183,149 @@ def load_task_handler(task_title: str) -> Tuple[Optional[Callable], Optional[str
 
         if hasattr(module, "handler"):
             handler_func = getattr(module, "handler")
+            _remember(task_title, version, handler_func)
             return handler_func, None
         return None, "Missing 'handler' function"
 
     except Exception as e:
         return None, str(e)
 
-async def execute_dynamic_task(task_title: str, payload: dict) -> Any:
-    handler, error = load_task_handler(task_title)
+def accepts_argument(handler: Callable, name: str) -> bool:
+    """
+    Handlers opt in to extras by declaring them: `progress` for progress
+    reporting, `context` for the value returned by the file's init().
+    """
+    try:
+        parameters = _parameters[handler]
+    except (KeyError, TypeError):
+        try:
+            parameters = frozenset(inspect.signature(handler).parameters)
+        except (TypeError, ValueError):
+            parameters = frozenset()
+        with contextlib.suppress(TypeError):
+            # callables that can't be weakly referenced are inspected on every call
+            _parameters[handler] = parameters
+    return name in parameters
+
+
+def handler_kwargs(handler: Callable, progress=None, context: Optional[TaskContext] = None) -> dict:
+    """Extra keyword arguments for one call of `handler`; `context` must be ready."""
+    kwargs = {}
+    if progress is not None and accepts_argument(handler, "progress"):
+        kwargs["progress"] = progress
+    if context is not None and accepts_argument(handler, "context"):
+        kwargs["context"] = context.value
+    return kwargs
+
+
+def batch_handler(handler: Callable) -> Optional[Callable]:
+    """The `handler_batch(payloads)` defined next to `handler` in its task file, if any."""
+    batch = getattr(handler, "__globals__", {}).get("handler_batch")
+    return batch if callable(batch) else None
+
+
+async def execute_dynamic_task(task_title: str, payload: dict, process_pool=None, redis_client=None,
+                               batcher=None, progress=None, profiler=None) -> Any:
+    """
+    Runs the task file's handler with a timeout. Async handlers run on the event loop,
+    sync handlers on the default thread pool, or in `process_pool` when one is given
+    so CPU-bound code escapes the GIL and a timed out handler is actually killed.
+    With `redis_client` (high instance) the published version of the file is used.
+    With `batcher`, files that define `handler_batch` get the payload grouped with
+    other tasks of the same title instead (see worker/batching.py).
+    `progress` is passed to handlers that take a `progress` argument.
+    With `profiler` (a TaskProfiler, for tasks sampled by worker/profiling.py)
+    the handler call is measured and its profile stored.
+    """
+    digest = await resolve_task_file(redis_client, task_title) if redis_client else None
+    handler, error = load_task_handler(task_title, digest)
     
     if error:
         raise Exception(f"Loading Error: {error}")
+    context = task_context(task_title)
+
+    if batcher is not None and batch_handler(handler):
+        max_size = handler.__globals__.get("BATCH_MAX_SIZE", settings.TASK_BATCH_MAX_SIZE)
+        return await batcher.submit(task_title, digest, payload, int(max_size))
 
     # DEBUG: Log the payload type and content
     logger.info(f"[DEBUG] Payload type: {type(payload)}")
     logger.info(f"[DEBUG] Payload content: {payload}")
 
+    if profiler is None:
+        return await _run_with_timeout(task_title, handler, payload, process_pool, digest,
+                                       progress=progress, context=context)
+
+    started = time.perf_counter()
+    ok = False
+    try:
+        result = await _run_with_timeout(task_title, handler, payload, process_pool, digest,
+                                         progress=progress, context=context, profiler=profiler)
+        ok = True
+        return result
+    finally:
+        profiler.record(task_title, ok, (time.perf_counter() - started) * 1000)
+
+
+async def execute_dynamic_batch(task_title: str, digest: Optional[str], payloads: list, process_pool=None) -> list:
+    """Runs `handler_batch(payloads)` of the task file once, with the same timeout as a single task."""
+    handler, error = load_task_handler(task_title, digest)
+    if error:
+        raise Exception(f"Loading Error: {error}")
+    handler_batch = batch_handler(handler)
+    if handler_batch is None:
+        raise Exception("Loading Error: Missing 'handler_batch' function")
+    return await _run_with_timeout(task_title, handler_batch, payloads, process_pool, digest, batch=True,
+                                   context=task_context(task_title))
+
+
+async def _run_with_timeout(task_title: str, handler: Callable, payload, process_pool, digest,
+                            batch=False, progress=None, context: Optional[TaskContext] = None,
+                            profiler=None):
     try:
         # --- TIMEOUT PROTECTION ---
         # Wrap task execution with a timeout to prevent infinite loops
         logger.info(f"Starting task '{task_title}' with {TASK_TIMEOUT_SECONDS}s timeout")
-        
-        if inspect.iscoroutinefunction(handler):
-            # Async handler with timeout
-            result = await asyncio.wait_for(
-                handler(payload),
-                timeout=TASK_TIMEOUT_SECONDS
-            )
+        loop = asyncio.get_event_loop()
+
+        if process_pool is not None and not inspect.iscoroutinefunction(handler):
+            # Sync handler - run in a pool process that is killed on timeout,
+            # the file's init() runs in that process
+            if not accepts_argument(handler, "progress"):
+                progress = None
+            result = await process_pool.run(task_title, payload, TASK_TIMEOUT_SECONDS, digest, batch, progress,
+                                            profiler.measured if profiler else None)
         else:
-            # Sync handler - run in executor with timeout
-            loop = asyncio.get_event_loop()
-            result = await asyncio.wait_for(
-                loop.run_in_executor(None, handler, payload),
-                timeout=TASK_TIMEOUT_SECONDS
-            )
+            if context is not None:
+                # keeps teardown() from running while this call initializes or uses the context
+                context.acquire()
+            try:
+                if context is not None and not context.ready:
+                    try:
+                        await loop.run_in_executor(None, context.get)
+                    except Exception as e:
+                        raise Exception(f"init() of '{task_title}' failed: {e}")
+                kwargs = handler_kwargs(handler, progress, context)
+                if inspect.iscoroutinefunction(handler):
+                    # Async handler with timeout, its CPU time is the process's while it ran
+                    measurement = profiler.measure(time.process_time) if profiler else contextlib.nullcontext()
+                    with measurement:
+                        result = await asyncio.wait_for(
+                            handler(payload, **kwargs),
+                            timeout=TASK_TIMEOUT_SECONDS
+                        )
+                else:
+                    # Sync handler - run in executor with timeout
+                    call = functools.partial(handler, payload, **kwargs)
+                    if profiler:
+                        call = functools.partial(run_measured, profiler.measure(), call)
+                    result = await asyncio.wait_for(
+                        loop.run_in_executor(None, call),
+                        timeout=TASK_TIMEOUT_SECONDS
+                    )
+            finally:
+                if context is not None:
+                    context.release()
         
         logger.info(f"Task '{task_title}' completed successfully")
         return result
@@ -81,4 +336,4 @@ async def execute_dynamic_task(task_title: str, payload: dict) -> Any:
         raise Exception(error_msg)
     except Exception as e:
         logger.error(f"Runtime error in {task_title}: {e}")
-        raise e
\ No newline at end of file
+        raise e
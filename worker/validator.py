@@ -0,0 +1,228 @@
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+
+import redis
+
+from core.config import settings
+from core.redis_client import get_redis_client
+from core import task_files
+from .sandbox import SandboxError, SandboxPool, protect_secrets
+from .task_handler import TASKS_DIR
+
+os.makedirs("logs", exist_ok=True)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - [Validator] - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/validator.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# how often the processing list is checked for validations of dead validators
+RECOVERY_INTERVAL_SECONDS = 30
+
+
+def processing_key(queue_name: str) -> str:
+    return f"{queue_name}:processing"
+
+
+class TaskFileValidator:
+    """
+    Consumes TASK_VALIDATION_QUEUE_NAME on the high-priority instance and checks
+    each staged upload in a pre-started sandbox (worker/sandbox.py) before it is
+    promoted: published to Redis for the workers and written to the shared volume.
+
+    VALIDATOR_CONCURRENCY threads each check one upload at a time. An id is moved
+    to `{queue}:processing` while it is checked, so the ids of a validator that
+    died are queued again by any other one once they are clearly stale.
+    """
+    def __init__(self, concurrency: int = settings.VALIDATOR_CONCURRENCY):
+        self.validator_id = str(uuid.uuid4())[:8]
+        self.redis = get_redis_client("high")
+        self.queue_name = settings.TASK_VALIDATION_QUEUE_NAME
+        self.processing = processing_key(self.queue_name)
+        self.concurrency = max(1, concurrency)
+        self.timeout = settings.VALIDATION_TIMEOUT_SECONDS
+        self.pool = None
+        self.running = True
+        # PENDING ids seen in the processing list by the last recovery pass
+        self._unclaimed = set()
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+
+    def shutdown(self, signum, frame):
+        logger.info("Shutting down validator...")
+        self.running = False
+
+    def consume_loop(self):
+        while self.running:
+            try:
+                validation_id = self.redis.blmove(self.queue_name, self.processing, 1, "RIGHT", "LEFT")
+            except redis.RedisError as e:
+                logger.error(f"Failed to read the validation queue: {e}")
+                time.sleep(1)
+                continue
+            if validation_id is None:
+                continue
+            try:
+                self.validate(validation_id)
+            except redis.RedisError as e:
+                # left in the processing list, recovery queues it again
+                logger.error(f"Redis error while validating {validation_id}: {e}")
+            except Exception:
+                logger.exception(f"Validation {validation_id} failed unexpectedly")
+                try:
+                    self._finish(validation_id, None, task_files.VALIDATION_REJECTED,
+                                 "Validation failed unexpectedly, please upload the file again")
+                except redis.RedisError as e:
+                    logger.error(f"Failed to record the outcome of {validation_id}: {e}")
+
+    def validate(self, validation_id: str):
+        record = task_files.get_validation(self.redis, validation_id)
+        if record is None or record.get("status") in task_files.VALIDATION_FINAL:
+            # expired, or finished by a validator that died before it could clean up
+            self.redis.lrem(self.processing, 1, validation_id)
+            return
+
+        title = record["title"]
+        staged_path = record["staged_path"]
+        self.redis.hset(task_files.validation_key(validation_id), mapping={
+            "status": task_files.VALIDATION_RUNNING,
+            "started_at": round(time.time(), 3),
+            "validator": self.validator_id,
+        })
+
+        try:
+            with open(staged_path, "rb") as f:
+                source = f.read()
+        except OSError:
+            self._finish(validation_id, staged_path, task_files.VALIDATION_REJECTED,
+                         "The staged upload is gone, please upload the file again")
+            return
+        try:
+            digest, code = task_files.compile_task_file(title, source)
+        except task_files.TaskFileError as e:
+            self._finish(validation_id, staged_path, task_files.VALIDATION_REJECTED, str(e))
+            return
+        if digest != record.get("digest"):
+            self._finish(validation_id, staged_path, task_files.VALIDATION_REJECTED,
+                         "The staged upload was modified, please upload the file again")
+            return
+
+        started = time.perf_counter()
+        try:
+            accepted, message, details = self.pool.validate(title, source.decode("utf-8"), self.timeout)
+        except SandboxError as e:
+            logger.error(f"No usable sandbox for {validation_id}: {e}")
+            return
+        details["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        if not accepted:
+            logger.info(f"Rejected upload {validation_id} of '{title}': {message}")
+            self._finish(validation_id, staged_path, task_files.VALIDATION_REJECTED, message, details)
+            return
+
+        promoted = task_files.promote_task_file(
+            self.redis, title, source, code, digest, int(record["upload_seq"])
+        )
+        if promoted:
+            self._write_task_file(title, source, digest)
+        else:
+            message = f"{message}, but a later upload of '{title}' is already live"
+        details["promoted"] = int(promoted)
+        logger.info(f"Validated upload {validation_id} of '{title}' in {details['duration_ms']} ms")
+        self._finish(validation_id, staged_path, task_files.VALIDATION_VALIDATED, message, details)
+
+    def _write_task_file(self, title: str, source: bytes, digest: str):
+        """
+        Keeps the shared volume in step with Redis. The copy there is only the
+        fallback for workers, so it is skipped if another upload was promoted meanwhile.
+        """
+        if self.redis.get(task_files.current_key(title)) != digest:
+            return
+        file_path = os.path.join(TASKS_DIR, f"{title}.py")
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(source)
+            os.replace(tmp_path, file_path)
+        except OSError as e:
+            logger.error(f"Failed to write {file_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _finish(self, validation_id: str, staged_path, status: str, message: str, details: dict = None):
+        entry = {"status": status, "message": message, "finished_at": round(time.time(), 3)}
+        entry.update(details or {})
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(task_files.validation_key(validation_id), mapping=entry)
+            pipe.lrem(self.processing, 1, validation_id)
+            pipe.execute()
+        if staged_path:
+            try:
+                os.remove(staged_path)
+            except OSError:
+                pass
+
+    def recovery_loop(self):
+        while self.running:
+            try:
+                self.requeue_stale()
+            except redis.RedisError as e:
+                logger.error(f"Failed to check for stale validations: {e}")
+            for _ in range(RECOVERY_INTERVAL_SECONDS):
+                if not self.running:
+                    break
+                time.sleep(1)
+
+    def requeue_stale(self):
+        """
+        Queues ids of validators that died again. A RUNNING one is stale once it
+        started well over VALIDATION_TIMEOUT_SECONDS ago; a PENDING one was taken
+        but never started, which is only sure once it is still PENDING a pass later.
+        """
+        cutoff = time.time() - (self.timeout * 3 + RECOVERY_INTERVAL_SECONDS)
+        unclaimed = set()
+        for validation_id in self.redis.lrange(self.processing, 0, -1):
+            record = task_files.get_validation(self.redis, validation_id)
+            status = record.get("status") if record else None
+            if status == task_files.VALIDATION_PENDING and validation_id not in self._unclaimed:
+                unclaimed.add(validation_id)
+                continue
+            if status == task_files.VALIDATION_RUNNING and float(record.get("started_at", 0)) > cutoff:
+                continue
+            if self.redis.lrem(self.processing, 1, validation_id) and status not in (None, *task_files.VALIDATION_FINAL):
+                logger.warning(f"Requeueing stale validation {validation_id}")
+                self.redis.rpush(self.queue_name, validation_id)
+        self._unclaimed = unclaimed
+
+    def start(self):
+        limits = {
+            "memory_mb": settings.VALIDATION_MAX_MEMORY_MB,
+            "cpu_seconds": settings.VALIDATION_MAX_CPU_SECONDS,
+            "open_files": settings.VALIDATION_MAX_OPEN_FILES,
+        }
+        protect_secrets()
+        self.pool = SandboxPool(self.concurrency, limits, settings.VALIDATION_SANDBOX_UID)
+        logger.info(f"Validator {self.validator_id} online with {self.concurrency} sandboxes.")
+        consumers = [threading.Thread(target=self.consume_loop, daemon=True) for _ in range(self.concurrency)]
+        for t in consumers:
+            t.start()
+        threading.Thread(target=self.recovery_loop, daemon=True).start()
+        while self.running:
+            time.sleep(1)
+        for t in consumers:
+            t.join(timeout=self.timeout + 5)
+        self.pool.close()
+
+
+if __name__ == "__main__":
+    # every sandbox would import this module again as its main module
+    raise SystemExit("Start the validator with `python -m worker.run_validator`")